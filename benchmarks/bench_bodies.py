@@ -0,0 +1,136 @@
+"""
+Gateway peak memory while large bodies stream through it concurrently.
+
+Starts a gateway (gateway_server.py) in front of an upstream running in this process,
+then sends `--concurrency` chunked uploads of `--size-mb` each at the same time, then
+downloads of JSON documents of the same size. The gateway's RSS is sampled every 20ms
+and the peak growth over its idle RSS is reported per phase, with the throughput.
+With `--transform` downloads go through the streaming JSON redaction; `--buffered`
+reads whole bodies into memory instead, for comparison.
+
+    python -m benchmarks.bench_bodies --concurrency 20 --size-mb 50 --transform
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+import uvicorn
+
+from benchmarks.load_test import BENCH_DIR, REPO_ROOT, free_port, rss_mb, wait_for_port
+
+CHUNK = 64 * 1024
+ROW = b'{"id":12345,"name":"item name","secret":"0123456789abcdef"},'
+BLOCK = ROW * (CHUNK // len(ROW))
+
+
+async def upstream(scope, receive, send) -> None:
+    """PUT drains the body; GET streams a JSON document of ?bytes=N."""
+    if scope['method'] == 'PUT':
+        more = True
+        while more:
+            message = await receive()
+            more = message.get('more_body', False)
+        await send({'type': 'http.response.start', 'status': 204, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    size = int(scope['query_string'].decode().partition('=')[2])
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': b'{"items":[', 'more_body': True})
+    for _ in range(size // len(BLOCK)):
+        await send({'type': 'http.response.body', 'body': BLOCK, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b'{"id":0}]}'})
+
+
+async def upload(client: httpx.AsyncClient, size: int) -> None:
+    async def body():
+        for _ in range(size // CHUNK):
+            yield bytes(CHUNK)
+
+    resp = await client.put('/r0/', content=body())
+    resp.raise_for_status()
+
+
+async def download(client: httpx.AsyncClient, size: int) -> None:
+    async with client.stream('GET', '/r0/', params={'bytes': size},
+                             headers={'accept-encoding': 'identity'}) as resp:
+        resp.raise_for_status()
+        async for _ in resp.aiter_raw():
+            pass
+
+
+async def phase(run, pid: int, idle: float) -> dict:
+    """Run `run()`, sampling the gateway's RSS until it finishes."""
+    peak = idle
+    task = asyncio.ensure_future(run())
+    started = time.perf_counter()
+    while not task.done():
+        peak = max(peak, rss_mb(pid) or 0.0)
+        await asyncio.wait([task], timeout=0.02)
+    await task
+    return {'seconds': round(time.perf_counter() - started, 2),
+            'peak_rss_growth_mb': round(peak - idle, 1)}
+
+
+async def run(args: argparse.Namespace) -> dict:
+    upstream_port, gateway_port = free_port(), free_port()
+    server = uvicorn.Server(uvicorn.Config(upstream, host='127.0.0.1', port=upstream_port,
+                                           lifespan='off', log_level='warning'))
+    serving = asyncio.ensure_future(server.serve())
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(
+        filter(None, [str(REPO_ROOT), str(BENCH_DIR), os.environ.get('PYTHONPATH')]))}
+    command = [sys.executable, str(BENCH_DIR / 'gateway_server.py'),
+               '--port', str(gateway_port), '--upstream', f"http://127.0.0.1:{upstream_port}",
+               '--max-body-bytes', str(args.size_mb * 2 << 20)]
+    command += ['--transform'] * args.transform + ['--buffered'] * args.buffered
+    gateway = subprocess.Popen(command, cwd=REPO_ROOT, env=env)
+    size = args.size_mb << 20
+    total_mb = args.concurrency * args.size_mb
+    try:
+        await asyncio.to_thread(wait_for_port, gateway_port, gateway)
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{gateway_port}",
+                                     limits=limits, timeout=None) as client:
+            await upload(client, CHUNK)         # imports and pools settle first
+            await download(client, CHUNK)
+            idle = rss_mb(gateway.pid) or 0.0
+
+            uploads = await phase(lambda: asyncio.gather(
+                *(upload(client, size) for _ in range(args.concurrency))), gateway.pid, idle)
+            downloads = await phase(lambda: asyncio.gather(
+                *(download(client, size) for _ in range(args.concurrency))), gateway.pid, idle)
+    finally:
+        gateway.terminate()
+        try:
+            gateway.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            gateway.kill()
+            gateway.wait()
+        server.should_exit = True
+        await serving
+
+    for result in (uploads, downloads):
+        result['mb/s'] = round(total_mb / result['seconds'], 1)
+    return {'concurrency': args.concurrency, 'size_mb': args.size_mb,
+            'transform': args.transform, 'buffered': args.buffered,
+            'idle_rss_mb': round(idle, 1), 'uploads': uploads, 'downloads': downloads}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--size-mb', type=int, default=50, help='bytes per body, in MiB')
+    parser.add_argument('--transform', action='store_true',
+                        help='redact a member of every item in downloads')
+    parser.add_argument('--buffered', action='store_true', help='buffer bodies in the gateway')
+    print(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == '__main__':
+    main()
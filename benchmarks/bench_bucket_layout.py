@@ -0,0 +1,134 @@
+"""
+Redis memory per bucket key and script throughput: current token_bucket.lua layout
+(one string, SET PX, no write on denial) against the {tokens, last_ts} hash it replaced.
+
+Requires a running Redis (REDIS_URL, default redis://localhost:6379). Memory figures
+use MEMORY USAGE and INFO; they are left out when the server does not support them.
+Keys are written under a 'bench:layout:' prefix and removed afterwards.
+
+    python -m benchmarks.bench_bucket_layout --keys 100000 --pipeline 500
+"""
+import argparse
+import asyncio
+import time
+from os import getenv
+
+from redis.asyncio import Redis
+
+from gateway.rate_limit import LUA
+
+# token_bucket.lua before the compact layout: HMSET + PEXPIRE on every call
+LEGACY_LUA = """
+local bucket_key = KEYS[1]
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+
+local state = redis.call('HMGET', bucket_key, 'tokens', 'last_ts')
+local tokens = tonumber(state[1])
+local last_timestamp = tonumber(state[2])
+if tokens == nil then
+	tokens = capacity
+	last_timestamp = now
+end
+
+local elapsed = math.max(0, (now - last_timestamp) / 1000.0)
+tokens = math.min(capacity, tokens + elapsed * rate)
+
+local allowed = tokens >= requested
+if allowed then
+	tokens = tokens - requested
+end
+
+redis.call('HMSET', bucket_key, 'tokens', tokens, 'last_ts', now)
+redis.call('PEXPIRE', bucket_key, math.ceil((capacity / rate) * 1000))
+
+return { (allowed and 1) or 0, tokens }
+"""
+
+LAYOUTS = {'legacy': LEGACY_LUA, 'compact': LUA}
+
+
+async def used_memory(redis: Redis) -> int | None:
+    try:
+        return (await redis.info('memory'))['used_memory']
+    except Exception:
+        return None
+
+
+async def memory_usage(redis: Redis, keys: list[str]) -> float | None:
+    try:
+        sizes = [await redis.memory_usage(key, samples=0) for key in keys]
+    except Exception:
+        return None
+    return sum(sizes) / len(sizes)
+
+
+async def drive(redis: Redis, sha: str, keys: list[str], capacity: int, pipeline: int) -> float:
+    """EVALSHA once per key in pipelined batches; returns calls per second."""
+    started = time.perf_counter()
+    for start in range(0, len(keys), pipeline):
+        async with redis.pipeline(transaction=False) as pipe:
+            now_ms = int(time.time() * 1000)
+            for key in keys[start:start + pipeline]:
+                pipe.evalsha(sha, 1, key, capacity, 0.001, now_ms, 1)
+            await pipe.execute()
+    return len(keys) / (time.perf_counter() - started)
+
+
+async def clear(redis: Redis, prefix: str) -> None:
+    batch = []
+    async for key in redis.scan_iter(match=prefix + '*', count=1000):
+        batch.append(key)
+        if len(batch) >= 1000:
+            await redis.delete(*batch)
+            batch.clear()
+    if batch:
+        await redis.delete(*batch)
+
+
+async def run(redis: Redis, layout: str, args) -> dict:
+    prefix = f"bench:layout:{layout}:"
+    keys = [f"{prefix}{{k{i}}}:global" for i in range(args.keys)]
+    sha = await redis.script_load(LAYOUTS[layout])
+    await clear(redis, prefix)
+
+    before = await used_memory(redis)
+    # capacity 1: the first call on each key spends its only token, the second is denied
+    allowed_rate = await drive(redis, sha, keys, 1, args.pipeline)
+    after = await used_memory(redis)
+    denied_rate = await drive(redis, sha, keys, 1, args.pipeline)
+
+    result = {
+        'layout': layout,
+        'allowed calls/s': round(allowed_rate),
+        'denied calls/s': round(denied_rate),
+        'bytes/key (MEMORY USAGE)': await memory_usage(redis, keys[:args.sample]),
+        'bytes/key (used_memory)': None if before is None or after is None
+                                   else round((after - before) / args.keys, 1),
+    }
+    await clear(redis, prefix)
+    return result
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--keys', type=int, default=100000)
+    parser.add_argument('--pipeline', type=int, default=500, help='calls per round trip')
+    parser.add_argument('--sample', type=int, default=100,
+                        help='keys measured with MEMORY USAGE')
+    parser.add_argument('--layouts', nargs='+', default=list(LAYOUTS), choices=list(LAYOUTS))
+    args = parser.parse_args()
+
+    redis = Redis.from_url(getenv("REDIS_URL", "redis://localhost:6379"))
+    try:
+        for layout in args.layouts:
+            print(await run(redis, layout, args))
+    finally:
+        await redis.aclose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+"""
+Per-request cost of header filtering: the raw (bytes, bytes) pipeline vs. the
+str/dict rebuild it replaced.
+
+Times the request side (forward_request_headers, including the httpx.Headers build
+where the str round trip used to be paid again) and the response side
+(response_headers) against the legacy implementations, best of `--repeat` runs.
+
+    python -m benchmarks.bench_headers --number 20000
+"""
+import argparse
+import timeit
+
+from httpx import Headers
+from starlette.datastructures import MutableHeaders
+
+from gateway.headers import forward_request_headers, response_headers
+
+CLIENT_HEADERS = [
+    (b'host', b'api.example.com'),
+    (b'user-agent', b'Mozilla/5.0 (X11; Linux x86_64)'),
+    (b'accept', b'application/json'),
+    (b'accept-encoding', b'gzip, br'),
+    (b'cookie', b'a=1'),
+    (b'cookie', b'b=2'),
+    (b'authorization', b'Bearer abc.def.ghi'),
+    (b'x-request-id', b'8d7f2c'),
+    (b'connection', b'keep-alive'),
+    (b'x-forwarded-for', b'10.0.0.1'),
+]
+
+UPSTREAM_HEADERS = [
+    (b'content-type', b'application/json'),
+    (b'content-length', b'512'),
+    (b'cache-control', b'max-age=60'),
+    (b'set-cookie', b'a=1'),
+    (b'set-cookie', b'b=2'),
+    (b'connection', b'keep-alive'),
+    (b'x-request-id', b'8d7f2c'),
+]
+
+
+def legacy_request_headers(raw):
+    """The dict rebuild forward_request_headers replaced."""
+    hop_by_hop_headers = {b'connection', b'keep-alive', b'proxy-authentication',
+                          b'proxy-authorization', b'te', b'trailers', b'transfer-encoding',
+                          b'upgrade'}
+    headers = dict()
+    for k, v in raw:
+        if k == b'host':
+            headers['X-Forwarded-Host'] = v.decode('latin-1')
+        elif k not in hop_by_hop_headers:
+            headers[k.decode('latin-1')] = v.decode('latin-1')
+    headers['X-Forwarded-Proto'] = 'http'
+    headers['X-Real-IP'] = '1.2.3.4'
+    return headers
+
+
+def legacy_response_headers(upstream: Headers):
+    """The dict rebuild response_headers replaced."""
+    excluded = {'content-encoding', 'transfer-encoding', 'connection'}
+    return {k: v for k, v in upstream.items() if k.lower() not in excluded}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=20000, help='calls per run')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    def best_us(func) -> float:
+        runs = timeit.repeat(func, number=args.number, repeat=args.repeat)
+        return round(min(runs) / args.number * 1e6, 2)
+
+    upstream = Headers(UPSTREAM_HEADERS)
+    cases = {
+        'request': (lambda: Headers(legacy_request_headers(CLIENT_HEADERS)),
+                    lambda: Headers(forward_request_headers(CLIENT_HEADERS, '1.2.3.4', 'http'))),
+        'response': (lambda: MutableHeaders(headers=legacy_response_headers(upstream)),
+                     lambda: response_headers(upstream.raw)),
+    }
+    for side, (legacy, raw) in cases.items():
+        print({'headers': side, 'dict rebuild us': best_us(legacy), 'raw us': best_us(raw)})
+
+
+if __name__ == '__main__':
+    main()
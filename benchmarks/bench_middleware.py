@@ -0,0 +1,97 @@
+"""
+Per-request overhead of RateLimitMiddleware: BaseHTTPMiddleware vs pure ASGI.
+
+Drives the ASGI apps directly (no server, no sockets) with FakeRateLimiter, so the
+numbers isolate middleware cost.
+
+    python -m benchmarks.bench_middleware --requests 20000
+"""
+import argparse
+import asyncio
+import time
+
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+from gateway.middleware import RateLimitMiddleware
+from gateway.testing.fake_limiter import FakeRateLimiter
+
+
+class LegacyRateLimitMiddleware(BaseHTTPMiddleware):
+    """The BaseHTTPMiddleware implementation RateLimitMiddleware replaced."""
+    def __init__(self, app, capacity: int = 50, rate: float = 1.0):
+        super().__init__(app)
+        self.capacity = capacity
+        self.rate = rate
+
+    async def dispatch(self, request: Request, call_next):
+        limiter = request.app.state.limiter
+        api_key = request.headers.get('x-api-key') or request.client.host
+        allowed, remaining_tokens = await limiter.allow(
+            f"rl:{api_key}:global", capacity=self.capacity, rate=self.rate,
+        )
+        if not allowed:
+            return JSONResponse(
+                status_code=429,
+                content={"detail": "Rate limit exceeded"},
+                headers={"X-RateLimit-Remaining": str(int(remaining_tokens))},
+            )
+        response = await call_next(request)
+        response.headers["X-RateLimit-Remaining"] = str(int(remaining_tokens))
+        return response
+
+
+async def endpoint(request: Request):
+    return PlainTextResponse("ok")
+
+
+def build(middleware) -> Starlette:
+    app = Starlette(routes=[Route("/", endpoint)])
+    app.add_middleware(middleware)
+    app.state.limiter = FakeRateLimiter()
+    return app
+
+
+async def drive(app: Starlette, requests: int) -> float:
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0', 'spec_version': '2.4'},
+        'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'path': '/',
+        'raw_path': b'/', 'root_path': '', 'query_string': b'',
+        'headers': [(b'host', b'gateway'), (b'x-api-key', b'bench')],
+        'client': ('127.0.0.1', 40000), 'server': ('127.0.0.1', 8000),
+    }
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+        app.state.limiter.calls.clear()
+    return time.perf_counter() - start
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+
+    for name, middleware in (('BaseHTTPMiddleware', LegacyRateLimitMiddleware),
+                             ('pure ASGI', RateLimitMiddleware)):
+        app = build(middleware)
+        await drive(app, 500)  # warm-up
+        elapsed = await drive(app, args.requests)
+        print({'middleware': name,
+               'requests/s': round(args.requests / elapsed),
+               'us/request': round(elapsed / args.requests * 1e6, 1)})
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
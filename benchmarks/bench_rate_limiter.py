@@ -0,0 +1,134 @@
+"""
+Redis round trips and latency per rate-limit decision, per limiter mode.
+
+Requires a running Redis (REDIS_URL, default redis://localhost:6379). With --shards,
+buckets are spread over those nodes by a ShardedRateLimiter, to check how decisions/s
+scale with the number of shards.
+
+    python -m benchmarks.bench_rate_limiter --requests 20000 --concurrency 200 --keys 100
+    python -m benchmarks.bench_rate_limiter --shards redis://r1:6379 redis://r2:6379
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from os import getenv
+
+from redis.asyncio import Redis
+
+from gateway.rate_limit import (RateLimiter, BatchingRateLimiter, LeasedRateLimiter,
+                                ShardedRateLimiter, bucket_key)
+
+
+class CountingRateLimiter(RateLimiter):
+    """RateLimiter that counts script evaluations and network round trips."""
+    def __init__(self, redis_client: Redis):
+        super().__init__(redis_client)
+        self.redis_ops = 0
+        self.round_trips = 0
+
+    async def _evalsha(self, script: str, keys: tuple[str, ...], args: tuple):
+        self.redis_ops += 1
+        self.round_trips += 1
+        return await super()._evalsha(script, keys, args)
+
+
+class CountingBatchingRateLimiter(BatchingRateLimiter):
+    def __init__(self, redis_client: Redis, **kwargs):
+        super().__init__(redis_client, **kwargs)
+        self.redis_ops = 0
+        self.round_trips = 0
+
+    async def _send(self, batch):
+        self.redis_ops += len(batch)
+        self.round_trips += 1
+        return await super()._send(batch)
+
+
+def build_shard(mode: str, redis: Redis, args):
+    if mode == 'batched':
+        return CountingBatchingRateLimiter(redis,
+                                           max_delay=args.batch_delay_ms / 1000,
+                                           max_batch=args.max_batch)
+    if mode in ('direct', 'leased'):
+        return CountingRateLimiter(redis)
+    raise ValueError(mode)
+
+
+def build(mode: str, clients: list[Redis], args) -> tuple[object, list]:
+    counters = [build_shard(mode, redis, args) for redis in clients]
+    limiter = counters[0] if len(counters) == 1 else ShardedRateLimiter(counters)
+    if mode == 'leased':
+        limiter = LeasedRateLimiter(limiter, max_drift=args.max_drift)
+    return limiter, counters
+
+
+async def run(mode: str, clients: list[Redis], args) -> dict:
+    limiter, counters = build(mode, clients, args)
+    await limiter.load()
+    for redis in clients:
+        await redis.flushdb()
+
+    latencies: list[float] = []
+    denied = 0
+    queue = iter(range(args.requests))
+
+    async def worker():
+        nonlocal denied
+        for i in queue:
+            key = bucket_key(f"bench-{mode}-{i % args.keys}", 'global')
+            start = time.perf_counter()
+            allowed, _ = await limiter.allow(key, args.capacity, args.rate)
+            latencies.append(time.perf_counter() - start)
+            denied += not allowed
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    if hasattr(limiter, 'close'):
+        await limiter.close()
+
+    redis_ops = sum(counter.redis_ops for counter in counters)
+    round_trips = sum(counter.round_trips for counter in counters)
+    latencies.sort()
+    return {
+        'mode': mode,
+        'shards': len(clients),
+        'decisions/s': round(args.requests / elapsed),
+        'redis ops/request': round(redis_ops / args.requests, 4),
+        'round trips/request': round(round_trips / args.requests, 4),
+        'p50 ms': round(statistics.median(latencies) * 1000, 3),
+        'p99 ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+        'denied': denied,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--keys', type=int, default=100)
+    parser.add_argument('--capacity', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=100.0)
+    parser.add_argument('--max-drift', type=int, default=20)
+    parser.add_argument('--batch-delay-ms', type=float, default=1.0)
+    parser.add_argument('--max-batch', type=int, default=128)
+    parser.add_argument('--modes', nargs='+', default=['direct', 'leased', 'batched'])
+    parser.add_argument('--shards', nargs='+', metavar='URL',
+                        help='Redis nodes to shard buckets over (default: REDIS_URL alone)')
+    args = parser.parse_args()
+
+    urls = args.shards or [getenv("REDIS_URL", "redis://localhost:6379")]
+    clients = [Redis.from_url(url) for url in urls]
+    try:
+        for mode in args.modes:
+            print(await run(mode, clients, args))
+    finally:
+        for redis in clients:
+            await redis.aclose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+"""
+Gateway memory per open WebSocket tunnel, and message round trips through them.
+
+Starts a gateway (gateway_server.py) in front of a WebSocket echo server running in
+this process, opens `--tunnels` connections through it and reports the gateway's RSS
+growth per tunnel, then the round-trip rate with one message in flight per tunnel.
+Every tunnel is three sockets on this host, so the open-files limit is raised as far
+as the hard limit allows.
+
+    python -m benchmarks.bench_tunnels --tunnels 5000 --rounds 10
+"""
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from websockets.asyncio.client import connect
+from websockets.asyncio.server import serve
+
+from benchmarks.load_test import BENCH_DIR, REPO_ROOT, free_port, rss_mb, wait_for_port
+
+
+def raise_open_files_limit() -> int:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        soft = hard if hard != resource.RLIM_INFINITY else 1 << 20
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    return soft
+
+
+async def echo(connection) -> None:
+    async for message in connection:
+        await connection.send(message)
+
+
+async def open_tunnels(url: str, count: int, batch: int = 200) -> list:
+    clients = []
+    for start in range(0, count, batch):
+        clients += await asyncio.gather(*(connect(url, compression=None, ping_interval=None)
+                                          for _ in range(min(batch, count - start))))
+    return clients
+
+
+async def round_trips(clients: list, rounds: int, payload: bytes) -> float:
+    async def one(client) -> None:
+        for _ in range(rounds):
+            await client.send(payload)
+            await client.recv()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(client) for client in clients))
+    return len(clients) * rounds / (time.perf_counter() - started)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    async with serve(echo, '127.0.0.1', 0, compression=None, ping_interval=None) as upstream:
+        upstream_port = upstream.sockets[0].getsockname()[1]
+        gateway_port = free_port()
+        env = {**os.environ, 'PYTHONPATH': os.pathsep.join(
+            filter(None, [str(REPO_ROOT), str(BENCH_DIR), os.environ.get('PYTHONPATH')]))}
+        gateway = subprocess.Popen(
+            [sys.executable, str(BENCH_DIR / 'gateway_server.py'),
+             '--port', str(gateway_port), '--upstream', f"http://127.0.0.1:{upstream_port}",
+             '--websocket'],
+            cwd=REPO_ROOT, env=env)
+        try:
+            await asyncio.to_thread(wait_for_port, gateway_port, gateway)
+            url = f"ws://127.0.0.1:{gateway_port}/r0/"
+            warm = await open_tunnels(url, 10)      # imports and pools settle first
+            await round_trips(warm, 1, b'x')
+            before = rss_mb(gateway.pid)
+
+            started = time.perf_counter()
+            clients = await open_tunnels(url, args.tunnels)
+            opened = time.perf_counter() - started
+            after = rss_mb(gateway.pid)
+            rate = await round_trips(clients, args.rounds, b'x' * args.payload)
+
+            await asyncio.gather(*(client.close() for client in clients + warm))
+        finally:
+            gateway.terminate()
+            try:
+                gateway.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                gateway.kill()
+                gateway.wait()
+
+    return {
+        'tunnels': args.tunnels,
+        'handshakes/s': round(args.tunnels / opened),
+        'round trips/s': round(rate),
+        'rss_mb': None if after is None else round(after, 1),
+        'kib/tunnel': None if before is None or after is None
+                      else round((after - before) * 1024 / args.tunnels, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tunnels', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=10, help='messages per tunnel')
+    parser.add_argument('--payload', type=int, default=64, help='message bytes')
+    args = parser.parse_args()
+
+    limit = raise_open_files_limit()
+    if limit < args.tunnels * 3 + 100:
+        parser.error(f"--tunnels {args.tunnels} needs ~{args.tunnels * 3} open files; "
+                     f"the limit is {limit}")
+    print(asyncio.run(run(args)))
+
+
+if __name__ == '__main__':
+    main()
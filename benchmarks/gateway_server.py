@@ -0,0 +1,97 @@
+"""
+Gateway process for load tests: `--routes` routes in front of one upstream.
+
+Started by load_test.py with the checkout under test first on PYTHONPATH, so the same
+script serves the working tree or a --baseline worktree. With `--limiter fake` the
+Redis limiter is replaced by a FakeRateLimiter; `--limiter redis` uses REDIS_URL.
+With `--workers` above 1 the gateway runs under gateway.serve, and every worker
+rebuilds the same setup from BENCH_* environment variables via create_app().
+`--hedge` gives every route a RetryPolicy with hedging. `--max-body-bytes`,
+`--transform` and `--buffered` set body limits, a JSON redaction of 'items.*.secret'
+in responses, and buffering on every route (for bench_bodies.py). `--websocket` lets
+every route tunnel WebSocket upgrades (for bench_tunnels.py).
+
+    python benchmarks/gateway_server.py --port 8000 --upstream http://127.0.0.1:9000
+"""
+import argparse
+import os
+
+import uvicorn
+
+from gateway.config import settings, RouteRule
+from gateway.main import application
+from gateway.testing.fake_limiter import FakeRateLimiter
+
+
+class BenchLimiter(FakeRateLimiter):
+    """FakeRateLimiter without the call log, so RSS reflects the gateway alone."""
+    async def allow(self, key: str, capacity: int, rate: float, tokens: int = 1):
+        return self.allow_next, capacity
+
+    async def check(self, checks, tokens: int = 1):
+        return self.allow_next, min(capacity for _, _, capacity, _ in checks)
+
+
+def create_app():
+    """App configured from the BENCH_* environment variables main() sets."""
+    # Policies are imported only when used: a --baseline checkout may predate them
+    retry = None
+    if os.environ.get('BENCH_HEDGE'):
+        from gateway.config import HedgePolicy, RetryPolicy
+        retry = RetryPolicy(hedge=HedgePolicy())
+    max_bytes = int(os.environ.get('BENCH_BODY_MAX_BYTES') or 0) or None
+    transform = None
+    if os.environ.get('BENCH_BODY_TRANSFORM'):
+        from gateway.config import JsonTransform
+        transform = JsonTransform(redact=['items.*.secret'])
+    websocket = None
+    if os.environ.get('BENCH_WEBSOCKET'):
+        from gateway.config import WebSocketPolicy
+        websocket = WebSocketPolicy()
+    settings.routes = [
+        RouteRule(prefix=f"/r{i}", upstream=os.environ['BENCH_UPSTREAM'], retry=retry,
+                  buffered=bool(os.environ.get('BENCH_BODY_BUFFERED')),
+                  max_request_bytes=max_bytes, max_response_bytes=max_bytes,
+                  response_transform=transform, websocket=websocket)
+        for i in range(int(os.environ['BENCH_ROUTES']))
+    ]
+    if os.environ['BENCH_LIMITER'] == 'fake':
+        application.state.limiter = BenchLimiter()
+    return application
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--upstream', default='http://127.0.0.1:9000')
+    parser.add_argument('--routes', type=int, default=1)
+    parser.add_argument('--limiter', choices=('fake', 'redis'), default='fake')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--hedge', action='store_true', help='hedge upstream requests')
+    parser.add_argument('--max-body-bytes', type=int, default=0,
+                        help='request and response body limit (0 = none)')
+    parser.add_argument('--transform', action='store_true',
+                        help="redact 'items.*.secret' in JSON responses")
+    parser.add_argument('--buffered', action='store_true', help='buffer bodies in memory')
+    parser.add_argument('--websocket', action='store_true', help='tunnel WebSocket upgrades')
+    args = parser.parse_args()
+
+    os.environ.update(BENCH_UPSTREAM=args.upstream, BENCH_ROUTES=str(args.routes),
+                      BENCH_LIMITER=args.limiter, BENCH_HEDGE='1' if args.hedge else '',
+                      BENCH_BODY_MAX_BYTES=str(args.max_body_bytes),
+                      BENCH_BODY_TRANSFORM='1' if args.transform else '',
+                      BENCH_BODY_BUFFERED='1' if args.buffered else '',
+                      BENCH_WEBSOCKET='1' if args.websocket else '')
+    if args.workers > 1:
+        from gateway.serve import main as serve
+        serve(['--app', 'gateway_server:create_app', '--factory', '--port', str(args.port),
+               '--workers', str(args.workers), '--log-level', 'warning'])
+        return
+
+    uvicorn.run(create_app(), host='127.0.0.1', port=args.port,
+                log_level='warning', access_log=False, ws_per_message_deflate=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""
+End-to-end load test: throughput, latency, CPU and memory of a running gateway.
+
+Starts a mock upstream (mock_upstream.py) and a gateway (gateway_server.py) as
+separate processes, then drives the gateway over keep-alive HTTP/1.1 connections
+for a fixed duration. Requests are spread over `--routes` routes and `--keys`
+distinct X-Api-Key values. Reports requests/s, p50/p99/p99.9 latency, gateway CPU
+time per request and gateway RSS, and can save them as JSON.
+
+    python -m benchmarks.load_test --concurrency 64 --duration 10 --payload 1024
+    python -m benchmarks.load_test --limiter redis --keys 10000 --output run.json
+    python -m benchmarks.load_test --baseline main        # also run `main`, compare
+    python -m benchmarks.load_test --compare old.json     # compare with a saved run
+    python -m benchmarks.load_test --workers 4            # multi-process gateway.serve
+    python -m benchmarks.load_test --slow-fraction 0.02 --slow-ms 200 --hedge
+
+`--slow-fraction`/`--slow-ms` make the mock upstream delay some responses; run with
+and without `--hedge` (hedged routes) to see the effect on p99/p99.9.
+
+CPU and RSS are read from /proc, so they are only reported on Linux. With --workers
+they cover the whole gateway process tree.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_ROOT = BENCH_DIR.parent
+
+METRICS = ('rps', 'p50_ms', 'p99_ms', 'p999_ms', 'cpu_us_per_request', 'rss_mb')
+LOWER_IS_BETTER = {'p50_ms', 'p99_ms', 'p999_ms', 'cpu_us_per_request', 'rss_mb'}
+
+
+# ---- Processes ----
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 15.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args[1]} exited with code {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"nothing listening on port {port} after {timeout}s")
+
+
+def process_tree(pid: int) -> list[int]:
+    """`pid` and all its descendants."""
+    pids = [pid]
+    for parent in pids:
+        try:
+            children = Path(f"/proc/{parent}/task/{parent}/children").read_text().split()
+        except OSError:
+            continue
+        pids.extend(int(child) for child in children)
+    return pids
+
+
+def cpu_seconds(pid: int) -> float | None:
+    """User + system CPU time of a process and its descendants."""
+    total = 0.0
+    for member in process_tree(pid):
+        try:
+            fields = Path(f"/proc/{member}/stat").read_text().rsplit(')', 1)[1].split()
+        except OSError:
+            if member == pid:
+                return None
+            continue
+        total += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return total
+
+
+def rss_mb(pid: int) -> float | None:
+    total = None
+    for member in process_tree(pid):
+        try:
+            for line in Path(f"/proc/{member}/status").read_text().splitlines():
+                if line.startswith('VmRSS:'):
+                    total = (total or 0.0) + int(line.split()[1]) / 1024
+        except OSError:
+            pass
+    return total
+
+
+# ---- Load generation ----
+
+def build_request(route: int, key: int, body: bytes) -> bytes:
+    if body:
+        return (b'POST /r%d/ HTTP/1.1\r\nhost: gateway\r\nx-api-key: k%d\r\n'
+                b'content-type: application/octet-stream\r\ncontent-length: %d\r\n\r\n'
+                % (route, key, len(body))) + body
+    return b'GET /r%d/ HTTP/1.1\r\nhost: gateway\r\nx-api-key: k%d\r\n\r\n' % (route, key)
+
+
+async def read_response(reader: asyncio.StreamReader) -> int:
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head[9:12])
+    length, chunked = 0, False
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'content-length':
+            length = int(value)
+        elif name == b'transfer-encoding' and b'chunked' in value.lower():
+            chunked = True
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length:
+        await reader.readexactly(length)
+    return status
+
+
+async def worker(port: int,
+                 worker_id: int,
+                 args: argparse.Namespace,
+                 body: bytes,
+                 deadline: float,
+                 latencies: list[float],
+                 statuses: dict[int, int]) -> None:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    n = worker_id
+    try:
+        while time.perf_counter() < deadline:
+            request = build_request(n % args.routes, n % args.keys, body)
+            n += args.concurrency
+            started = time.perf_counter()
+            writer.write(request)
+            status = await read_response(reader)
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def drive(port: int, args: argparse.Namespace, duration: float) -> tuple[list[float], dict[int, int], float]:
+    body = b'x' * args.body
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(
+        worker(port, i, args, body, deadline, latencies, statuses)
+        for i in range(args.concurrency)
+    ))
+    return latencies, statuses, time.perf_counter() - started
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def run(args: argparse.Namespace, checkout: Path) -> dict:
+    """Start upstream and gateway from `checkout`, warm up, then measure."""
+    upstream_port, gateway_port = free_port(), free_port()
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(
+        filter(None, [str(checkout), str(BENCH_DIR), os.environ.get('PYTHONPATH')]))}
+
+    upstream = subprocess.Popen(
+        [sys.executable, str(BENCH_DIR / 'mock_upstream.py'),
+         '--port', str(upstream_port), '--payload', str(args.payload),
+         '--slow-fraction', str(args.slow_fraction), '--slow-ms', str(args.slow_ms)])
+    gateway = subprocess.Popen(
+        [sys.executable, str(BENCH_DIR / 'gateway_server.py'),
+         '--port', str(gateway_port), '--upstream', f"http://127.0.0.1:{upstream_port}",
+         '--routes', str(args.routes), '--limiter', args.limiter,
+         '--workers', str(args.workers)] + (['--hedge'] if args.hedge else []),
+        cwd=checkout, env=env)
+    try:
+        wait_for_port(upstream_port, upstream)
+        wait_for_port(gateway_port, gateway)
+
+        if args.warmup > 0:
+            asyncio.run(drive(gateway_port, args, args.warmup))
+        cpu_before = cpu_seconds(gateway.pid)
+        latencies, statuses, elapsed = asyncio.run(drive(gateway_port, args, args.duration))
+        cpu_after = cpu_seconds(gateway.pid)
+        rss = rss_mb(gateway.pid)
+    finally:
+        for process in (gateway, upstream):
+            process.terminate()
+        for process in (gateway, upstream):
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    latencies.sort()
+    count = len(latencies)
+    cpu = None
+    if cpu_before is not None and cpu_after is not None and count:
+        cpu = round((cpu_after - cpu_before) / count * 1e6, 1)
+    return {
+        'requests': count,
+        'statuses': {str(status): n for status, n in sorted(statuses.items())},
+        'rps': round(count / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'p999_ms': round(percentile(latencies, 0.999) * 1000, 3),
+        'cpu_us_per_request': cpu,
+        'rss_mb': None if rss is None else round(rss, 1),
+    }
+
+
+# ---- Baselines and reporting ----
+
+def git(*args: str, cwd: Path = REPO_ROOT) -> str:
+    return subprocess.run(['git', *args], cwd=cwd, check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+
+def describe(checkout: Path) -> str | None:
+    try:
+        return git('describe', '--always', '--dirty', cwd=checkout)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_baseline(args: argparse.Namespace, ref: str) -> dict:
+    """Run the same load against `ref`, checked out in a temporary git worktree."""
+    workdir = Path(tempfile.mkdtemp(prefix='gateway-baseline-'))
+    checkout = workdir / 'tree'
+    git('worktree', 'add', '--detach', str(checkout), ref)
+    try:
+        return {'ref': ref, 'commit': describe(checkout), 'results': run(args, checkout)}
+    finally:
+        git('worktree', 'remove', '--force', str(checkout))
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(current: dict, baseline: dict) -> None:
+    print(f"\n{'metric':<20}{'baseline':>12}{'current':>12}{'change':>10}")
+    for metric in METRICS:
+        old, new = baseline.get(metric), current.get(metric)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        better = (change < 0) == (metric in LOWER_IS_BETTER) or change == 0
+        print(f"{metric:<20}{old:>12}{new:>12}{change:>+9.1f}%{'' if better else '  <-'}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=64,
+                        help='open client connections, each with one request in flight')
+    parser.add_argument('--duration', type=float, default=10.0, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=2.0, help='unmeasured seconds first')
+    parser.add_argument('--payload', type=int, default=1024, help='upstream response bytes')
+    parser.add_argument('--body', type=int, default=0,
+                        help='request body bytes; requests are POSTs when non-zero')
+    parser.add_argument('--routes', type=int, default=1, help='routes configured and hit')
+    parser.add_argument('--keys', type=int, default=1, help='distinct X-Api-Key values')
+    parser.add_argument('--limiter', choices=('fake', 'redis'), default='fake',
+                        help='FakeRateLimiter, or the Redis limiter at REDIS_URL')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='gateway worker processes (via gateway.serve when above 1)')
+    parser.add_argument('--slow-fraction', type=float, default=0.0,
+                        help='share of upstream responses delayed by --slow-ms')
+    parser.add_argument('--slow-ms', type=float, default=200.0)
+    parser.add_argument('--hedge', action='store_true',
+                        help='hedge upstream requests (RetryPolicy with a HedgePolicy)')
+    parser.add_argument('--output', type=Path, help='write results as JSON')
+    parser.add_argument('--baseline', metavar='GIT_REF',
+                        help='also run against this git ref and compare')
+    parser.add_argument('--compare', type=Path, metavar='JSON',
+                        help='compare with results saved by an earlier --output')
+    args = parser.parse_args()
+
+    config = {name: getattr(args, name) for name in
+              ('concurrency', 'duration', 'warmup', 'payload', 'body', 'routes', 'keys',
+               'limiter', 'workers', 'slow_fraction', 'slow_ms', 'hedge')}
+    report = {'config': config,
+              'current': {'commit': describe(REPO_ROOT), 'results': run(args, REPO_ROOT)}}
+    print(json.dumps(report['current'], indent=2))
+
+    if args.baseline:
+        report['baseline'] = run_baseline(args, args.baseline)
+        print(json.dumps(report['baseline'], indent=2))
+        compare(report['current']['results'], report['baseline']['results'])
+    if args.compare:
+        saved = json.loads(args.compare.read_text())
+        compare(report['current']['results'], saved['current']['results'])
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + '\n')
+
+
+if __name__ == '__main__':
+    main()
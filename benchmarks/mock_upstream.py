@@ -0,0 +1,85 @@
+"""
+Minimal keep-alive HTTP/1.1 server used as the upstream in gateway load tests.
+
+Answers every request with a fixed `--payload`-byte body after reading (and discarding)
+the request body. It does no routing or parsing beyond framing, so the gateway in
+front of it is the bottleneck being measured. With `--slow-fraction`, that share of
+responses is delayed by `--slow-ms`, to give the gateway a latency tail to cut
+(retries and hedging).
+
+    python benchmarks/mock_upstream.py --port 9000 --payload 1024
+    python benchmarks/mock_upstream.py --slow-fraction 0.02 --slow-ms 200
+"""
+import argparse
+import asyncio
+import random
+
+
+async def read_chunked(reader: asyncio.StreamReader) -> None:
+    while True:
+        size = int((await reader.readline()).split(b';')[0], 16)
+        await reader.readexactly(size + 2)      # chunk data + CRLF
+        if size == 0:
+            return
+
+
+def make_handler(response: bytes, slow_fraction: float = 0.0, slow_ms: float = 0.0):
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                length, chunked = 0, False
+                for line in head.split(b'\r\n')[1:]:
+                    name, _, value = line.partition(b':')
+                    name = name.strip().lower()
+                    if name == b'content-length':
+                        length = int(value)
+                    elif name == b'transfer-encoding' and b'chunked' in value.lower():
+                        chunked = True
+                if chunked:
+                    await read_chunked(reader)
+                elif length:
+                    await reader.readexactly(length)
+                if slow_fraction and random.random() < slow_fraction:
+                    await asyncio.sleep(slow_ms / 1000)
+                writer.write(response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    return handle
+
+
+async def serve(host: str, port: int, payload: int,
+                slow_fraction: float = 0.0, slow_ms: float = 0.0) -> None:
+    body = b'x' * payload
+    response = (b'HTTP/1.1 200 OK\r\n'
+                b'content-type: application/octet-stream\r\n'
+                b'content-length: %d\r\n\r\n' % len(body)) + body
+    server = await asyncio.start_server(make_handler(response, slow_fraction, slow_ms),
+                                        host, port, backlog=4096)
+    async with server:
+        await server.serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--payload', type=int, default=1024)
+    parser.add_argument('--slow-fraction', type=float, default=0.0,
+                        help='share of responses delayed by --slow-ms')
+    parser.add_argument('--slow-ms', type=float, default=0.0)
+    args = parser.parse_args()
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    asyncio.run(serve(args.host, args.port, args.payload, args.slow_fraction, args.slow_ms))
+
+
+if __name__ == '__main__':
+    main()
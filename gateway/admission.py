@@ -0,0 +1,238 @@
+import asyncio
+from collections import deque
+
+from .config import AdmissionSettings, PriorityClass, RouteRule
+
+# Admission control: caps on requests handled at once, globally and per route, with
+# fair queuing of the excess.
+#
+# Requests over a cap wait in per-consumer queues (the consumer is the API key or
+# client address, as for rate limiting). A freed slot goes straight to the next
+# waiter, picked by deficit round robin over consumers and weighted by their priority
+# class, so a consumer flooding the gateway only lengthens its own queue. A request
+# still queued when its class's queue_timeout passes is shed with a 503. The client
+# is told to back off, instead of the request sitting through the rate limiter, the
+# upstream pool and the upstream timeout.
+
+
+class _Consumer:
+    __slots__ = ('waiters', 'deficit', 'weight')
+
+    def __init__(self, weight: float):
+        self.waiters: deque[asyncio.Future] = deque()
+        self.deficit = 0.0
+        self.weight = weight
+
+
+class FairQueue:
+    """
+    Slots of one cap (`limit` requests at once) and the requests queued for them.
+
+    Consumers with waiters take turns in a ring. A turn adds the consumer's weight
+    to its deficit, and each slot handed to it costs 1. A consumer whose queue
+    empties leaves the ring and loses its deficit.
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.queued = 0
+        self._consumers: dict[str, _Consumer] = {}
+        self._ring: deque[str] = deque()    # consumers in turn order, front has the turn
+
+    def try_acquire(self) -> bool:
+        """Take a free slot, unless requests are already queued for one."""
+        if self.in_flight < self.limit and not self.queued:
+            self.in_flight += 1
+            return True
+        return False
+
+    def queue_length(self, consumer: str) -> int:
+        state = self._consumers.get(consumer)
+        return 0 if state is None else len(state.waiters)
+
+    def enqueue(self, consumer: str, weight: float) -> asyncio.Future:
+        """A future that completes when a slot is handed to this waiter."""
+        state = self._consumers.get(consumer)
+        if state is None:
+            state = self._consumers[consumer] = _Consumer(weight)
+            self._ring.append(consumer)
+        state.weight = weight
+        waiter = asyncio.get_running_loop().create_future()
+        state.waiters.append(waiter)
+        self.queued += 1
+        return waiter
+
+    def abandon(self, consumer: str, waiter: asyncio.Future) -> None:
+        """Withdraw a waiter that is shed or cancelled, or pass on its slot if it got one."""
+        if waiter.done():
+            self.release()
+            return
+        waiter.cancel()
+        self._consumers[consumer].waiters.remove(waiter)
+        self.queued -= 1
+
+    def release(self) -> None:
+        if self.in_flight <= self.limit:
+            waiter = self._next()
+            if waiter is not None:
+                waiter.set_result(None)     # the slot changes hands; in_flight stays
+                return
+        self.in_flight -= 1
+
+    def set_limit(self, limit: int) -> None:
+        """Apply a new cap (e.g. after a config reload), handing out any slots it adds."""
+        self.limit = limit
+        while self.in_flight < limit:
+            waiter = self._next()
+            if waiter is None:
+                break
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def _next(self) -> asyncio.Future | None:
+        ring, consumers = self._ring, self._consumers
+        while ring:
+            consumer = ring[0]
+            state = consumers[consumer]
+            if not state.waiters:           # its waiters were all withdrawn
+                ring.popleft()
+                del consumers[consumer]
+                continue
+            if state.deficit < 1:
+                state.deficit += state.weight
+                if state.deficit < 1:
+                    ring.rotate(-1)
+                    continue
+            state.deficit -= 1
+            waiter = state.waiters.popleft()
+            self.queued -= 1
+            if not state.waiters:
+                ring.popleft()
+                del consumers[consumer]
+            elif state.deficit < 1:
+                ring.rotate(-1)
+            return waiter
+        return None
+
+    def snapshot(self) -> dict:
+        return {'limit': self.limit, 'in_flight': self.in_flight, 'queued': self.queued}
+
+
+class AdmissionStats:
+    __slots__ = ('admitted', 'queued', 'shed_timeout', 'shed_queue_full')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+class AdmissionController:
+    """The global and per-route FairQueues of this worker."""
+    def __init__(self, policy: AdmissionSettings):
+        self.policy = policy
+        self.stats = AdmissionStats()
+        self.gate = None if policy.max_in_flight is None else FairQueue(policy.max_in_flight)
+        self.routes: dict[str, FairQueue] = {}
+        self.waiting = 0
+        self._tiers = {tier: cls for cls in policy.classes for tier in cls.tiers}
+        self._default = next(cls for cls in policy.classes if cls.name == policy.default_class)
+
+    def priority_class(self, tier: str) -> PriorityClass:
+        return self._tiers.get(tier, self._default)
+
+    def gates(self, rule: RouteRule | None) -> list[FairQueue]:
+        """The caps a request to `rule` needs a slot of, the route's first."""
+        gates = []
+        if rule is not None and rule.max_in_flight is not None:
+            gate = self.routes.get(rule.prefix)
+            if gate is None:
+                gate = self.routes[rule.prefix] = FairQueue(rule.max_in_flight)
+            elif gate.limit != rule.max_in_flight:
+                gate.set_limit(rule.max_in_flight)
+            gates.append(gate)
+        if self.gate is not None:
+            gates.append(self.gate)
+        return gates
+
+    async def admit(self,
+                    consumer: str,
+                    tier: str,
+                    rule: RouteRule | None) -> list[FairQueue] | None:
+        """
+        Slots for one request, to be given back with release(); None if it is shed.
+
+        The route's slot is taken first, so requests to a saturated route queue there
+        without holding global slots that requests to other routes could use. The
+        queue timeout covers the wait for all of them.
+        """
+        priority = self.priority_class(tier)
+        held: list[FairQueue] = []
+        deadline = None
+        try:
+            for gate in self.gates(rule):
+                if not gate.try_acquire():
+                    if deadline is None:
+                        deadline = asyncio.get_running_loop().time() + priority.queue_timeout
+                    if not await self._wait(gate, consumer, priority, deadline):
+                        self.release(held)
+                        return None
+                held.append(gate)
+        except BaseException:
+            self.release(held)
+            raise
+        self.stats.admitted += 1
+        return held
+
+    async def _wait(self,
+                    gate: FairQueue,
+                    consumer: str,
+                    priority: PriorityClass,
+                    deadline: float) -> bool:
+        timeout = deadline - asyncio.get_running_loop().time()
+        if timeout <= 0:
+            self.stats.shed_timeout += 1
+            return False
+        if (self.waiting >= self.policy.max_queued
+                or gate.queue_length(consumer) >= self.policy.max_queued_per_consumer):
+            self.stats.shed_queue_full += 1
+            return False
+
+        waiter = gate.enqueue(consumer, priority.weight)
+        self.waiting += 1
+        self.stats.queued += 1
+        try:
+            await asyncio.wait((waiter,), timeout=timeout)
+        except asyncio.CancelledError:
+            gate.abandon(consumer, waiter)
+            raise
+        finally:
+            self.waiting -= 1
+        if waiter.done():
+            return True
+        gate.abandon(consumer, waiter)
+        self.stats.shed_timeout += 1
+        return False
+
+    def prune(self, routes: list[RouteRule]) -> None:
+        """
+        Drop the gates of routes no longer capped, e.g. after a config reload.
+
+        Requests holding or waiting for a dropped gate still finish with it.
+        """
+        capped = {rule.prefix for rule in routes if rule.max_in_flight is not None}
+        for prefix in [prefix for prefix in self.routes if prefix not in capped]:
+            del self.routes[prefix]
+
+    @staticmethod
+    def release(gates: list[FairQueue]) -> None:
+        for gate in reversed(gates):
+            gate.release()
+
+    def snapshot(self) -> dict:
+        stats: dict = {name: getattr(self.stats, name) for name in AdmissionStats.__slots__}
+        stats['waiting'] = self.waiting
+        if self.gate is not None:
+            stats['global'] = self.gate.snapshot()
+        for prefix, gate in self.routes.items():
+            stats[prefix] = gate.snapshot()
+        return stats
@@ -0,0 +1,307 @@
+import asyncio
+import random
+import time
+from bisect import bisect
+from collections.abc import Callable, Collection, Iterable
+from itertools import accumulate
+
+import httpx
+
+from .config import RouteRule
+from .protection import AdaptiveConcurrency, CircuitBreaker, UpstreamRejected
+from .retries import Retrier
+
+# Upstream target selection for routes with several upstreams.
+#
+# Everything on the hot path (select/acquire/release) is O(1), apart from weighted
+# selection which is a bisect over cumulative weights. The set of usable targets only
+# changes on health transitions, and is rebuilt then rather than filtered per request.
+
+
+class Target:
+    __slots__ = ('url', 'weight', 'outstanding', 'latency', 'healthy', 'probe_failures',
+                 'failures', 'ejected_until', 'breaker', 'concurrency')
+
+    def __init__(self, url: str, weight: int = 1):
+        self.url = url
+        self.weight = weight
+        self.outstanding = 0
+        self.latency = 0.0    # EWMA of time to response headers, seconds
+        self.healthy = True     # active health check verdict
+        self.probe_failures = 0     # consecutive failed health probes
+        self.failures = 0       # consecutive transport errors
+        self.ejected_until = 0.0
+        self.breaker: CircuitBreaker | None = None
+        self.concurrency: AdaptiveConcurrency | None = None
+
+    def available(self, now: float) -> bool:
+        return (self.healthy and now >= self.ejected_until
+                and (self.breaker is None or now >= self.breaker.open_until))
+
+    def __repr__(self) -> str:
+        return f"Target({self.url!r}, outstanding={self.outstanding})"
+
+
+class UpstreamPool:
+    """
+    Targets of one RouteRule plus the state its balancer needs.
+
+    Strategies:
+        round_robin        cycle through usable targets
+        weighted           random pick proportional to target weight
+        least_outstanding  exact minimum of in-flight requests, via count buckets
+        p2c                best of two random targets by latency x (outstanding + 1)
+
+    Targets are taken out of rotation by active health checks (mark_health) or by
+    passive outlier ejection after `consecutive_failures` transport errors. If no
+    target is usable, all of them are (panic mode), as failing open beats a 502.
+
+    Routes with a circuit_breaker or concurrency_limit also get per-target
+    protection (see protection.py): pick() skips targets whose breaker is open or
+    whose in-flight count is at its adaptive limit, and raises UpstreamRejected when
+    no target will take the request.
+
+    Routes with a retry policy also get a Retrier (see retries.py), which picks the
+    targets of further attempts with pick(exclude=targets already tried).
+    """
+    EWMA_ALPHA = 0.3
+
+    def __init__(self, rule: RouteRule):
+        self.rule = rule
+        self.targets = [Target(t.url, t.weight) for t in rule.upstreams]
+        for target in self.targets:
+            if rule.circuit_breaker is not None:
+                target.breaker = CircuitBreaker(rule.circuit_breaker)
+            if rule.concurrency_limit is not None:
+                target.concurrency = AdaptiveConcurrency(rule.concurrency_limit)
+        self.retrier = Retrier(rule.retry) if rule.retry is not None else None
+        self.strategy = rule.balancer
+        self._select: Callable[[], Target] = getattr(self, f'_select_{self.strategy}')
+        self._rr = 0
+        self._buckets: dict[int, dict[Target, None]] = {}
+        self._min_outstanding = 0
+        self._next_reinstate = float('inf')
+        self.next_health_check = 0.0     # monotonic time; see HealthChecker
+        self._refresh(time.monotonic())
+
+    # ---- Usable target set ----
+    def _refresh(self, now: float) -> None:
+        usable = [t for t in self.targets if t.available(now)]
+        self.usable = usable or list(self.targets)
+        self._cumulative = list(accumulate(t.weight for t in self.usable))
+        self._next_reinstate = min(
+            (until for t in self.targets
+             for until in (t.ejected_until, t.breaker.open_until if t.breaker else 0.0)
+             if until > now),
+            default=float('inf'),
+        )
+
+        # Insertion-ordered dicts used as ordered sets, keyed by outstanding count
+        self._buckets = {}
+        for target in self.usable:
+            self._buckets.setdefault(target.outstanding, {})[target] = None
+        self._min_outstanding = min(self._buckets, default=0)
+
+    # ---- Hot path ----
+    def select(self) -> Target:
+        now = time.monotonic()
+        if now >= self._next_reinstate:
+            self._refresh(now)
+        return self._select()
+
+    def _select_round_robin(self) -> Target:
+        self._rr = (self._rr + 1) % len(self.usable)
+        return self.usable[self._rr]
+
+    def _select_weighted(self) -> Target:
+        point = random.random() * self._cumulative[-1]
+        return self.usable[bisect(self._cumulative, point)]
+
+    def _select_least_outstanding(self) -> Target:
+        return next(iter(self._buckets[self._min_outstanding]))
+
+    def _select_p2c(self) -> Target:
+        if len(self.usable) == 1:
+            return self.usable[0]
+        a, b = random.sample(self.usable, 2)
+        score_a = a.latency * (a.outstanding + 1)
+        score_b = b.latency * (b.outstanding + 1)
+        return a if score_a <= score_b else b
+
+    def pick(self, exclude: Collection[Target] = ()) -> Target:
+        """
+        select() a target that admits the request, or raise UpstreamRejected.
+
+        Targets in `exclude` are only picked when no other usable target admits it.
+        """
+        target = self.select()
+        if not exclude and target.breaker is None and target.concurrency is None:
+            return target
+
+        now = time.monotonic()
+        if target not in exclude:
+            rejection = self._admit(target, now)
+            if rejection is None:
+                return target
+        else:
+            rejection = None
+        candidates = [t for t in self.usable if t is not target and t not in exclude]
+        candidates += [t for t in self.usable if t in exclude]
+        for other in candidates:
+            refused = self._admit(other, now)
+            if refused is None:
+                return other
+            rejection = rejection or refused
+        raise rejection or UpstreamRejected('no usable target')
+
+    @staticmethod
+    def _admit(target: Target, now: float) -> UpstreamRejected | None:
+        limit = target.concurrency
+        if limit is not None and target.outstanding >= limit.limit:
+            return UpstreamRejected('concurrency limit reached')
+        breaker = target.breaker
+        if breaker is not None and not breaker.allow(now):
+            retry_after = breaker.open_until - now
+            return UpstreamRejected('circuit open', retry_after if retry_after > 0 else None)
+        return None
+
+    def acquire(self, target: Target) -> None:
+        self._move(target, +1)
+
+    def release(self, target: Target) -> None:
+        self._move(target, -1)
+
+    def _move(self, target: Target, delta: int) -> None:
+        old = target.outstanding
+        target.outstanding = new = old + delta
+        bucket = self._buckets.get(old)
+        if bucket is None or target not in bucket:
+            return  # not in rotation; only the counter matters
+
+        del bucket[target]
+        if not bucket:
+            del self._buckets[old]
+        self._buckets.setdefault(new, {})[target] = None
+
+        if new < self._min_outstanding:
+            self._min_outstanding = new
+        elif old == self._min_outstanding and old not in self._buckets:
+            self._min_outstanding = new
+
+    # ---- Feedback ----
+    def observe(self, target: Target, latency: float, ok: bool = True) -> None:
+        """
+        Record a completed exchange and its time to response headers.
+
+        `ok` is False for 5xx answers; they count against the circuit breaker and
+        concurrency limit, though not towards transport-level outlier ejection.
+        """
+        target.failures = 0
+        if target.latency == 0.0:
+            target.latency = latency
+        else:
+            target.latency += self.EWMA_ALPHA * (latency - target.latency)
+
+        if target.concurrency is not None:
+            target.concurrency.record(ok, latency, target.outstanding)
+        breaker = target.breaker
+        if breaker is not None:
+            now = time.monotonic()
+            if breaker.record(ok and latency < breaker.policy.slow_call_seconds, now):
+                self._refresh(now)
+
+    def report_failure(self, target: Target) -> None:
+        """Record a transport error; eject the target after too many in a row."""
+        target.failures += 1
+        now = time.monotonic()
+        if target.concurrency is not None:
+            target.concurrency.record(False, 0.0, target.outstanding)
+        opened = target.breaker is not None and target.breaker.record(False, now)
+
+        outlier = self.rule.outlier
+        if target.failures >= outlier.consecutive_failures:
+            target.failures = 0
+            target.ejected_until = now + outlier.ejection_seconds
+            opened = True
+        if opened:
+            self._refresh(now)
+
+    def mark_health(self, target: Target, healthy: bool) -> None:
+        if target.healthy != healthy:
+            target.healthy = healthy
+            self._refresh(time.monotonic())
+
+    def stats(self) -> list[dict]:
+        now = time.monotonic()
+        return [{
+            'url': t.url,
+            'outstanding': t.outstanding,
+            'latency_ms': round(t.latency * 1000, 3),
+            'healthy': t.healthy,
+            'ejected': now < t.ejected_until,
+            'circuit': t.breaker.state if t.breaker else None,
+            'concurrency_limit': round(t.concurrency.limit, 1) if t.concurrency else None,
+        } for t in self.targets]
+
+
+class HealthChecker:
+    """
+    Background task probing targets of routes that configure a health_check.
+
+    A target is marked unhealthy after `unhealthy_threshold` failed probes in a row
+    (non-2xx/3xx or transport error) and healthy again on the first success. Probe
+    state lives on the pools and targets, so it goes away with replaced routes.
+    """
+    def __init__(self,
+                 pools: Callable[[], Iterable[UpstreamPool]],
+                 client: Callable[[], httpx.AsyncClient],
+                 tick: float = 1.0):
+        self.pools = pools
+        self.client = client
+        self.tick = tick
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await self.check_due(time.monotonic())
+            await asyncio.sleep(self.tick)
+
+    async def check_due(self, now: float) -> None:
+        probes = []
+        for pool in self.pools():
+            check = pool.rule.health_check
+            if check is None or pool.next_health_check > now:
+                continue
+            pool.next_health_check = now + check.interval
+            probes.extend(self._probe(pool, target) for target in pool.targets)
+        if probes:
+            await asyncio.gather(*probes)
+
+    async def _probe(self, pool: UpstreamPool, target: Target) -> None:
+        check = pool.rule.health_check
+        try:
+            resp = await self.client().get(target.url.rstrip('/') + check.path,
+                                           timeout=check.timeout)
+            ok = resp.status_code < 400
+        except Exception:
+            ok = False
+
+        if ok:
+            target.probe_failures = 0
+            pool.mark_health(target, True)
+        else:
+            target.probe_failures += 1
+            if target.probe_failures >= check.unhealthy_threshold:
+                pool.mark_health(target, False)
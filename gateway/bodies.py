@@ -0,0 +1,508 @@
+import asyncio
+import json
+import re
+from collections.abc import AsyncIterator, Mapping
+
+import httpx
+
+from .config import JsonTransform
+from .headers import RawHeaders
+
+# Size limits and streaming rewrites of request and response bodies.
+#
+# Limits are enforced as bodies stream. A declared Content-Length over the limit is
+# refused before any byte is read, and a body without one, or longer than it said, is
+# cut off at the limit. The JSON transformer rewrites a document as its chunks arrive.
+# It keeps one frame per open object or array and at most one member name or literal,
+# never the document itself, and passes string values through piece by piece. Its
+# memory is bounded by nesting depth and max_key_bytes, whatever the body size.
+
+
+class BodyTooLarge(Exception):
+    def __init__(self, limit: int):
+        super().__init__(f"body exceeds {limit} bytes")
+        self.limit = limit
+
+
+class TransformError(ValueError):
+    """The body is not well-formed JSON (or has a member name or literal over max_key_bytes)."""
+
+
+# Chunks are fed to the transformer in slices of this size, yielding to the event loop
+# in between, so a large chunk doesn't hold the loop for long
+TRANSFORM_SLICE = 16 * 1024
+
+
+def declared_length(headers: Mapping[str, str]) -> int | None:
+    value = headers.get('content-length', '')
+    return int(value) if value.isdigit() else None
+
+
+def is_json(content_type: str | None) -> bool:
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    return media_type == 'application/json' or media_type.endswith('+json')
+
+
+async def limited(chunks: AsyncIterator[bytes], limit: int) -> AsyncIterator[bytes]:
+    """Pass chunks through, raising BodyTooLarge before the one that crosses `limit`."""
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > limit:
+            raise BodyTooLarge(limit)
+        yield chunk
+
+
+class LimitedStream(httpx.AsyncByteStream):
+    """An upstream response stream cut off at `limit` bytes (as received, still encoded)."""
+    def __init__(self, stream: httpx.AsyncByteStream, limit: int):
+        self.stream = stream
+        self.limit = limit
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in limited(self.stream.__aiter__(), self.limit):
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self.stream.aclose()
+
+
+async def transformed(chunks: AsyncIterator[bytes], policy: JsonTransform) -> AsyncIterator[bytes]:
+    """
+    A JSON body rewritten by `policy`; raises TransformError if it is malformed.
+
+    An empty body (a HEAD or 204 response, say) stays empty.
+    """
+    transformer = JsonStreamTransformer(policy)
+    received = False
+    async for chunk in chunks:
+        received = received or bool(chunk)
+        for start in range(0, len(chunk), TRANSFORM_SLICE):
+            if start:
+                await asyncio.sleep(0)
+            out = transformer.feed(chunk[start:start + TRANSFORM_SLICE])
+            if out:
+                yield out
+    if received:
+        out = transformer.close()
+        if out:
+            yield out
+
+
+def rewritten_headers(raw: RawHeaders) -> RawHeaders:
+    """Headers of a rewritten body: its length is unknown and a strong ETag no longer holds."""
+    updated = []
+    for name, value in raw:
+        if name == b'content-length':
+            continue
+        if name == b'etag' and not value.startswith(b'W/'):
+            value = b'W/' + value
+        updated.append((name, value))
+    return updated
+
+
+# ---- Streaming JSON transformation ----
+class _PathNode:
+    __slots__ = ('children', 'wildcard', 'include', 'remove', 'redact', 'include_below')
+
+    def __init__(self):
+        self.children: dict[str, _PathNode] = {}
+        self.wildcard: _PathNode | None = None
+        self.include = self.remove = self.redact = False
+        self.include_below = False      # an include path goes through this node
+
+    def child(self, segment: str) -> '_PathNode':
+        if segment == '*':
+            if self.wildcard is None:
+                self.wildcard = _PathNode()
+            return self.wildcard
+        return self.children.setdefault(segment, _PathNode())
+
+
+def compile_paths(policy: JsonTransform) -> _PathNode:
+    root = _PathNode()
+    for flag, paths in (('include', policy.include), ('remove', policy.remove),
+                        ('redact', policy.redact)):
+        for path in paths:
+            node = root
+            for segment in path.split('.'):
+                if flag == 'include':
+                    node.include_below = True
+                node = node.child(segment)
+            setattr(node, flag, True)
+    return root
+
+
+# What happens to a value: emitted as it is, skipped, replaced, or descended into
+# with its members decided one by one
+KEEP, DROP, REDACT, FILTER = range(4)
+
+# Parser states
+(_VALUE, _VALUE_OR_END, _KEY, _KEY_OR_END, _KEY_STRING, _COLON, _STRING, _SCALAR,
+ _SKIP, _AFTER_VALUE, _END) = range(11)
+
+_NOT_WHITESPACE = re.compile(rb'[^ \t\r\n]')
+_STRING_SPECIAL = re.compile(rb'["\\]')
+# Everything up to the next bracket or unterminated string, complete strings included
+_SKIP_RUN = re.compile(rb'(?:[^"{}\[\]]+|"[^"\\]*(?:\\.[^"\\]*)*")*')
+_SCALAR_END = re.compile(rb'[\s,\]}]')
+# Members with a scalar value, and objects holding only those, are the common case
+# and are taken in one step. Names or strings with escapes, and values cut by the
+# chunk's end, go through the states instead.
+_MEMBER_PATTERN = (rb'[ \t\r\n]*"([^"\\]*)"[ \t\r\n]*:[ \t\r\n]*'
+                   rb'("[^"\\]*"|true|false|null|-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?'
+                   rb'(?:[eE][-+]?[0-9]+)?)[ \t\r\n]*')
+_MEMBER = re.compile(_MEMBER_PATTERN + rb'(?=[,}])')
+_MEMBERS = re.compile(_MEMBER_PATTERN + rb',?')
+_FLAT_OBJECT_PATTERN = (rb'\{(?:' + _MEMBER_PATTERN + rb'(?:,' + _MEMBER_PATTERN
+                        + rb')*|[ \t\r\n]*)\}')
+_FLAT_OBJECT = re.compile(_FLAT_OBJECT_PATTERN)
+_NEXT_FLAT_OBJECT = re.compile(rb'[ \t\r\n]*,[ \t\r\n]*(' + _FLAT_OBJECT_PATTERN + rb')')
+_LITERAL = re.compile(rb'true|false|null|-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?')
+
+
+# Scalar members' modes remembered per document, keyed by parent paths and name
+_CACHE_SIZE = 1024
+
+
+class _Frame:
+    __slots__ = ('array', 'mode', 'nodes', 'included', 'emitted', 'index')
+
+    def __init__(self, array: bool, mode: int, nodes: tuple[_PathNode, ...], included: bool):
+        self.array = array
+        self.mode = mode
+        self.nodes = nodes
+        self.included = included
+        self.emitted = 0
+        self.index = 0
+
+
+class JsonStreamTransformer:
+    """
+    Rewrites one JSON document fed in chunks of any size.
+
+    feed() returns the output the chunk completed; close() checks the document ended
+    and returns what was left (a top-level literal ends only with the document).
+    Raises TransformError on malformed input. Objects and arrays the rules descend
+    into are re-emitted minified. Those kept or dropped whole are only scanned for
+    their closing bracket: kept ones are copied byte for byte and not validated.
+    """
+    def __init__(self, policy: JsonTransform):
+        self.root = compile_paths(policy)
+        self.redaction = json.dumps(policy.redaction).encode()
+        self.max_key_bytes = policy.max_key_bytes
+        self._stack: list[_Frame] = []
+        self._state = _VALUE
+        # Path nodes and inclusion of the value about to start
+        self._nodes = (self.root,)
+        self._included = not policy.include
+        self._key = bytearray()
+        self._value_mode = KEEP     # of the string, scalar or skipped container being read
+        self._literal = bytearray()
+        self._member_modes: dict[tuple, int] = {}
+        self._escape = False
+        # A container kept or dropped whole is only scanned for its end
+        self._skip_depth = 0
+        self._skip_string = False
+
+    def feed(self, chunk: bytes) -> bytes:
+        out = bytearray()
+        i, n = 0, len(chunk)
+        while i < n:
+            state = self._state
+            if state == _STRING or state == _KEY_STRING:
+                i = self._read_string(chunk, i, out)
+            elif state == _SKIP:
+                i = self._skip(chunk, i, out)
+            elif state == _KEY or state == _KEY_OR_END:
+                member = _MEMBER.match(chunk, i)
+                if member is None:
+                    token = _NOT_WHITESPACE.search(chunk, i)
+                    if token is None:
+                        break
+                    i = token.end()
+                    self._structural(chunk[i - 1], out)
+                else:
+                    self._member(self._stack[-1], member[1], member[2], out)
+                    i = member.end()
+            elif state == _SCALAR:
+                end = _SCALAR_END.search(chunk, i)
+                stop = n if end is None else end.start()
+                self._literal += chunk[i:stop]
+                if len(self._literal) > self.max_key_bytes:
+                    raise TransformError(f"literal over {self.max_key_bytes} bytes")
+                i = stop
+                if end is not None:
+                    self._end_literal(out)
+            else:
+                token = _NOT_WHITESPACE.search(chunk, i)
+                if token is None:
+                    break
+                i = token.end()
+                byte = chunk[i - 1]
+                self._structural(byte, out)
+                if byte == 0x7b and self._state == _KEY_OR_END:
+                    flat = _FLAT_OBJECT.match(chunk, i - 1)
+                    if flat is not None:
+                        i = self._flat_object(chunk, i, flat.end(), out)
+        return bytes(out)
+
+    def close(self) -> bytes:
+        out = bytearray()
+        if self._state == _SCALAR and not self._stack:
+            self._end_literal(out)      # a top-level literal ends with the document
+        if self._state != _END:
+            raise TransformError("truncated JSON document")
+        return bytes(out)
+
+    # ---- Tokens ----
+    def _read_string(self, chunk: bytes, i: int, out: bytearray) -> int:
+        key = self._state == _KEY_STRING
+        if self._escape:
+            self._escape = False
+            self._string_piece(chunk[i:i + 1], key, out)
+            return i + 1
+        special = _STRING_SPECIAL.search(chunk, i)
+        stop = len(chunk) if special is None else special.start()
+        if stop > i:
+            self._string_piece(chunk[i:stop], key, out)
+        if special is None:
+            return stop
+        if chunk[stop] == 0x5c:         # backslash: the next byte is escaped
+            self._escape = True
+            self._string_piece(b'\\', key, out)
+        elif key:
+            self._state = _COLON
+        else:
+            if self._value_mode == KEEP:
+                out += b'"'
+            self._end_value()
+        return stop + 1
+
+    def _skip(self, chunk: bytes, i: int, out: bytearray) -> int:
+        """Scan to the end of a skipped container, copying it when it is kept."""
+        start, n = i, len(chunk)
+        while i < n:
+            if self._escape:
+                self._escape = False
+                i += 1
+            elif self._skip_string:
+                special = _STRING_SPECIAL.search(chunk, i)
+                if special is None:
+                    i = n
+                    break
+                i = special.end()
+                if chunk[i - 1] == 0x5c:
+                    self._escape = True
+                else:
+                    self._skip_string = False
+            else:
+                i = _SKIP_RUN.match(chunk, i).end()
+                if i == n:
+                    break
+                byte = chunk[i]
+                i += 1
+                if byte == 0x22:                # a string the chunk cuts off
+                    self._skip_string = True
+                elif byte == 0x7b or byte == 0x5b:
+                    self._skip_depth += 1
+                else:
+                    self._skip_depth -= 1
+                    if not self._skip_depth:
+                        self._end_value()
+                        break
+        if self._value_mode == KEEP:
+            out += chunk[start:i]
+        return i
+
+    def _string_piece(self, piece: bytes, key: bool, out: bytearray) -> None:
+        if key:
+            self._key += piece
+            if len(self._key) > self.max_key_bytes:
+                raise TransformError(f"member name over {self.max_key_bytes} bytes")
+        elif self._value_mode == KEEP:
+            out += piece
+
+    def _structural(self, byte: int, out: bytearray) -> None:
+        state = self._state
+        if state == _VALUE:
+            self._begin_value(byte, out)
+        elif state == _AFTER_VALUE:
+            frame = self._stack[-1]
+            if byte == 0x2c:                                    # ,
+                if frame.array:
+                    self._begin_element(frame)
+                else:
+                    self._state = _KEY
+            elif byte == (0x5d if frame.array else 0x7d):       # ] or }
+                self._close_container(frame, out)
+            else:
+                raise TransformError(f"expected ',' or a closing bracket, got {chr(byte)!r}")
+        elif state == _KEY or state == _KEY_OR_END:
+            if byte == 0x22:                                    # "
+                self._key.clear()
+                self._state = _KEY_STRING
+            elif byte == 0x7d and state == _KEY_OR_END:         # }
+                self._close_container(self._stack[-1], out)
+            else:
+                raise TransformError(f"expected a member name, got {chr(byte)!r}")
+        elif state == _COLON:
+            if byte != 0x3a:                                    # :
+                raise TransformError(f"expected ':', got {chr(byte)!r}")
+            self._begin_member(self._stack[-1])
+        elif state == _VALUE_OR_END:
+            if byte == 0x5d:                                    # ]
+                self._close_container(self._stack[-1], out)
+            else:
+                self._begin_element(self._stack[-1])
+                self._begin_value(byte, out)
+        else:   # _END
+            raise TransformError("data after the JSON document")
+
+    # ---- Values ----
+    def _flat_object(self, chunk: bytes, start: int, end: int, out: bytearray) -> int:
+        """
+        The rest of a filtered object whose members all have scalar values, and of
+        the array elements after it that are objects of that kind.
+        """
+        while True:
+            frame = self._stack[-1]
+            for member in _MEMBERS.finditer(chunk, start, end - 1):
+                self._member(frame, member[1], member[2], out)
+            self._close_container(frame, out)
+            if not self._stack or not self._stack[-1].array:
+                return end
+            following = _NEXT_FLAT_OBJECT.match(chunk, end)
+            if following is None:
+                return end
+            self._begin_element(self._stack[-1])
+            self._begin_value(0x7b, out)
+            start, end = following.start(1) + 1, following.end(1)
+            if self._state != _KEY_OR_END:
+                return start        # kept or dropped whole: scanned from here
+
+    def _member(self, frame: _Frame, key: bytes, value: bytes, out: bytearray) -> None:
+        """A member with a scalar value, read whole."""
+        if len(key) > self.max_key_bytes:
+            raise TransformError(f"member name over {self.max_key_bytes} bytes")
+        if len(value) > self.max_key_bytes and value[0] != 0x22:
+            raise TransformError(f"literal over {self.max_key_bytes} bytes")
+        modes = self._member_modes
+        mode = modes.get((frame.nodes, frame.included, key))
+        if mode is None:
+            self._child(frame, key.decode('utf-8', 'replace'))
+            mode = self._decide(False)
+            if len(modes) >= _CACHE_SIZE:
+                modes.clear()
+            modes[frame.nodes, frame.included, key] = mode
+        if mode != DROP:
+            if frame.emitted:
+                out += b','
+            frame.emitted += 1
+            out += b'"' + key + b'":' + (value if mode == KEEP else self.redaction)
+        self._state = _AFTER_VALUE
+
+    def _begin_member(self, frame: _Frame) -> None:
+        if frame.mode == FILTER:
+            self._child(frame, self._key_name())
+        self._state = _VALUE
+
+    def _begin_element(self, frame: _Frame) -> None:
+        if frame.mode == FILTER:
+            self._child(frame, str(frame.index))
+        frame.index += 1
+        self._state = _VALUE
+
+    def _key_name(self) -> str:
+        raw = bytes(self._key)
+        if b'\\' not in raw:
+            return raw.decode('utf-8', 'replace')
+        try:
+            return json.loads(b'"' + raw + b'"')
+        except ValueError:
+            raise TransformError("invalid escape in a member name") from None
+
+    def _child(self, frame: _Frame, segment: str) -> None:
+        nodes = []
+        for node in frame.nodes:
+            child = node.children.get(segment)
+            if child is not None:
+                nodes.append(child)
+            if node.wildcard is not None:
+                nodes.append(node.wildcard)
+        self._nodes = tuple(nodes)
+        self._included = frame.included
+
+    def _decide(self, container: bool) -> int:
+        nodes, included = self._nodes, self._included
+        if nodes:
+            if any(node.remove for node in nodes):
+                return DROP
+            included = self._included = included or any(node.include for node in nodes)
+            if not included and not any(node.include_below for node in nodes):
+                return DROP     # off every include path: rules below it don't matter
+            if any(node.redact for node in nodes):
+                return REDACT
+            if container and any(node.children or node.wildcard for node in nodes):
+                return FILTER
+        return KEEP if included else DROP
+
+    def _begin_value(self, byte: int, out: bytearray) -> None:
+        container = byte == 0x7b or byte == 0x5b                # { or [
+        frame = self._stack[-1] if self._stack else None
+        if frame is None or frame.mode == FILTER:
+            mode = self._decide(container)
+        else:
+            mode = KEEP if frame.mode == KEEP else DROP
+        mode = self._open_value(frame, mode, out)
+
+        if container:
+            if mode != DROP:
+                out.append(byte)
+            if mode == FILTER:
+                self._stack.append(_Frame(byte == 0x5b, mode, self._nodes, self._included))
+                self._state = _VALUE_OR_END if byte == 0x5b else _KEY_OR_END
+            else:
+                self._value_mode = mode
+                self._skip_depth = 1
+                self._state = _SKIP
+        elif byte == 0x22:                                      # "
+            self._value_mode = mode
+            if mode == KEEP:
+                out += b'"'
+            self._state = _STRING
+        elif byte == 0x2d or 0x30 <= byte <= 0x39 or byte in b'tfn':
+            self._value_mode = mode
+            self._literal = bytearray((byte,))
+            self._state = _SCALAR
+        else:
+            raise TransformError(f"unexpected {chr(byte)!r} where a value should start")
+
+    def _open_value(self, frame: _Frame | None, mode: int, out: bytearray) -> int:
+        """Emit what precedes a value (or its redaction); the mode left for the value itself."""
+        if mode != DROP and frame is not None:
+            if frame.emitted:
+                out += b','
+            frame.emitted += 1
+            if not frame.array:
+                out += b'"' + self._key + b'":'
+        if mode == REDACT:
+            out += self.redaction
+            mode = DROP
+        return mode
+
+    def _close_container(self, frame: _Frame, out: bytearray) -> None:
+        self._stack.pop()
+        if frame.mode != DROP:
+            out.append(0x5d if frame.array else 0x7d)
+        self._end_value()
+
+    def _end_literal(self, out: bytearray) -> None:
+        if _LITERAL.fullmatch(self._literal) is None:
+            raise TransformError(f"invalid literal {bytes(self._literal)!r}")
+        if self._value_mode == KEEP:
+            out += self._literal
+        self._end_value()
+
+    def _end_value(self) -> None:
+        self._state = _AFTER_VALUE if self._stack else _END
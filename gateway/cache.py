@@ -0,0 +1,402 @@
+import asyncio
+import json
+import struct
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Awaitable, Callable, Mapping
+from email.utils import parsedate_to_datetime
+
+import httpx
+import redis.exceptions
+from redis.asyncio import Redis
+from starlette.responses import Response
+
+from .compression import encoded_headers
+from .config import CachePolicy
+
+# HTTP response cache for idempotent GET/HEAD requests.
+#
+# Entries live in a byte-bounded in-process LRU and, for routes with shared=True, in
+# Redis so that every gateway instance can serve them. Freshness follows the upstream
+# Cache-Control/Expires headers (falling back to the route's CachePolicy), stale
+# entries are revalidated with If-None-Match/If-Modified-Since, and
+# stale-while-revalidate serves the old copy while a background refresh runs.
+# Bodies are stored decoded; compressed variants are kept next to them in memory only,
+# so a hit is never compressed twice by the same instance.
+
+CACHEABLE_STATUSES = frozenset({200, 203, 204, 300, 301, 308, 404, 410})
+
+# A shared-tier call failing this way counts as a miss (or a skipped store)
+REDIS_ERRORS = (redis.exceptions.RedisError, OSError, asyncio.TimeoutError)
+
+
+def parse_cache_control(value: str | None) -> dict[str, str | None]:
+    """'max-age=60, no-cache' -> {'max-age': '60', 'no-cache': None}"""
+    directives: dict[str, str | None] = {}
+    if not value:
+        return directives
+    for part in value.split(','):
+        name, _, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip('"') if arg else None
+    return directives
+
+
+def _seconds(value: str | None) -> float | None:
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _http_date(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class CacheEntry:
+    __slots__ = ('status', 'headers', 'body', 'stored_at', 'fresh_until',
+                 'stale_until', 'expires_at', 'etag', 'last_modified', 'encoded', 'size')
+
+    def __init__(self,
+                 status: int,
+                 headers: list[tuple[str, str]],
+                 body: bytes,
+                 stored_at: float,
+                 fresh_until: float,
+                 stale_until: float,
+                 expires_at: float):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+        self.fresh_until = fresh_until      # served as-is until then
+        self.stale_until = stale_until      # stale-while-revalidate window end
+        self.expires_at = expires_at        # kept for conditional revalidation until then
+        self.etag: str | None = None
+        self.last_modified: str | None = None
+        self.encoded: dict[str, bytes] = {}     # content-encoding -> compressed body
+        for name, value in headers:
+            if name == 'etag':
+                self.etag = value
+            elif name == 'last-modified':
+                self.last_modified = value
+        self.size = len(body) + sum(len(k) + len(v) for k, v in headers) + 64
+
+    def add_encoded(self, encoding: str, body: bytes) -> None:
+        self.size += len(body) - len(self.encoded.get(encoding, b''))
+        self.encoded[encoding] = body
+
+    def to_response(self, now: float, head: bool = False, encoding: str | None = None) -> Response:
+        body = self.body if encoding is None else self.encoded[encoding]
+        response = Response(content=b'' if head else body, status_code=self.status)
+        # Relay stored headers verbatim (content-length included, also for HEAD)
+        response.raw_headers = [
+            (k.encode('latin-1'), v.encode('latin-1')) for k, v in self.headers
+            if k != 'age'
+        ]
+        if encoding is not None:
+            response.raw_headers = encoded_headers(response.raw_headers, encoding)
+            response.raw_headers.append((b'content-length', str(len(body)).encode()))
+        response.raw_headers.append((b'age', str(int(now - self.stored_at)).encode()))
+        return response
+
+    def dumps(self) -> bytes:
+        meta = json.dumps([self.status, self.headers, self.stored_at, self.fresh_until,
+                           self.stale_until, self.expires_at]).encode()
+        return struct.pack('>I', len(meta)) + meta + self.body
+
+    @classmethod
+    def loads(cls, data: bytes) -> 'CacheEntry':
+        (meta_len,) = struct.unpack_from('>I', data)
+        status, headers, *times = json.loads(data[4:4 + meta_len])
+        return cls(status, [tuple(h) for h in headers], data[4 + meta_len:], *times)
+
+
+class MemoryTier:
+    """LRU bounded by the total size of stored entries, not their count."""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._data: OrderedDict[str, tuple[object, int]] = OrderedDict()
+
+    def get(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        self._data.move_to_end(key)
+        return item[0]
+
+    def put(self, key: str, value, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        self.pop(key)
+        self._data[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self._data.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def pop(self, key: str) -> None:
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.bytes -= item[1]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class CacheStats:
+    __slots__ = ('hits', 'stale_hits', 'misses', 'revalidated', 'stores',
+                 'bytes_served', 'bytes_stored', 'redis_hits', 'redis_errors')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+class ResponseCache:
+    def __init__(self,
+                 max_bytes: int,
+                 redis: Redis | None = None,
+                 redis_prefix: str = 'cache:',
+                 redis_timeout: float = 0.05):
+        self.memory = MemoryTier(max_bytes)
+        self.redis = redis
+        self.redis_prefix = redis_prefix
+        self.redis_timeout = redis_timeout
+        self.stats = CacheStats()
+        self._revalidating: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()
+
+    # ---- Keys and Vary ----
+    @staticmethod
+    def variant_key(base: str, vary: tuple[str, ...], headers: Mapping[str, str]) -> str:
+        if not vary:
+            return base
+        return base + '\n' + '\n'.join(headers.get(name, '') for name in vary)
+
+    async def _vary(self, base: str, shared: bool) -> tuple[str, ...] | None:
+        vary = self.memory.get('vary\n' + base)
+        if vary is None and shared and self.redis is not None:
+            raw = await self._shared(self.redis.get(self.redis_prefix + 'vary:' + base))
+            if raw is not None:
+                vary = tuple(json.loads(raw))
+                self.memory.put('vary\n' + base, vary, 64 + len(raw))
+        return vary
+
+    # ---- Lookup / store ----
+    async def get(self,
+                  base: str,
+                  headers: Mapping[str, str],
+                  shared: bool) -> tuple[str, CacheEntry | None]:
+        """:return: (variant key, entry or None)"""
+        vary = await self._vary(base, shared)
+        key = self.variant_key(base, vary or (), headers)
+        if vary is None:
+            return key, None
+
+        entry = self.memory.get(key)
+        if entry is None and shared and self.redis is not None:
+            raw = await self._shared(self.redis.get(self.redis_prefix + key))
+            if raw is not None:
+                entry = CacheEntry.loads(raw)
+                self.memory.put(key, entry, entry.size)
+                self.stats.redis_hits += 1
+        return key, entry
+
+    async def put(self,
+                  base: str,
+                  vary: tuple[str, ...],
+                  headers: Mapping[str, str],
+                  entry: CacheEntry,
+                  shared: bool) -> None:
+        key = self.variant_key(base, vary, headers)
+        self.memory.put('vary\n' + base, vary, 64 + sum(map(len, vary)))
+        self.memory.put(key, entry, entry.size)
+        self.stats.stores += 1
+        self.stats.bytes_stored += len(entry.body)
+
+        if shared and self.redis is not None:
+            ttl_ms = max(1, int((entry.expires_at - time.time()) * 1000))
+
+            async def store() -> None:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.set(self.redis_prefix + 'vary:' + base, json.dumps(vary), px=ttl_ms)
+                    pipe.set(self.redis_prefix + key, entry.dumps(), px=ttl_ms)
+                    await pipe.execute()
+
+            await self._shared(store())
+
+    async def _shared(self, call: Awaitable):
+        """Result of a shared-tier call, or None if Redis failed or was too slow."""
+        try:
+            return await asyncio.wait_for(call, self.redis_timeout)
+        except REDIS_ERRORS:
+            self.stats.redis_errors += 1
+            return None
+
+    def add_encoded(self, key: str, entry: CacheEntry, encoding: str, body: bytes) -> None:
+        """Keep a compressed variant of a stored entry (in memory only)."""
+        entry.add_encoded(encoding, body)
+        if self.memory.get(key) is entry:
+            self.memory.put(key, entry, entry.size)
+
+    def begin_revalidation(self, key: str) -> bool:
+        """Claim the background refresh of `key`; False if one is already running."""
+        if key in self._revalidating:
+            return False
+        self._revalidating.add(key)
+        return True
+
+    def end_revalidation(self, key: str) -> None:
+        self._revalidating.discard(key)
+
+    def spawn(self, coro: Awaitable) -> None:
+        """Run a best-effort background store/refresh; its failures are dropped."""
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled():
+            task.exception()
+
+    def snapshot(self) -> dict:
+        stats = {name: getattr(self.stats, name) for name in CacheStats.__slots__}
+        stats.update(entries=len(self.memory),
+                     memory_bytes=self.memory.bytes,
+                     memory_max_bytes=self.memory.max_bytes,
+                     evictions=self.memory.evictions)
+        return stats
+
+    async def aclose(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def request_cacheable(method: str, headers: Mapping[str, str]) -> bool:
+    """
+    Requests that may be answered from (and stored in) a shared cache.
+
+    Authenticated ones are not: an API key identifies the consumer like credentials do.
+    """
+    if method not in ('GET', 'HEAD') or 'authorization' in headers or 'x-api-key' in headers:
+        return False
+    return 'no-store' not in parse_cache_control(headers.get('cache-control'))
+
+
+def build_entry(status: int,
+                headers: list[tuple[str, str]],
+                body: bytes,
+                policy: CachePolicy,
+                now: float) -> tuple[CacheEntry, tuple[str, ...]] | None:
+    """
+    Cache entry for an upstream response, or None if it must not be stored.
+    :return: (entry, names of request headers the response varies on)
+    """
+    if status not in CACHEABLE_STATUSES or len(body) > policy.max_entry_bytes:
+        return None
+
+    values: dict[str, str] = {}
+    for name, value in headers:
+        values[name] = f"{values[name]}, {value}" if name in values else value
+    if 'set-cookie' in values:
+        return None
+
+    directives = parse_cache_control(values.get('cache-control'))
+    if 'no-store' in directives or 'private' in directives:
+        return None
+
+    vary = tuple(sorted({v.strip().lower() for v in values.get('vary', '').split(',') if v.strip()}))
+    if '*' in vary:
+        return None
+
+    ttl = _seconds(directives.get('s-maxage'))
+    if ttl is None:
+        ttl = _seconds(directives.get('max-age'))
+    if ttl is None:
+        expires, date = _http_date(values.get('expires')), _http_date(values.get('date'))
+        if expires is not None:
+            ttl = max(0.0, expires - (date or now))
+    if ttl is None:
+        ttl = policy.default_ttl
+    if 'no-cache' in directives:
+        ttl = 0.0
+    ttl = min(ttl, policy.max_ttl)
+
+    swr = _seconds(directives.get('stale-while-revalidate'))
+    swr = policy.stale_while_revalidate if swr is None else min(swr, policy.max_ttl)
+
+    validators = 'etag' in values or 'last-modified' in values
+    if ttl <= 0 and swr <= 0 and not validators:
+        return None
+
+    fresh_until = now + ttl
+    stale_until = fresh_until + swr
+    expires_at = stale_until + (policy.revalidate_window if validators else 0.0)
+    return CacheEntry(status, headers, body, now, fresh_until, stale_until, expires_at), vary
+
+
+def refreshed(entry: CacheEntry,
+              not_modified: httpx.Response,
+              policy: CachePolicy,
+              now: float) -> tuple[CacheEntry, tuple[str, ...]] | None:
+    """Entry updated with the headers of a 304 Not Modified answer."""
+    updated = dict(entry.headers)
+    for name, value in not_modified.headers.items():
+        if name in ('cache-control', 'expires', 'date', 'etag', 'last-modified', 'vary'):
+            updated[name] = value
+    return build_entry(entry.status, list(updated.items()), entry.body, policy, now)
+
+
+def conditional_headers(entry: CacheEntry) -> dict[str, str]:
+    headers = {}
+    if entry.etag is not None:
+        headers['If-None-Match'] = entry.etag
+    if entry.last_modified is not None:
+        headers['If-Modified-Since'] = entry.last_modified
+    return headers
+
+
+async def tee_into_cache(chunks: AsyncIterator[bytes],
+                         limit: int,
+                         on_complete: Callable[[bytes], None]) -> AsyncIterator[bytes]:
+    """
+    Pass chunks through while keeping a copy of up to `limit` bytes.
+
+    The copy is dropped as soon as the body outgrows the limit, so memory stays bounded
+    regardless of object size; on_complete only sees bodies that fit.
+    """
+    parts: list[bytes] | None = []
+    size = 0
+    async for chunk in chunks:
+        if parts is not None:
+            size += len(chunk)
+            if size > limit:
+                parts = None
+            else:
+                parts.append(chunk)
+        yield chunk
+    if parts is not None:
+        on_complete(b''.join(parts))
+
+
+async def read_limited(chunks: AsyncIterator[bytes], limit: int) -> bytes | None:
+    """Read a streamed body, or None if it exceeds `limit` bytes."""
+    parts = []
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > limit:
+            return None
+        parts.append(chunk)
+    return b''.join(parts)
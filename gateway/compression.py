@@ -0,0 +1,311 @@
+import asyncio
+import zlib
+from collections.abc import AsyncIterator, Callable
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from .bodies import rewritten_headers
+from .config import CompressionSettings
+from .headers import RawHeaders, response_headers
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Content-Encoding negotiation between upstreams and clients.
+#
+# A body the upstream already compressed in an encoding the client accepts is relayed
+# byte for byte, never decoded. Otherwise it is decoded (httpx) and, like an
+# uncompressed body, compressed in the client's preferred encoding when its media type
+# is worth it. Compression streams chunk by chunk, and a body of unknown length is
+# flushed after every upstream chunk so incremental responses keep flowing (at some
+# cost in ratio). Chunks of at least thread_threshold bytes are compressed on a small
+# dedicated thread pool (zlib, brotli and zstandard release the GIL), so large bodies
+# don't stall the event loop.
+
+# Encodings httpx can decode, i.e. that can be undone for clients not accepting them
+DECODABLE = frozenset({'gzip', 'deflate'}
+                      | ({'br'} if brotli is not None else set())
+                      | ({'zstd'} if zstandard is not None else set()))
+
+AVAILABLE = frozenset({'gzip'}
+                      | ({'br'} if brotli is not None else set())
+                      | ({'zstd'} if zstandard is not None else set()))
+
+# Statuses whose bodies are representations that may be re-encoded (not 206 ranges)
+COMPRESSIBLE_STATUSES = frozenset({200, 201, 202, 203, 400, 401, 403, 404, 410, 422, 500})
+
+# Events must reach the client as soon as they are written; never buffer them
+NEVER_COMPRESSED = frozenset({'text/event-stream'})
+
+
+def parse_accept_encoding(value: str | None) -> dict[str, float]:
+    """'gzip;q=0.8, br' -> {'gzip': 0.8, 'br': 1.0}"""
+    accepted: dict[str, float] = {}
+    if not value:
+        return accepted
+    for part in value.split(','):
+        coding, *params = part.strip().split(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, arg = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(arg)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def accepts(accepted: dict[str, float], encoding: str) -> bool:
+    q = accepted.get(encoding)
+    if q is None and encoding == 'x-gzip':
+        q = accepted.get('gzip')
+    if q is None:
+        q = accepted.get('*', 0.0)
+    return q > 0
+
+
+class _Compressor:
+    """
+    Streaming compressor: compress() per chunk, then flush() once.
+
+    sync() emits everything compressed so far without ending the stream.
+    """
+    __slots__ = ('compress', 'sync', 'flush')
+
+    def __init__(self,
+                 compress: Callable[[bytes], bytes],
+                 sync: Callable[[], bytes],
+                 flush: Callable[[], bytes]):
+        self.compress = compress
+        self.sync = sync
+        self.flush = flush
+
+    def compress_synced(self, chunk: bytes) -> bytes:
+        return self.compress(chunk) + self.sync()
+
+
+def new_compressor(encoding: str, policy: CompressionSettings) -> _Compressor:
+    if encoding == 'gzip':
+        stream = zlib.compressobj(policy.gzip_level, zlib.DEFLATED, 31)    # 31: gzip header
+        return _Compressor(stream.compress, lambda: stream.flush(zlib.Z_SYNC_FLUSH),
+                           stream.flush)
+    if encoding == 'br':
+        stream = brotli.Compressor(quality=policy.brotli_quality)
+        return _Compressor(stream.process, stream.flush, stream.finish)
+    if encoding == 'zstd':
+        stream = zstandard.ZstdCompressor(level=policy.zstd_level).compressobj()
+        return _Compressor(stream.compress,
+                           lambda: stream.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+                           stream.flush)
+    raise ValueError(f"unsupported encoding: {encoding!r}")
+
+
+class CompressionStats:
+    __slots__ = ('passthrough', 'decoded', 'compressed', 'bytes_in', 'bytes_out',
+                 'thread_offloads')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+class ContentEncoder:
+    def __init__(self, policy: CompressionSettings):
+        self.policy = policy
+        self.encodings = [encoding for encoding in policy.encodings if encoding in AVAILABLE]
+        self.stats = CompressionStats()
+        self._executor: ThreadPoolExecutor | None = None
+        self._exact_types = frozenset(t for t in policy.content_types if '*' not in t)
+        self._type_patterns = [t.split('*', 1) for t in policy.content_types if '*' in t]
+
+    # ---- Negotiation ----
+    def choose(self, accept_encoding: str | None) -> str | None:
+        """Preferred encoding the client accepts with the highest q, or None for identity."""
+        if not self.policy.enabled or not accept_encoding:
+            return None
+        accepted = parse_accept_encoding(accept_encoding)
+        best, best_q = None, 0.0
+        for encoding in self.encodings:
+            q = accepted.get(encoding, accepted.get('*', 0.0))
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def compressible(self, status: int, headers: httpx.Headers | dict, length: int | None) -> bool:
+        if status not in COMPRESSIBLE_STATUSES:
+            return False
+        if length is not None and length < self.policy.min_bytes:
+            return False
+        if 'no-transform' in headers.get('cache-control', '').lower():
+            return False
+        media_type = headers.get('content-type', '').split(';')[0].strip().lower()
+        if not media_type or media_type in NEVER_COMPRESSED:
+            return False
+        if media_type in self._exact_types:
+            return True
+        return any(media_type.startswith(head) and media_type.endswith(tail)
+                   for head, tail in self._type_patterns)
+
+    # ---- Responses ----
+    def relay(self,
+              resp: httpx.Response,
+              accept_encoding: str | None,
+              tee: Callable[[AsyncIterator[bytes], str | None], AsyncIterator[bytes]] | None = None,
+              transform: Callable[[AsyncIterator[bytes]], AsyncIterator[bytes]] | None = None
+              ) -> tuple[RawHeaders, AsyncIterator[bytes]]:
+        """
+        Headers and body iterator for relaying a streamed upstream response.
+
+        `tee` wraps the body before it is compressed for the client, e.g. to keep a copy;
+        it is also told the body's content-encoding (None when decoded). `transform`
+        rewrites the decoded body before that; the caller makes sure the upstream
+        encoding is DECODABLE.
+        """
+        upstream = resp.headers.get('content-encoding', '').strip().lower()
+        if upstream and upstream != 'identity':
+            if transform is None and (upstream not in DECODABLE
+                                      or accepts(parse_accept_encoding(accept_encoding),
+                                                 upstream)):
+                self.stats.passthrough += 1
+                content = resp.aiter_raw()
+                return (with_vary(response_headers(resp.headers.raw, decoded=False)),
+                        content if tee is None else tee(content, upstream))
+            self.stats.decoded += 1
+            content = resp.aiter_bytes()
+            length = None
+        else:
+            content = resp.aiter_raw()
+            declared = resp.headers.get('content-length', '')
+            length = int(declared) if declared.isdigit() else None
+        headers = response_headers(resp.headers.raw)
+        if transform is not None:
+            content = transform(content)
+            headers = rewritten_headers(headers)
+            length = None
+        if tee is not None:
+            content = tee(content, None)
+
+        if not self.policy.enabled or not self.compressible(resp.status_code, resp.headers,
+                                                            length):
+            return headers, content
+        encoding = self.choose(accept_encoding)
+        if encoding is None:
+            return with_vary(headers), content
+        return (encoded_headers(headers, encoding),
+                self.compress_stream(content, encoding, sync=length is None))
+
+    async def compress_stream(self,
+                              chunks: AsyncIterator[bytes],
+                              encoding: str,
+                              sync: bool = False) -> AsyncIterator[bytes]:
+        """
+        Compressed chunks; with `sync`, each input chunk's output is sent right away
+        instead of when the compressor's buffers fill up.
+        """
+        self.stats.compressed += 1
+        compressor = new_compressor(encoding, self.policy)
+        compress = compressor.compress_synced if sync else compressor.compress
+        loop = asyncio.get_running_loop()
+        threshold = self.policy.thread_threshold
+        async for chunk in chunks:
+            self.stats.bytes_in += len(chunk)
+            if len(chunk) >= threshold:
+                self.stats.thread_offloads += 1
+                out = await loop.run_in_executor(self.executor, compress, chunk)
+            else:
+                out = compress(chunk)
+            if out:
+                self.stats.bytes_out += len(out)
+                yield out
+        tail = compressor.flush()
+        self.stats.bytes_out += len(tail)
+        yield tail
+
+    async def compress(self, body: bytes, encoding: str) -> bytes:
+        """Whole body in one go, e.g. for a cache entry variant."""
+        self.stats.compressed += 1
+        self.stats.bytes_in += len(body)
+        compressor = new_compressor(encoding, self.policy)
+
+        def run() -> bytes:
+            return compressor.compress(body) + compressor.flush()
+
+        out = await self._run(run, len(body))
+        self.stats.bytes_out += len(out)
+        return out
+
+    async def decode(self, body: bytes, encoding: str) -> bytes:
+        return await self._run(lambda: decode_body(body, encoding), len(body))
+
+    async def _run(self, work: Callable[[], bytes], size: int) -> bytes:
+        if size < self.policy.thread_threshold:
+            return work()
+        self.stats.thread_offloads += 1
+        return await asyncio.get_running_loop().run_in_executor(self.executor, work)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.policy.threads,
+                                                thread_name_prefix='compress')
+        return self._executor
+
+    def snapshot(self) -> dict:
+        return {name: getattr(self.stats, name) for name in CompressionStats.__slots__}
+
+    def close(self) -> None:
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def decode_body(body: bytes, encoding: str) -> bytes:
+    """Undo a content-encoding from DECODABLE."""
+    if encoding == 'gzip':
+        return zlib.decompress(body, 47)        # 47: gzip or zlib header
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:                      # raw deflate, as some servers send it
+            return zlib.decompress(body, -15)
+    if encoding == 'br' and brotli is not None:
+        return brotli.decompress(body)
+    if encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    raise ValueError(f"unsupported encoding: {encoding!r}")
+
+
+def with_vary(headers: RawHeaders) -> RawHeaders:
+    """Make sure Vary lists Accept-Encoding, for caches between gateway and client."""
+    for name, value in headers:
+        if name == b'vary' and (b'accept-encoding' in value.lower() or value.strip() == b'*'):
+            return headers
+    return headers + [(b'vary', b'accept-encoding')]
+
+
+def encoded_headers(headers: RawHeaders, encoding: str) -> RawHeaders:
+    """
+    Headers of a representation the gateway compressed itself.
+
+    Content-Length is dropped (the body is re-chunked) and a strong ETag is weakened:
+    the bytes differ from those the upstream tagged.
+    """
+    updated = rewritten_headers(headers)
+    updated.append((b'content-encoding', encoding.encode('latin-1')))
+    return with_vary(updated)
@@ -1,11 +1,454 @@
-from pydantic import BaseModel, Field
+from ipaddress import ip_network
+from typing import Literal
+
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+# Bucket of the per-consumer limit every request is checked against
+GLOBAL_BUCKET = 'global'
+
+class RateLimitPolicy(BaseModel):
+    """
+    A rate-limit bucket applied on top of the global per-consumer limit.
+
+    capacity/rate mean: bucket size and refill per second (token_bucket), requests
+    per capacity/rate-second window (sliding_window), burst and sustained rate (gcra).
+    """
+    # Part of the Redis key; must be unique across all policies, and not GLOBAL_BUCKET
+    name: str
+    capacity: int = Field(gt=0)
+    rate: float = Field(gt=0)
+    algorithm: Literal['token_bucket', 'sliding_window', 'gcra'] = 'token_bucket'
+    # Path prefix (segment-aware); only used for policies in Settings.rate_limit
+    prefix: str | None = None
+    # Restrict to these HTTP methods / consumer tiers (None = all)
+    methods: list[str] | None = None
+    tiers: list[str] | None = None
+
+    @field_validator('methods')
+    @classmethod
+    def _upper_methods(cls, methods: list[str] | None) -> list[str] | None:
+        return None if methods is None else [method.upper() for method in methods]
+
+    @field_validator('name')
+    @classmethod
+    def _not_reserved(cls, name: str) -> str:
+        if name == GLOBAL_BUCKET:
+            raise ValueError(f"policy name {GLOBAL_BUCKET!r} is reserved for the global limit")
+        return name
+
+class UpstreamTarget(BaseModel):
+    url: str
+    weight: int = Field(default=1, ge=1)
+
+class HealthCheck(BaseModel):
+    """Active health probing of a route's upstream targets."""
+    path: str = '/health'
+    interval: float = Field(default=5.0, gt=0.0)
+    timeout: float = Field(default=1.0, gt=0.0)
+    unhealthy_threshold: int = Field(default=2, ge=1)
+
+class OutlierDetection(BaseModel):
+    """Passive ejection of targets that keep failing at the transport level."""
+    consecutive_failures: int = Field(default=5, ge=1)
+    ejection_seconds: float = Field(default=30.0, gt=0.0)
+
+class CircuitBreakerPolicy(BaseModel):
+    """Fail fast with 503 while an upstream target keeps erroring or timing out."""
+    # Rolling window the error rate is computed over, in seconds
+    window: float = Field(default=10.0, gt=0.0)
+    # Fewer calls than this in the window never trip the breaker
+    min_requests: int = Field(default=20, ge=1)
+    # Fraction of failed calls that opens the breaker
+    error_rate: float = Field(default=0.5, gt=0.0, le=1.0)
+    # Calls slower than this (to response headers) count as failures
+    slow_call_seconds: float = Field(default=5.0, gt=0.0)
+    # Time spent open before letting probe requests through (half-open)
+    open_seconds: float = Field(default=30.0, gt=0.0)
+    # Probe requests allowed while half-open; all must succeed to close again
+    half_open_requests: int = Field(default=5, ge=1)
+
+class ConcurrencyLimit(BaseModel):
+    """
+    Adaptive cap on in-flight requests per upstream target (AIMD).
+
+    The limit grows by one per round of successful calls while it is being used, and
+    shrinks by `backoff` when a call fails or its latency exceeds `latency_tolerance`
+    times the lowest recently observed latency.
+    """
+    initial_limit: int = Field(default=20, ge=1)
+    min_limit: int = Field(default=1, ge=1)
+    max_limit: int = Field(default=1000, ge=1)
+    latency_tolerance: float = Field(default=2.0, gt=1.0)
+    backoff: float = Field(default=0.9, gt=0.0, lt=1.0)
+
+class CachePolicy(BaseModel):
+    """Response caching for a route's GET/HEAD requests."""
+    # Freshness when the upstream sends no Cache-Control max-age/Expires (0 = don't cache)
+    default_ttl: float = Field(default=0.0, ge=0.0)
+    max_ttl: float = Field(default=86400.0, ge=0.0)
+    # Serve stale while refreshing in the background, unless the upstream says otherwise
+    stale_while_revalidate: float = Field(default=0.0, ge=0.0)
+    # How long stale entries with ETag/Last-Modified are kept for conditional requests
+    revalidate_window: float = Field(default=300.0, ge=0.0)
+    # Larger responses are streamed through without being cached
+    max_entry_bytes: int = Field(default=1024 * 1024, gt=0)
+    # Also store entries in Redis, shared by all gateway instances
+    shared: bool = False
+
+class CoalescePolicy(BaseModel):
+    """Single-flight sharing of identical concurrent GET/HEAD upstream requests."""
+    # Requests that may join one in-flight upstream call; later ones go upstream themselves
+    max_waiters: int = Field(default=100, ge=1)
+    # Request headers that must match for two requests to share a response; keep the
+    # credentials ones (x-api-key is the consumer identity) unless responses are public
+    key_headers: list[str] = Field(default_factory=lambda: [
+        'accept', 'accept-encoding', 'accept-language', 'authorization', 'cookie',
+        'x-api-key',
+    ])
+    # New requests stop joining a flight once its body has grown past this; after
+    # that, the upstream is read no further ahead of the slowest reader than this
+    max_body_bytes: int = Field(default=1024 * 1024, gt=0)
+
+    @field_validator('key_headers')
+    @classmethod
+    def _lower_headers(cls, names: list[str]) -> list[str]:
+        return [name.lower() for name in names]
+
+class HedgePolicy(BaseModel):
+    """Send a second attempt when the first is slower than most of the route's calls."""
+    # Hedge once the first attempt has waited this percentile of recent latencies
+    percentile: float = Field(default=0.95, gt=0.0, lt=1.0)
+    # Never hedge sooner than this, nor before `min_samples` latencies were seen
+    min_delay_ms: float = Field(default=5.0, ge=0.0)
+    min_samples: int = Field(default=100, ge=1)
+
+class RetryPolicy(BaseModel):
+    """
+    Retries of failed upstream attempts, preferably on another target.
+
+    Requests that never reached the upstream (connect errors, pool timeouts) are
+    always retried. Others only if their method is idempotent (or they carry
+    `idempotency_header`) and their body can be sent again.
+    """
+    # Total attempts, the first one included
+    attempts: int = Field(default=3, ge=1)
+    methods: list[str] = Field(default_factory=lambda: [
+        'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+    idempotency_header: str | None = 'idempotency-key'
+    # Upstream answers retried like transport errors (idempotent requests only)
+    statuses: list[int] = Field(default_factory=lambda: [502, 503, 504])
+    # Full-jitter exponential backoff: uniform(0, min(max, base * 2^retry))
+    backoff_base_ms: float = Field(default=25.0, ge=0.0)
+    backoff_max_ms: float = Field(default=250.0, ge=0.0)
+    # Retries and hedges may add at most this fraction of the route's requests...
+    budget_ratio: float = Field(default=0.2, ge=0.0)
+    # ...plus this many per second, so quiet routes can still retry
+    budget_min_per_second: float = Field(default=10.0, ge=0.0)
+    hedge: HedgePolicy | None = None
+
+    @field_validator('methods')
+    @classmethod
+    def _upper_methods(cls, methods: list[str]) -> list[str]:
+        return [method.upper() for method in methods]
+
+    @field_validator('idempotency_header')
+    @classmethod
+    def _lower_header(cls, name: str | None) -> str | None:
+        return None if name is None else name.lower()
+
+class WebSocketPolicy(BaseModel):
+    """WebSocket (HTTP Upgrade) tunnels to a route's upstream."""
+    # Tunnels with no message in either direction for this long are closed
+    idle_timeout: float = Field(default=300.0, gt=0.0)
+    # Tunnels are closed this long after the handshake (None = no limit)
+    max_lifetime: float | None = Field(default=None, gt=0.0)
+    open_timeout: float = Field(default=10.0, gt=0.0)
+    # Per-direction buffering: larger messages close the tunnel (1009); the upstream
+    # reader pauses with max_queue messages pending, writers with write_limit bytes
+    max_message_bytes: int = Field(default=1024 * 1024, gt=0)
+    max_queue: int = Field(default=16, ge=1)
+    write_limit: int = Field(default=32 * 1024, ge=0)
+    # permessage-deflate to the upstream; costs a zlib context per tunnel
+    compression: bool = False
+
+class JsonTransform(BaseModel):
+    """
+    Field projection and redaction of JSON bodies, applied as they stream.
+
+    Paths are dotted member names from the document root; '*' matches any member
+    name or array index, e.g. 'items.*.id'.
+    """
+    # Keep only these values and the objects/arrays leading to them (empty = all)
+    include: list[str] = Field(default_factory=list)
+    # Members dropped, name and value
+    remove: list[str] = Field(default_factory=list)
+    # Values replaced by `redaction`
+    redact: list[str] = Field(default_factory=list)
+    redaction: str | int | float | bool | None = '[REDACTED]'
+    # Longest member name or literal accepted, bounding what one document can hold in memory
+    max_key_bytes: int = Field(default=4096, gt=0)
+
+    @field_validator('include', 'remove', 'redact')
+    @classmethod
+    def _valid_paths(cls, paths: list[str]) -> list[str]:
+        for path in paths:
+            if not all(path.split('.')):
+                raise ValueError(f"invalid path {path!r}")
+        return paths
+
 
 class RouteRule(BaseModel):
     prefix: str
-    upstream: str
+    # Single upstream shorthand; equivalent to upstreams=[UpstreamTarget(url=...)]
+    upstream: str | None = None
+    upstreams: list[UpstreamTarget] = Field(default_factory=list)
+    balancer: Literal['round_robin', 'weighted', 'least_outstanding', 'p2c'] = 'round_robin'
+    health_check: HealthCheck | None = None
+    outlier: OutlierDetection = Field(default_factory=OutlierDetection)
+    circuit_breaker: CircuitBreakerPolicy | None = None
+    concurrency_limit: ConcurrencyLimit | None = None
+    # Read the whole request/response body into memory before proxying.
+    # Streaming is the default; buffering is meant for small JSON payloads.
+    buffered: bool = False
+    rate_limits: list[RateLimitPolicy] = Field(default_factory=list)
+    cache: CachePolicy | None = None
+    coalesce: CoalescePolicy | None = None
+    retry: RetryPolicy | None = None
+    # Body sizes, enforced while streaming (None = no cap). Larger requests get 413,
+    # larger upstream responses 502, or are cut off if streaming has begun
+    max_request_bytes: int | None = Field(default=None, gt=0)
+    max_response_bytes: int | None = Field(default=None, gt=0)
+    # Streaming rewrites of JSON bodies, the request's before it goes upstream
+    request_transform: JsonTransform | None = None
+    response_transform: JsonTransform | None = None
+    # Requests to this route handled at once; more wait in the admission queues
+    max_in_flight: int | None = Field(default=None, ge=1)
+    # WebSocket upgrades are refused unless the route sets a policy
+    websocket: WebSocketPolicy | None = None
+
+    @model_validator(mode='after')
+    def _normalize_upstreams(self) -> 'RouteRule':
+        if not self.upstreams:
+            if self.upstream is None:
+                raise ValueError("a route needs 'upstream' or 'upstreams'")
+            self.upstreams = [UpstreamTarget(url=self.upstream)]
+        elif self.upstream is None:
+            self.upstream = self.upstreams[0].url
+        return self
+
+class LeaseSettings(BaseModel):
+    """Local token pre-allocation in front of the Redis limiter (see LeasedRateLimiter)."""
+    # Max unspent tokens one instance may hold per key; bounds over-admission
+    max_drift: int = Field(default=10, ge=1)
+    # Lease the next batch in the background once this fraction is left
+    low_watermark: float = Field(default=0.25, ge=0.0, le=1.0)
+    # Seconds before unspent leased tokens are discarded
+    lease_ttl: float = Field(default=1.0, gt=0.0)
+
+class BatchSettings(BaseModel):
+    """Coalescing of concurrent limiter calls into pipelines (see BatchingRateLimiter)."""
+    # Longest a call waits for others to join its batch; 0 = same loop iteration
+    max_delay_ms: float = Field(default=1.0, ge=0.0)
+    max_batch: int = Field(default=128, ge=1)
+
+class RedisFailureSettings(BaseModel):
+    """What the rate limiter does while Redis is slow or down (see ResilientRateLimiter)."""
+    # 'open' admits every request, 'closed' rejects every request, 'local' enforces
+    # in-process buckets holding this instance's share of each limit
+    mode: Literal['open', 'closed', 'local'] = 'local'
+    # Longest a request waits on Redis for a rate-limit decision
+    timeout_ms: float = Field(default=50.0, gt=0.0)
+    # Longest script loading, reconnect attempts and heartbeats may take, in seconds
+    connect_timeout: float = Field(default=1.0, gt=0.0)
+    # Gateway instances sharing the limits; None = count live instances in Redis
+    instances: int | None = Field(default=None, ge=1)
+    # Seconds between instance heartbeats while Redis is up
+    heartbeat_seconds: float = Field(default=5.0, gt=0.0)
+    # Failed or timed-out calls open the breaker and Redis is skipped; open_seconds
+    # is also the interval between background reconnect attempts
+    breaker: CircuitBreakerPolicy = Field(default_factory=lambda: CircuitBreakerPolicy(
+        window=5.0, min_requests=5, open_seconds=1.0, half_open_requests=3))
+
+class RateLimitSettings(BaseModel):
+    lease: LeaseSettings | None = None
+    batch: BatchSettings | None = None
+    redis_failure: RedisFailureSettings = Field(default_factory=RedisFailureSettings)
+    # Timestamps for bucket state: this process's clock, or the Redis server's
+    # (no skew between instances, one extra command inside each script call)
+    clock: Literal['app', 'redis'] = 'app'
+    # Policies matched by path prefix, in addition to those on each RouteRule
+    policies: list[RateLimitPolicy] = Field(default_factory=list)
+    # API key -> consumer tier, for tier-scoped policies
+    consumers: dict[str, str] = Field(default_factory=dict)
+    default_tier: str = 'default'
+
+class PoolSettings(BaseModel):
+    """Connection pool, timeouts and protocol for an upstream client (None = no limit)."""
+    max_connections: int | None = 100
+    max_keepalive_connections: int | None = 20
+    keepalive_expiry: float | None = 5.0
+    connect_timeout: float | None = 20.0
+    read_timeout: float | None = 20.0
+    write_timeout: float | None = 20.0
+    # Longest a request may wait for a free connection
+    pool_timeout: float | None = 20.0
+    # HTTP/2 multiplexing; needs the 'h2' package
+    http2: bool = False
+    # Keep-alive connections opened at startup, by requesting HEAD warm_path
+    warm_connections: int = Field(default=0, ge=0)
+    warm_path: str = '/'
+
+class CacheSettings(BaseModel):
+    # Upper bound on the in-process cache tier, counted in stored bytes
+    max_bytes: int = Field(default=64 * 1024 * 1024, gt=0)
+    redis_prefix: str = 'cache:'
+    # Deadline for each shared-tier call; a failed lookup is a miss, a failed store is skipped
+    redis_timeout_ms: int = Field(default=50, gt=0)
+
+class CompressionSettings(BaseModel):
+    """Content-Encoding negotiation and compression of responses to clients."""
+    enabled: bool = True
+    # Server preference; encodings whose library is not installed are skipped
+    # (br needs 'brotli', zstd needs 'zstandard')
+    encodings: list[Literal['zstd', 'br', 'gzip']] = Field(
+        default_factory=lambda: ['zstd', 'br', 'gzip'])
+    # Responses known to be smaller are sent as they are
+    min_bytes: int = Field(default=1024, ge=0)
+    # Media types worth compressing ('text/*' matches every text type)
+    content_types: list[str] = Field(default_factory=lambda: [
+        'text/*', 'application/json', 'application/javascript', 'application/xml',
+        'application/*+json', 'application/*+xml', 'image/svg+xml',
+    ])
+    gzip_level: int = Field(default=6, ge=1, le=9)
+    brotli_quality: int = Field(default=4, ge=0, le=11)
+    zstd_level: int = Field(default=3, ge=1, le=22)
+    # Chunks/bodies at least this large are compressed on a worker thread
+    thread_threshold: int = Field(default=64 * 1024, ge=0)
+    threads: int = Field(default=4, ge=1)
+
+class PriorityClass(BaseModel):
+    """Admission share and patience of the consumer tiers listed."""
+    name: str
+    # Consumer tiers (see RateLimitSettings.consumers) in this class
+    tiers: list[str] = Field(default_factory=list)
+    # Slots each consumer of this class gets per round while requests queue
+    # (deficit round robin quantum); 0.5 means one every other round
+    weight: float = Field(default=1.0, gt=0.0)
+    # Queued requests are shed with 503 after waiting this long; 0 = never queue
+    queue_timeout: float = Field(default=1.0, ge=0.0)
+
+class AdmissionSettings(BaseModel):
+    """Admission control in front of the rate limiter (see AdmissionController)."""
+    enabled: bool = True
+    # Requests this worker handles at once (None = no global cap); per-route caps
+    # are RouteRule.max_in_flight
+    max_in_flight: int | None = Field(default=1000, ge=1)
+    # Requests waiting for a slot, in all and per consumer; more are shed at once
+    max_queued: int = Field(default=1000, ge=0)
+    max_queued_per_consumer: int = Field(default=50, ge=0)
+    classes: list[PriorityClass] = Field(default_factory=lambda: [PriorityClass(name='default')])
+    # Class of consumers whose tier no class lists
+    default_class: str = 'default'
+    # Retry-After sent with shed requests, in seconds
+    retry_after: float = Field(default=1.0, ge=0.0)
+
+    @model_validator(mode='after')
+    def _known_default_class(self) -> 'AdmissionSettings':
+        if not any(cls.name == self.default_class for cls in self.classes):
+            raise ValueError(f"default_class {self.default_class!r} is not in 'classes'")
+        return self
+
+class TracingSettings(BaseModel):
+    """Request traces (W3C traceparent), kept by tail sampling, and their export."""
+    enabled: bool = True
+    # Every request is traced in memory; once it has finished its spans are kept if
+    # it took at least slow_ms, failed with a 5xx (keep_errors) or was sampled at
+    # sample_ratio, and dropped otherwise
+    slow_ms: float = Field(default=500.0, ge=0.0)
+    keep_errors: bool = True
+    sample_ratio: float = Field(default=0.0, ge=0.0, le=1.0)
+    # Kept traces held in memory for /_gateway/traces
+    buffer_size: int = Field(default=256, ge=1)
+    # Kept traces are exported as OTLP/JSON: appended to a file (one request per
+    # line, as the OpenTelemetry collector's file exporter writes them) and/or
+    # POSTed to an OTLP/HTTP collector, e.g. 'http://collector:4318/v1/traces'
+    export_file: str | None = None
+    otlp_endpoint: str | None = None
+    export_interval: float = Field(default=5.0, gt=0.0)
+    # Traces waiting for export beyond this are dropped, oldest first
+    max_pending: int = Field(default=2048, ge=1)
+    service_name: str = 'api-gateway'
+    # Longest capture /_gateway/profile may be asked for, in seconds
+    max_profile_seconds: float = Field(default=60.0, gt=0.0)
+    # The profiler walks every task's await chain on the event loop: no more often
+    # than this, and over at most profile_max_tasks tasks per walk
+    profile_task_interval_ms: float = Field(default=50.0, ge=10.0)
+    profile_max_tasks: int = Field(default=1000, ge=1)
+
+class AdminSettings(BaseModel):
+    """Access to the endpoints that expose traffic or cost CPU (traces, profiling)."""
+    # Client addresses or networks let in without a token
+    allow: list[str] = Field(default_factory=lambda: ['127.0.0.1/32', '::1/128'])
+    # Bearer token that lets any client in; None = GATEWAY_ADMIN_TOKEN, if set
+    token: str | None = None
+
+    @field_validator('allow')
+    @classmethod
+    def _valid_networks(cls, networks: list[str]) -> list[str]:
+        for network in networks:
+            ip_network(network, strict=False)
+        return networks
+
+class RedisSettings(BaseModel):
+    """Redis deployment behind the rate limiter and the shared cache tier."""
+    # A single node, or any node of a Redis Cluster; None = REDIS_URL
+    url: str | None = None
+    # Treat `url` as a Redis Cluster; keys are routed by hash slot
+    cluster: bool = False
+    # Independent nodes the rate-limit buckets are spread over by consistent hashing
+    # of the consumer (instead of `url`); the first one also serves everything else
+    shards: list[str] = Field(default_factory=list)
+    # Connection pool per node
+    max_connections: int = Field(default=64, ge=1)
+    # Longest a command waits for a free pooled connection
+    pool_timeout: float = Field(default=1.0, gt=0.0)
+    socket_timeout: float | None = 5.0
+    socket_connect_timeout: float | None = 1.0
+    # Seconds an idle pooled connection may sit before it is checked; 0 = never
+    health_check_interval: float = Field(default=30.0, ge=0.0)
+
+    @model_validator(mode='after')
+    def _one_topology(self) -> 'RedisSettings':
+        if self.cluster and self.shards:
+            raise ValueError("use either 'cluster' or 'shards', not both")
+        return self
 
 class Settings(BaseModel):
     routes: list[RouteRule] = Field(default_factory=list)
+    rate_limit: RateLimitSettings = Field(default_factory=RateLimitSettings)
+    # Shared upstream client, used for origins without their own pool
+    default_pool: PoolSettings = Field(default_factory=PoolSettings)
+    # Dedicated pools keyed by upstream origin, e.g. 'http://users-service:8000'
+    upstream_pools: dict[str, PoolSettings] = Field(default_factory=dict)
+    cache: CacheSettings = Field(default_factory=CacheSettings)
+    redis: RedisSettings = Field(default_factory=RedisSettings)
+    compression: CompressionSettings = Field(default_factory=CompressionSettings)
+    admission: AdmissionSettings = Field(default_factory=AdmissionSettings)
+    tracing: TracingSettings = Field(default_factory=TracingSettings)
+    admin: AdminSettings = Field(default_factory=AdminSettings)
+    # Number of recent path lookups kept by the compiled router
+    route_cache_size: int = 4096
+
+    @model_validator(mode='after')
+    def _unique_policy_names(self) -> 'Settings':
+        # The name is the policy's bucket key: two policies with one name would share it
+        seen = set()
+        for policy in [*self.rate_limit.policies,
+                       *(policy for rule in self.routes for policy in rule.rate_limits)]:
+            if policy.name in seen:
+                raise ValueError(f"duplicate rate-limit policy name {policy.name!r}")
+            seen.add(policy.name)
+        return self
 
 # default in-memory config
 settings = Settings(
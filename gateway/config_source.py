@@ -0,0 +1,207 @@
+import asyncio
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from os import getenv
+
+from redis.asyncio import Redis
+
+from .admission import AdmissionController
+from .config import Settings, settings
+from .routing import Router, get_router, publish_router
+
+# External, hot-reloadable gateway configuration.
+#
+# Settings can come from a YAML/JSON file (GATEWAY_CONFIG_FILE) or a Redis key
+# (GATEWAY_CONFIG_KEY) instead of the defaults in config.py. Either is validated with
+# the Settings model. The whole document applies at startup; afterwards, changes to
+# routes and rate-limit policies/consumers are swapped in live, and everything else
+# (pools, cache sizes, how the limiter talks to Redis) waits for the next restart.
+#
+# A file is watched by polling its stat() signature. A Redis key is re-read whenever
+# a message arrives on the channel of the same name, so writers should
+# SET the key and then PUBLISH to it (see publish_config).
+
+logger = logging.getLogger('uvicorn.error')
+
+# Settings sections that can only take effect on restart
+RESTART_FIELDS = ('default_pool', 'upstream_pools', 'cache', 'redis', 'compression')
+# ... and the rate_limit ones, which shape the limiter built at startup
+RESTART_RATE_LIMIT_FIELDS = ('lease', 'batch', 'redis_failure', 'clock')
+
+
+def parse_settings(data: str | bytes, fmt: str) -> Settings:
+    """Validate a 'json' or 'yaml' document as Settings."""
+    if fmt == 'json':
+        raw = json.loads(data)
+    else:
+        try:
+            import yaml
+        except ImportError:
+            raise RuntimeError("YAML config needs PyYAML (pip install 'python-api-gateway[yaml]')")
+        raw = yaml.safe_load(data)
+    return Settings.model_validate(raw or {})
+
+
+def config_format(name: str) -> str:
+    return 'json' if name.endswith('.json') else 'yaml'
+
+
+def replace_settings(new: Settings) -> None:
+    """Adopt every section of `new`; for startup, before anything reads settings."""
+    for name in Settings.model_fields:
+        setattr(settings, name, getattr(new, name))
+
+
+def apply_settings(new: Settings, admission: AdmissionController | None = None) -> None:
+    """
+    Hot-swap routes and rate-limit policies from `new`.
+
+    The routing table is compiled first; publishing it and the new rate-limit
+    settings then happens without an await in between, so every request sees
+    either the old or the new configuration, never a mix, and lookups take no locks.
+    Per-route admission gates of routes that are gone or uncapped are dropped.
+    """
+    current = settings.rate_limit
+    rate_limit = new.rate_limit.model_copy(update={
+        name: getattr(current, name) for name in RESTART_RATE_LIMIT_FIELDS
+    })
+    router = Router(new.routes, cache_size=new.route_cache_size, previous=get_router())
+
+    for name in RESTART_RATE_LIMIT_FIELDS:
+        if getattr(current, name) != getattr(new.rate_limit, name):
+            logger.warning("Config reload: 'rate_limit.%s' changes apply on restart", name)
+    for name in RESTART_FIELDS:
+        if getattr(settings, name) != getattr(new, name):
+            logger.warning("Config reload: '%s' changes apply on restart", name)
+
+    settings.route_cache_size = new.route_cache_size
+    settings.rate_limit = rate_limit
+    publish_router(router)
+    if admission is not None:
+        admission.prune(new.routes)
+    logger.info("Config reloaded: %d routes", len(new.routes))
+
+
+class ConfigWatcher(ABC):
+    """
+    Background task applying configuration changes from a source.
+
+    Set `admission` to the worker's AdmissionController so reloads prune its gates.
+    """
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+        self.admission: AdmissionController | None = None
+
+    @abstractmethod
+    async def read(self) -> Settings:
+        """The source's current document."""
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def reload(self) -> bool:
+        """Read and apply the source; a broken document keeps the current config."""
+        try:
+            apply_settings(await self.read(), self.admission)
+        except Exception as exc:
+            logger.error("Config reload failed, keeping current config: %s", exc)
+            return False
+        return True
+
+    @abstractmethod
+    async def _run(self) -> None:
+        """Call reload() whenever the source changes, until cancelled."""
+
+
+class FileConfigWatcher(ConfigWatcher):
+    def __init__(self, path: str, interval: float = 2.0):
+        super().__init__()
+        self.path = path
+        self.interval = interval
+        self._signature = self._stat()
+
+    def _stat(self) -> tuple | None:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    async def read(self) -> Settings:
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        return parse_settings(data, config_format(self.path))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            signature = self._stat()
+            if signature is not None and signature != self._signature:
+                self._signature = signature
+                await self.reload()
+
+
+class RedisConfigWatcher(ConfigWatcher):
+    def __init__(self, redis: Redis, key: str, fmt: str = 'json', retry: float = 1.0):
+        super().__init__()
+        self.redis = redis
+        self.key = key
+        self.fmt = fmt
+        self.retry = retry
+
+    async def read(self) -> Settings:
+        data = await self.redis.get(self.key)
+        if data is None:
+            raise LookupError(f"config key {self.key!r} not found")
+        return parse_settings(data, self.fmt)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.key)
+                    # Catch up on anything published while (re)subscribing
+                    await self.reload()
+                    async for message in pubsub.listen():
+                        if message['type'] == 'message':
+                            await self.reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("Config subscription to %r lost: %s", self.key, exc)
+                await asyncio.sleep(self.retry)
+
+    async def stop(self) -> None:
+        await super().stop()
+        await self.redis.aclose()
+
+
+async def publish_config(redis: Redis, key: str, data: str | bytes) -> None:
+    """Store a config document and notify every gateway watching `key`."""
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.set(key, data)
+        pipe.publish(key, b'reload')
+        await pipe.execute()
+
+
+def watcher_from_env() -> ConfigWatcher | None:
+    """Watcher for GATEWAY_CONFIG_FILE or GATEWAY_CONFIG_KEY, if either is set."""
+    path = getenv('GATEWAY_CONFIG_FILE')
+    if path:
+        return FileConfigWatcher(path, interval=float(getenv('GATEWAY_CONFIG_POLL', '2.0')))
+    key = getenv('GATEWAY_CONFIG_KEY')
+    if key:
+        redis = Redis.from_url(getenv("REDIS_URL", "redis://localhost:6379"))
+        return RedisConfigWatcher(redis, key, fmt=getenv('GATEWAY_CONFIG_FORMAT', 'json'))
+    return None
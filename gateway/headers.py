@@ -0,0 +1,117 @@
+from collections.abc import Mapping
+
+# Header handling on raw ASGI/httpx header lists.
+#
+# Headers stay (bytes, bytes) pairs from the client socket to the upstream request and
+# back, so nothing is decoded to str and re-encoded on the hot path, duplicates (several
+# Cookie or Forwarded lines) survive, and their order is kept. ASGI servers and httpx
+# both hand out lower-cased header names, which is what the filter sets below match.
+
+RawHeaders = list[tuple[bytes, bytes]]
+
+# RFC 9110 section 7.6.1, plus the obsolete names still seen in the wild
+HOP_BY_HOP = frozenset({
+    b'connection',
+    b'keep-alive',
+    b'proxy-authenticate',
+    b'proxy-authorization',
+    b'proxy-connection',
+    b'te',
+    b'trailer',
+    b'trailers',
+    b'transfer-encoding',
+    b'upgrade',
+})
+
+# Set by the gateway itself; client-supplied values would be spoofable
+_REQUEST_DROPPED = HOP_BY_HOP | {b'host', b'x-forwarded-proto', b'x-real-ip'}
+_REQUEST_DROPPED_TRACED = _REQUEST_DROPPED | {b'traceparent'}
+
+_RESPONSE_DROPPED = HOP_BY_HOP
+# Negotiated separately on each leg of a WebSocket tunnel
+_HANDSHAKE = frozenset({b'sec-websocket-key', b'sec-websocket-version',
+                        b'sec-websocket-extensions', b'sec-websocket-protocol',
+                        b'sec-websocket-accept'})
+_RESPONSE_DROPPED_DECODED = _RESPONSE_DROPPED | {b'content-encoding', b'content-length'}
+
+def _with_connection_tokens(raw: RawHeaders, dropped: frozenset[bytes]) -> frozenset[bytes]:
+    """`dropped` plus the header names a Connection header lists as hop-by-hop."""
+    listed = [
+        token.strip().lower()
+        for name, value in raw if name == b'connection'
+        for token in value.split(b',')
+    ]
+    return dropped.union(listed) if listed else dropped
+
+
+def forward_request_headers(raw: RawHeaders,
+                            client_host: str | None,
+                            scheme: str,
+                            traceparent: bytes | None = None) -> RawHeaders:
+    """
+    Client request headers as they should be sent upstream.
+
+    Drops hop-by-hop headers (including those named in Connection), moves Host to
+    X-Forwarded-Host, appends the client address to X-Forwarded-For and sets
+    X-Forwarded-Proto and X-Real-IP. A `traceparent` given replaces the client's
+    (tracestate is passed on as it is).
+    """
+    dropped = _with_connection_tokens(
+        raw, _REQUEST_DROPPED if traceparent is None else _REQUEST_DROPPED_TRACED)
+    forwarded_for = None
+    headers = []
+    for name, value in raw:
+        if name not in dropped:
+            if name == b'x-forwarded-for':
+                forwarded_for = value if forwarded_for is None else forwarded_for + b', ' + value
+            else:
+                headers.append((name, value))
+        elif name == b'host':
+            # Preserve original host in new 'X-Forwarded-Host' header
+            headers.append((b'x-forwarded-host', value))
+
+    client = (client_host or 'unknown').encode('latin-1')
+    headers.append((b'x-forwarded-for',
+                    client if forwarded_for is None else forwarded_for + b', ' + client))
+    headers.append((b'x-forwarded-proto', scheme.encode('latin-1')))
+    headers.append((b'x-real-ip', client))
+    if traceparent is not None:
+        headers.append((b'traceparent', traceparent))
+    return headers
+
+
+def forward_handshake_headers(raw: RawHeaders,
+                              client_host: str | None,
+                              scheme: str) -> RawHeaders:
+    """forward_request_headers() for a WebSocket handshake, minus the Sec-WebSocket-* ones."""
+    return [(name, value) for name, value in forward_request_headers(raw, client_host, scheme)
+            if name not in _HANDSHAKE]
+
+
+def response_headers(raw: RawHeaders, decoded: bool = True) -> RawHeaders:
+    """
+    Upstream response headers that are safe to relay to the client.
+
+    With `decoded` (the body is relayed as httpx decoded it) an upstream
+    Content-Encoding is dropped, and with it Content-Length, which then no longer
+    applies. Otherwise both are kept for a body relayed byte for byte.
+    """
+    dropped = _RESPONSE_DROPPED
+    if decoded:
+        for name, _ in raw:
+            if name == b'content-encoding':
+                dropped = _RESPONSE_DROPPED_DECODED
+                break
+    dropped = _with_connection_tokens(raw, dropped)
+    return [(name, value) for name, value in raw if name not in dropped]
+
+def replace_headers(raw: RawHeaders, updates: Mapping[str, str]) -> RawHeaders:
+    """Copy of `raw` with every header named in `updates` replaced by its new value."""
+    encoded = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+               for name, value in updates.items()]
+    names = {name for name, _ in encoded}
+    return [(name, value) for name, value in raw if name not in names] + encoded
+
+
+def decode_headers(raw: RawHeaders) -> list[tuple[str, str]]:
+    return [(name.decode('latin-1'), value.decode('latin-1')) for name, value in raw]
@@ -1,120 +1,715 @@
+import asyncio
+import hmac
+from collections.abc import AsyncIterator, Awaitable, Callable
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, Response, HTTPException
+from math import ceil
+from fastapi import Depends, FastAPI, Request, Response, HTTPException, WebSocket
+from fastapi.responses import PlainTextResponse
 import httpx
-from os import getenv
-from redis.asyncio import Redis
+from ipaddress import ip_address, ip_network
+from os import getenv, getpid
+from websockets.exceptions import InvalidHandshake, InvalidStatus
+from time import monotonic, perf_counter, time
 
-from .middleware import RateLimitMiddleware
-from .rate_limit import RateLimiter
-from .routing import find_upstream
+from .admission import AdmissionController
+from .balancing import HealthChecker, Target, UpstreamPool
+from .bodies import (BodyTooLarge, LimitedStream, TransformError, declared_length, is_json,
+                     limited, rewritten_headers, transformed)
+from .cache import (CacheEntry, ResponseCache, build_entry, conditional_headers,
+                    parse_cache_control, read_limited, refreshed, request_cacheable,
+                    tee_into_cache)
+from .compression import DECODABLE, ContentEncoder, accepts, parse_accept_encoding, with_vary
+from .metrics import LoopLagMonitor, MetricsMiddleware, connect_tracer, metrics
+from .middleware import AdmissionMiddleware, RateLimitMiddleware
+from .pools import UpstreamClients, build_client
+from .profiling import Profiler, collapsed
+from .protection import UpstreamRejected
+from .config import CachePolicy, RouteRule, settings
+from .config_source import replace_settings, watcher_from_env
+from .headers import (RawHeaders, decode_headers, forward_handshake_headers,
+                      forward_request_headers, replace_headers, response_headers)
+from .rate_limit import (RateLimiter, BatchingRateLimiter, LeasedRateLimiter,
+                         ResilientRateLimiter, ShardedRateLimiter)
+from .redis_client import build_redis, redis_urls
+from .retries import OnceBody
+from .routing import get_router, match_route
+from .singleflight import SingleFlight
+from .streaming import ReleasingStream, UpstreamStreamingResponse, request_body_stream
+from .tracing import Tracer, TracingMiddleware, current_traceparent, record
+from .tunnel import Tunnels, connect_upstream, deny, websocket_url
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for startup and shutdown logic."""
     #---- Startup ----
+    # External config replaces the in-code defaults before anything reads them
+    config_watcher = watcher_from_env()
+    if config_watcher is not None:
+        replace_settings(await config_watcher.read())
+
     if not hasattr(app.state, 'limiter'):
-        redis = Redis.from_url(getenv("REDIS_URL", "redis://localhost:6379"))
-        print("Redis ping success:", await redis.ping())
+        urls = redis_urls(settings.redis)
+        clients = [build_redis(url, settings.redis) for url in urls]
+
+        batch = settings.rate_limit.batch
+        clock = settings.rate_limit.clock
+        if batch is not None:
+            shards = [BatchingRateLimiter(client,
+                                          max_delay=batch.max_delay_ms / 1000,
+                                          max_batch=batch.max_batch,
+                                          clock=clock)
+                      for client in clients]
+        else:
+            shards = [RateLimiter(client, clock=clock) for client in clients]
+        sharded = ShardedRateLimiter(shards, names=urls) if len(shards) > 1 else None
+        limiter = shards[0] if sharded is None else sharded
+
+        lease = settings.rate_limit.lease
+        if lease is not None:
+            limiter = LeasedRateLimiter(limiter,
+                                        max_drift=lease.max_drift,
+                                        low_watermark=lease.low_watermark,
+                                        lease_ttl=lease.lease_ttl)
 
-        limiter = RateLimiter(redis)
+        # Bounded: an unreachable Redis means starting degraded, not blocking startup
+        # A breaker per shard, so one node being down degrades only its consumers
+        limiter = ResilientRateLimiter(limiter, clients[0], settings.rate_limit.redis_failure,
+                                       sharding=sharded)
         await limiter.load()
+        limiter.start()
 
-        app.state.redis = redis
+        # The first node also backs the shared cache tier and instance heartbeats
+        app.state.redis = clients[0]
+        app.state.redis_shards = clients
         app.state.limiter = limiter
 
     if not hasattr(app.state, 'http_client'):
-        app.state.http_client = httpx.AsyncClient(timeout=20.0)
+        app.state.http_client = build_client(settings.default_pool)
+
+    if not hasattr(app.state, 'upstream_clients'):
+        app.state.upstream_clients = UpstreamClients(settings.upstream_pools)
+        await app.state.upstream_clients.warm_up()
+
+    if not hasattr(app.state, 'response_cache'):
+        app.state.response_cache = ResponseCache(
+            settings.cache.max_bytes,
+            redis=getattr(app.state, 'redis', None),
+            redis_prefix=settings.cache.redis_prefix,
+            redis_timeout=settings.cache.redis_timeout_ms / 1000)
+
+    if not hasattr(app.state, 'singleflight'):
+        app.state.singleflight = SingleFlight()
+
+    if not hasattr(app.state, 'content_encoder'):
+        app.state.content_encoder = ContentEncoder(settings.compression)
+
+    if not hasattr(app.state, 'admission'):
+        app.state.admission = AdmissionController(settings.admission)
+    if config_watcher is not None:
+        config_watcher.admission = app.state.admission
+        config_watcher.start()
+
+    if not hasattr(app.state, 'tracer'):
+        app.state.tracer = Tracer(settings.tracing)
+    app.state.tracer.start()
+
+    if not hasattr(app.state, 'profiler'):
+        app.state.profiler = Profiler(
+            task_interval=settings.tracing.profile_task_interval_ms / 1000,
+            max_tasks=settings.tracing.profile_max_tasks)
+
+    if not hasattr(app.state, 'tunnels'):
+        app.state.tunnels = Tunnels()
+    app.state.tunnels.start()
+
+    # Probes go through whichever client and routing table are current
+    health_checker = HealthChecker(
+        pools=lambda: get_router().pools.values(),
+        client=lambda: app.state.http_client,
+    )
+    health_checker.start()
+
+    loop_lag = LoopLagMonitor()
+    loop_lag.start()
+    metrics.collectors.update(
+        pool=lambda: app.state.upstream_clients.snapshot(),
+        cache=lambda: app.state.response_cache.snapshot(),
+        coalescing=lambda: app.state.singleflight.snapshot(),
+        compression=lambda: app.state.content_encoder.snapshot(),
+        tunnels=lambda: app.state.tunnels.snapshot(),
+        admission=lambda: app.state.admission.snapshot(),
+        tracing=lambda: app.state.tracer.snapshot(),
+        upstream=upstream_gauges,
+        retries=retry_gauges,
+    )
+    if hasattr(app.state.limiter, 'snapshot'):
+        metrics.collectors['rate_limiter'] = app.state.limiter.snapshot
 
     try:
         yield
     finally:
         #---- Shutdown ----
+        if config_watcher is not None:
+            await config_watcher.stop()
+        await health_checker.stop()
+        if hasattr(app.state, 'tunnels'):
+            await app.state.tunnels.aclose()
+        if hasattr(app.state, 'tracer'):
+            await app.state.tracer.aclose()
+        await loop_lag.stop()
+        if hasattr(app.state, 'singleflight'):
+            await app.state.singleflight.aclose()
+        if hasattr(app.state, 'content_encoder'):
+            app.state.content_encoder.close()
+        if hasattr(app.state, 'response_cache'):
+            await app.state.response_cache.aclose()
         if hasattr(app.state, 'http_client'):
             await app.state.http_client.aclose()
-        if hasattr(app.state, 'redis'):
-            await app.state.redis.aclose()
+        if hasattr(app.state, 'upstream_clients'):
+            await app.state.upstream_clients.aclose()
+        if hasattr(getattr(app.state, 'limiter', None), 'close'):
+            await app.state.limiter.close()
+        for client in getattr(app.state, 'redis_shards', ()):
+            await client.aclose()
 
 application = FastAPI(lifespan=lifespan)
 
 application.add_middleware(RateLimitMiddleware, capacity=50, rate=1.0)
+application.add_middleware(AdmissionMiddleware)
+application.add_middleware(MetricsMiddleware)
+application.add_middleware(TracingMiddleware)
+
+@application.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint; not rate-limited."""
+    return PlainTextResponse(metrics.render(),
+                             media_type="text/plain; version=0.0.4; charset=utf-8")
+
+STARTED = monotonic()
+
+@application.get("/_gateway/health")
+async def health():
+    """Liveness of the worker process that answers; not rate-limited."""
+    return {
+        "status": "ok",
+        "worker": getenv("GATEWAY_WORKER_ID"),
+        "pid": getpid(),
+        "uptime": round(monotonic() - STARTED, 1),
+        "in_flight": metrics.in_flight,
+    }
+
+@application.get("/_gateway/upstreams")
+async def upstream_stats():
+    """Balancer, circuit breaker and concurrency limit state per route target."""
+    return {prefix: pool.stats() for prefix, pool in route_pools()}
+
+def route_pools():
+    router = get_router()
+    return [(rule.prefix, router.pools[id(rule)]) for rule in router.routes
+            if id(rule) in router.pools]
+
+def upstream_gauges() -> dict[str, dict]:
+    gauges = {}
+    for prefix, pool in route_pools():
+        for target in pool.stats():
+            gauges[f"{prefix} {target['url']}"] = {
+                'outstanding': target['outstanding'],
+                'latency_ms': target['latency_ms'],
+                'circuit_open': int(target['circuit'] == 'open'),
+                'concurrency_limit': target['concurrency_limit'],
+            }
+    return gauges
+
+def retry_gauges() -> dict[str, dict]:
+    return {prefix: pool.retrier.snapshot() for prefix, pool in route_pools()
+            if pool.retrier is not None}
+
+@application.get("/_gateway/retries")
+async def retry_stats():
+    """Retries, failovers, hedges and budget rejections per route with a retry policy."""
+    return retry_gauges()
+
+@application.get("/_gateway/pools")
+async def pool_stats(request: Request):
+    """Connection pool utilization and wait times, for sizing upstream pools."""
+    return request.app.state.upstream_clients.snapshot()
+
+@application.get("/_gateway/cache")
+async def cache_stats(request: Request):
+    """Response cache hit/miss and byte counters."""
+    return request.app.state.response_cache.snapshot()
+
+@application.get("/_gateway/coalescing")
+async def coalescing_stats(request: Request):
+    """Upstream calls started, requests that joined one, and requests over the waiter cap."""
+    return request.app.state.singleflight.snapshot()
+
+@application.get("/_gateway/compression")
+async def compression_stats(request: Request):
+    """Bodies passed through still encoded, decoded, and compressed by the gateway."""
+    return request.app.state.content_encoder.snapshot()
+
+@application.get("/_gateway/tunnels")
+async def tunnel_stats(request: Request):
+    """Open WebSocket tunnels and how closed ones ended."""
+    return request.app.state.tunnels.snapshot()
+
+@application.get("/_gateway/admission")
+async def admission_stats(request: Request):
+    """In-flight and queued requests per admission cap, and how many were shed."""
+    return request.app.state.admission.snapshot()
+
+def require_admin(request: Request) -> None:
+    """Let in allow-listed client addresses and bearers of the admin token; 403 otherwise."""
+    policy = settings.admin
+    token = policy.token or getenv("GATEWAY_ADMIN_TOKEN")
+    if token:
+        scheme, _, given = request.headers.get('authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(given.strip().encode(),
+                                                              token.encode()):
+            return
+    if request.client is not None:
+        try:
+            address = ip_address(request.client.host)
+        except ValueError:
+            address = None
+        if address is not None and any(address in ip_network(network, strict=False)
+                                       for network in policy.allow):
+            return
+    raise HTTPException(status_code=403, detail="Admin access required")
+
+@application.get("/_gateway/traces", dependencies=[Depends(require_admin)])
+async def traces(request: Request, limit: int = 50):
+    """Most recent traces kept by tail sampling (slow or failed requests), newest first."""
+    recent = request.app.state.tracer.recent
+    return [trace.summary() for trace in list(reversed(recent))[:max(limit, 0)]]
+
+@application.get("/_gateway/profile", dependencies=[Depends(require_admin)])
+async def profile(request: Request, seconds: float = 5.0, interval_ms: float = 10.0,
+                  format: str = 'json'):
+    """
+    Sample the event loop thread's stack and every task's await stack for `seconds`.
+
+    format=collapsed returns 'stack count' lines for flame graph tools.
+    """
+    if not 0 < seconds <= settings.tracing.max_profile_seconds:
+        raise HTTPException(status_code=400, detail="seconds must be in "
+                            f"(0, {settings.tracing.max_profile_seconds}]")
+    if interval_ms < 5:
+        raise HTTPException(status_code=400, detail="interval_ms must be at least 5")
+    try:
+        stacks = await request.app.state.profiler.profile(seconds, interval_ms / 1000)
+    except RuntimeError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    if format == 'collapsed':
+        return PlainTextResponse(collapsed(stacks))
+    return {kind: [{'stack': stack, 'count': count} for stack, count in counts.most_common(50)]
+            for kind, counts in stacks.items()}
+
+@application.websocket("/{path:path}")
+async def websocket_proxy(websocket: WebSocket, path: str):
+    """Tunnel a WebSocket upgrade to the route's upstream (rate-limited at handshake)."""
+    tunnels: Tunnels = websocket.app.state.tunnels
+    match = match_route("/" + path)
+    if match is None or match.rule.websocket is None:
+        tunnels.stats.refused += 1
+        await deny(websocket, 404, "No upstream route found")
+        return
+
+    pool, policy = match.pool, match.rule.websocket
+    try:
+        target = pool.pick()
+    except UpstreamRejected as exc:
+        tunnels.stats.refused += 1
+        await deny(websocket, 503, f"Upstream unavailable: {exc.reason}")
+        return
+
+    scheme = 'https' if websocket.url.scheme == 'wss' else 'http'
+    headers = forward_handshake_headers(websocket.headers.raw,
+                                        websocket.client.host if websocket.client else None,
+                                        scheme)
+    url = websocket_url(target.url, match.suffix, websocket.url.query)
+
+    pool.acquire(target)
+    try:
+        started = perf_counter()
+        try:
+            upstream = await connect_upstream(url, headers,
+                                              websocket.scope.get('subprotocols', []), policy)
+        except InvalidStatus as exc:
+            status = exc.response.status_code
+            pool.observe(target, perf_counter() - started, ok=status < 500)
+            tunnels.stats.refused += 1
+            await deny(websocket, status if status >= 400 else 502,
+                       "Upstream refused the WebSocket upgrade")
+            return
+        except (OSError, asyncio.TimeoutError, InvalidHandshake) as exc:
+            pool.report_failure(target)
+            tunnels.stats.upstream_errors += 1
+            await deny(websocket, 502, f"Upstream WebSocket unavailable: {exc}")
+            return
+        pool.observe(target, perf_counter() - started)
+        await tunnels.relay(websocket, upstream, policy)
+    finally:
+        pool.release(target)
 
 @application.api_route(
     path="/{path:path}",
     methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS", "HEAD"],
 )
 async def proxy(path: str, request: Request):
-    upstream, suffix = find_upstream("/" + path)
-    if not upstream:
+    started = perf_counter()
+    match = match_route("/" + path)
+    matched = perf_counter()
+    metrics.observe('route_match', matched - started)
+    record('route_match', started, matched)
+    if match is None:
         raise HTTPException(status_code=404, detail="No upstream route found")
+    request.scope['gateway.route'] = match.rule.prefix
 
-    url = upstream.rstrip("/") + suffix
-    raw_headers = request.headers.raw   # raw headers from client
-
-    # Debugging
-    # print('\n\nMAIN---all headers (raw) from initial request:')
-    # for k, v in raw_headers:
-    #     print(f"\t{k}  =  {v}")
-
-    hop_by_hop_headers = {
-            b'connection',
-            b'keep-alive',
-            b'proxy-authentication',
-            b'proxy-authorization',
-            b'te',
-            b'trailers',
-            b'transfer-encoding',
-            b'upgrade',
-        }
-
-    # decoded headers from raw_headers excluding hop_by_hop headers
-    headers = dict()
-    for k, v in raw_headers:
-        if k == b'host':
-            # Preserve original host in new 'X-Forwarded-Host' header
-            headers['X-Forwarded-Host'] = v.decode('latin-1')
-        elif k not in hop_by_hop_headers:
-            headers[k.decode('latin-1')] = v.decode('latin-1')
-
-    headers['X-Forwarded-Proto'] = request.url.scheme
-    headers['X-Real-IP'] = request.client.host
-
-    # Debugging
-    # print('\nMAIN---headers after removing hopybyhops:')
-    # for k, v in headers.items():
-    #     print(f"\t{k}  =  {v}")
-
-    body = await request.body()
+    rule, pool = match.rule, match.pool
+    max_request_bytes = rule.max_request_bytes
+    if (max_request_bytes is not None
+            and (declared_length(request.headers) or 0) > max_request_bytes):
+        raise HTTPException(status_code=413, detail="Request body too large")
+    try:
+        target = pool.pick()
+    except UpstreamRejected as exc:
+        headers = None if exc.retry_after is None else {"Retry-After": str(ceil(exc.retry_after))}
+        raise HTTPException(status_code=503, detail=f"Upstream unavailable: {exc.reason}",
+                            headers=headers)
+    headers = forward_request_headers(request.headers.raw,
+                                      request.client.host if request.client else None,
+                                      request.url.scheme,
+                                      current_traceparent())
 
-    # ---- Proxy Request ----
+    def attempt(target: Target, headers: RawHeaders, content=None) -> Awaitable[httpx.Response]:
+        client: httpx.AsyncClient = (request.app.state.upstream_clients.get(target.url)
+                                     or request.app.state.http_client)
+        url = target.url.rstrip("/") + match.suffix
+        return send_streamed(client, request, url, headers, pool, target, content=content,
+                             max_response_bytes=rule.max_response_bytes)
+
+    retrier = pool.retrier
+    idempotent = retrier is not None and retrier.idempotent(request.method, request.headers)
+
+    async def send(headers: RawHeaders, content=None) -> httpx.Response:
+        if retrier is None:
+            return await attempt(target, headers, content)
+        return await retrier.send(pool, target, lambda t: attempt(t, headers, content),
+                                  idempotent, content if isinstance(content, OnceBody) else None)
+
+    content = request_body_stream(request)
+    if content is not None:
+        if max_request_bytes is not None:
+            content = limited(content, max_request_bytes)
+        if rule.request_transform is not None and is_json(request.headers.get('content-type')):
+            content = transformed(content, rule.request_transform)
+            headers = rewritten_headers(headers)
+    coalesce = rule.coalesce
+    if request.method not in ('GET', 'HEAD') or content is not None:
+        coalesce = None
+    if retrier is not None and content is not None:
+        content = OnceBody(content)
+    flights: SingleFlight = request.app.state.singleflight
+
+    async def fetch(extra_headers: dict[str, str] | None = None) -> httpx.Response:
+        if extra_headers:
+            # Conditional requests are per-entry; they never share a flight
+            return await send(replace_headers(headers, extra_headers))
+        if coalesce is not None:
+            key = flights.key(request.method, request.url.path, request.url.query,
+                              request.headers, coalesce.key_headers)
+            return await flights.fetch(key, lambda: send(headers), coalesce)
+        return await send(headers, content)
+
+    cache: ResponseCache = request.app.state.response_cache
+    if rule.cache is not None and request_cacheable(request.method, request.headers):
+        return await proxy_cached(request, cache, rule.cache, fetch, rule)
+
+    if rule.buffered:
+        return await proxy_buffered(request, send, headers, content, rule)
+
+    # ---- Proxy Request (streamed) ----
+    resp = await fetch()
+
+    encoder: ContentEncoder = request.app.state.content_encoder
+    headers, content = encoder.relay(resp, request.headers.get('accept-encoding'),
+                                     transform=await response_transform(rule, resp))
+    return UpstreamStreamingResponse(resp, headers=headers, content=content)
+
+
+async def response_transform(rule: RouteRule, resp: httpx.Response
+                             ) -> Callable[[AsyncIterator[bytes]], AsyncIterator[bytes]] | None:
+    """The route's JSON rewrite for this response, if it has one and the body is JSON."""
+    policy = rule.response_transform
+    if policy is None or not is_json(resp.headers.get('content-type')):
+        return None
+    encoding = resp.headers.get('content-encoding', '').strip().lower()
+    if encoding and encoding != 'identity' and encoding not in DECODABLE:
+        await resp.aclose()
+        raise HTTPException(status_code=502,
+                            detail=f"Cannot transform a response in {encoding} encoding")
+    return lambda chunks: transformed(chunks, policy)
+
+
+async def send_streamed(client: httpx.AsyncClient,
+                        request: Request,
+                        url: str,
+                        headers: RawHeaders,
+                        pool: UpstreamPool,
+                        target: Target,
+                        content=None,
+                        max_response_bytes: int | None = None) -> httpx.Response:
+    """
+    Send the upstream request and return once response headers arrive.
+
+    The target stays acquired until the response is closed. A response declaring more
+    than `max_response_bytes` is refused here; one that doesn't is cut off as it streams.
+    """
+    upstream_request = client.build_request(
+        request.method,
+        url,
+        headers=headers,
+        content=content,
+        params=request.query_params
+    )
+    upstream_request.extensions['trace'] = connect_tracer()
+    pool.acquire(target)
+    started = perf_counter()
     try:
-        resp = await request.app.state.http_client.request(
-            request.method,
-            url,
-            headers=headers,
-            content=body,
-            params=request.query_params
-        )
+        resp = await client.send(upstream_request, stream=True)
+    except asyncio.CancelledError:
+        # Client gone or a hedged attempt lost the race; not the target's fault
+        pool.release(target)
+        record('upstream', started, target=target.url, cancelled=True)
+        raise
+    except BodyTooLarge as exc:
+        # The client's body, not the target's fault
+        pool.release(target)
+        raise HTTPException(status_code=413, detail="Request body too large") from exc
+    except TransformError as exc:
+        pool.release(target)
+        raise HTTPException(status_code=400, detail=f"Invalid JSON body: {exc}") from exc
     except Exception as exc:
-        raise HTTPException(status_code=502, detail=str(exc))
+        pool.release(target)
+        pool.report_failure(target)
+        record('upstream', started, target=target.url, error=repr(exc))
+        raise HTTPException(status_code=502, detail=str(exc)) from exc
+    headers_received = perf_counter()
+    pool.observe(target, headers_received - started, ok=resp.status_code < 500)
+    metrics.observe('upstream_ttfb', headers_received - started)
+    record('upstream', started, headers_received, target=target.url, status=resp.status_code)
 
-    # Debugging
-    # print('\nMAIN---response headers after state client proxy request:')
-    # for k, v in resp.headers.items():
-    #     print(f"\t{k}  =  {v}")
+    def release() -> None:
+        pool.release(target)
+        ended = perf_counter()
+        metrics.observe('upstream_body', ended - headers_received)
+        record('upstream_body', headers_received, ended)
 
-    filtered_headers = {
-        k: v for k, v in resp.headers.items()
-        if k.lower() not in {'content-encoding', 'transfer-encoding', 'connection'}
-    }
+    resp.stream = ReleasingStream(resp.stream, release)
+    if max_response_bytes is not None:
+        if (declared_length(resp.headers) or 0) > max_response_bytes:
+            await resp.aclose()
+            raise HTTPException(status_code=502, detail="Upstream response too large")
+        resp.stream = LimitedStream(resp.stream, max_response_bytes)
+    return resp
 
-    #Debugging
-    # print('\nMAIN---proxy request headers after filtering:')
-    # for k, v in filtered_headers.items():
-    #     print(f"\t{k}  =  {v}")
 
-    return Response(
-        content=resp.content,
-        status_code=resp.status_code,
-        headers=filtered_headers
-    )
+async def proxy_cached(request: Request,
+                       cache: ResponseCache,
+                       policy: CachePolicy,
+                       fetch: Callable[[dict[str, str]], Awaitable[httpx.Response]],
+                       rule: RouteRule) -> Response:
+    """
+    Serve GET/HEAD from the response cache, revalidating or filling it from upstream.
+
+    `fetch` sends the upstream request with extra (conditional) headers added. Entries
+    hold bodies after the route's response transform.
+    """
+    now = time()
+    head = request.method == 'HEAD'
+    base = request.url.path + ('?' + request.url.query if request.url.query else '')
+    directives = parse_cache_control(request.headers.get('cache-control'))
+    must_revalidate = 'no-cache' in directives or directives.get('max-age') == '0'
+
+    key, entry = await cache.get(base, request.headers, policy.shared)
+    if entry is not None and now >= entry.expires_at:
+        entry = None
+
+    if entry is not None and not must_revalidate:
+        if now < entry.fresh_until:
+            cache.stats.hits += 1
+            cache.stats.bytes_served += 0 if head else len(entry.body)
+            return await serve_entry(request, cache, key, entry, now)
+
+        if now < entry.stale_until:
+            cache.stats.stale_hits += 1
+            cache.stats.bytes_served += 0 if head else len(entry.body)
+            if cache.begin_revalidation(key):
+                cache.spawn(revalidate(cache, policy, request, base, key, entry, fetch, rule))
+            return await serve_entry(request, cache, key, entry, now)
+
+    resp = await fetch(conditional_headers(entry) if entry is not None else {})
+
+    if resp.status_code == 304 and entry is not None:
+        await resp.aclose()
+        cache.stats.revalidated += 1
+        updated = refreshed(entry, resp, policy, time())
+        if updated is not None:
+            await cache.put(base, updated[1], request.headers, updated[0], policy.shared)
+            key, entry = cache.variant_key(base, updated[1], request.headers), updated[0]
+        return await serve_entry(request, cache, key, entry, time())
+
+    cache.stats.misses += 1
+    encoder: ContentEncoder = request.app.state.content_encoder
+    accept_encoding = request.headers.get('accept-encoding')
+    declared = int(resp.headers.get('content-length', 0) or 0)
+    status = resp.status_code
+    transform = await response_transform(rule, resp)
+    stored_headers = response_headers(resp.headers.raw)
+    if transform is not None:
+        stored_headers = rewritten_headers(stored_headers)
+    stored_headers = decode_headers(stored_headers)
+
+    def tee(chunks: AsyncIterator[bytes], encoding: str | None) -> AsyncIterator[bytes]:
+        if head or declared > policy.max_entry_bytes:
+            return chunks
+
+        def store(body: bytes) -> None:
+            cache.spawn(store_entry(cache, encoder, policy, request, base, status,
+                                    stored_headers, body, encoding))
+
+        return tee_into_cache(chunks, policy.max_entry_bytes, store)
+
+    headers, content = encoder.relay(resp, accept_encoding, tee=tee, transform=transform)
+    return UpstreamStreamingResponse(resp, headers=headers, content=content)
+
+
+async def serve_entry(request: Request,
+                      cache: ResponseCache,
+                      key: str,
+                      entry: CacheEntry,
+                      now: float) -> Response:
+    """Cached response in an encoding the client accepts, compressing each variant once."""
+    head = request.method == 'HEAD'
+    encoder: ContentEncoder = request.app.state.content_encoder
+    accept_encoding = request.headers.get('accept-encoding')
+    accepted = parse_accept_encoding(accept_encoding)
+    encoding = next((name for name in entry.encoded if accepts(accepted, name)), None)
+    if encoding is None:
+        if not encoder.compressible(entry.status, dict(entry.headers), len(entry.body)):
+            return entry.to_response(now, head=head)
+        encoding = encoder.choose(accept_encoding)
+        if encoding is not None:
+            cache.add_encoded(key, entry, encoding, await encoder.compress(entry.body, encoding))
+    response = entry.to_response(now, head=head, encoding=encoding)
+    response.raw_headers = with_vary(response.raw_headers)
+    return response
+
+
+async def store_entry(cache: ResponseCache,
+                      encoder: ContentEncoder,
+                      policy: CachePolicy,
+                      request: Request,
+                      base: str,
+                      status: int,
+                      headers: list[tuple[str, str]],
+                      body: bytes,
+                      encoding: str | None) -> None:
+    """
+    Cache a body that was relayed to the client.
+
+    `encoding` is set when the body was passed through still upstream-compressed: it is
+    stored decoded, with the upstream bytes kept as that encoding's variant. Otherwise
+    the variant the client asked for is compressed up front for the next hits.
+    """
+    encoded = body
+    if encoding is not None:
+        if encoding not in DECODABLE:
+            return
+        body = await encoder.decode(encoded, encoding)
+    built = build_entry(status, headers, body, policy, time())
+    if built is None:
+        return
+    entry, vary = built
+    if encoding is None:
+        encoding = encoder.choose(request.headers.get('accept-encoding'))
+        if encoding is not None and encoder.compressible(status, dict(headers), len(body)):
+            entry.add_encoded(encoding, await encoder.compress(body, encoding))
+    else:
+        entry.add_encoded(encoding, encoded)
+    await cache.put(base, vary, request.headers, entry, policy.shared)
+
+
+async def revalidate(cache: ResponseCache,
+                     policy: CachePolicy,
+                     request: Request,
+                     base: str,
+                     key: str,
+                     entry: CacheEntry,
+                     fetch: Callable[[dict[str, str]], Awaitable[httpx.Response]],
+                     rule: RouteRule) -> None:
+    """Background refresh of a stale entry (stale-while-revalidate)."""
+    try:
+        resp = await fetch(conditional_headers(entry))
+        transform = await response_transform(rule, resp)
+    except HTTPException:
+        cache.end_revalidation(key)
+        return
+
+    try:
+        if resp.status_code == 304:
+            cache.stats.revalidated += 1
+            updated = refreshed(entry, resp, policy, time())
+        else:
+            headers = response_headers(resp.headers.raw)
+            chunks = resp.aiter_bytes()
+            if transform is not None:
+                headers, chunks = rewritten_headers(headers), transform(chunks)
+            body = await read_limited(chunks, policy.max_entry_bytes)
+            updated = None if body is None else build_entry(
+                resp.status_code, decode_headers(headers), body, policy, time()
+            )
+        if updated is not None:
+            await cache.put(base, updated[1], request.headers, updated[0], policy.shared)
+    except (BodyTooLarge, TransformError):
+        pass    # the stale entry stays until it expires
+    finally:
+        await resp.aclose()
+        cache.end_revalidation(key)
+
+
+async def proxy_buffered(request: Request,
+                         send: Callable[[RawHeaders, bytes], Awaitable[httpx.Response]],
+                         headers: RawHeaders,
+                         content: AsyncIterator[bytes] | None,
+                         rule: RouteRule) -> Response:
+    """Proxy with request and response bodies fully read into memory."""
+    try:
+        body = b'' if content is None else b''.join([chunk async for chunk in content])
+    except BodyTooLarge as exc:
+        raise HTTPException(status_code=413, detail="Request body too large") from exc
+    except TransformError as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON body: {exc}") from exc
+
+    # ---- Proxy Request ----
+    resp = await send(headers, body)
+    encoder: ContentEncoder = request.app.state.content_encoder
+    try:
+        headers, content = encoder.relay(resp, request.headers.get('accept-encoding'),
+                                         transform=await response_transform(rule, resp))
+        body = b''.join([chunk async for chunk in content])
+    except BodyTooLarge as exc:
+        raise HTTPException(status_code=502, detail="Upstream response too large") from exc
+    except TransformError as exc:
+        raise HTTPException(status_code=502, detail=f"Invalid upstream JSON: {exc}") from exc
+    finally:
+        await resp.aclose()
+
+    response = Response(content=body, status_code=resp.status_code)
+    if not any(name == b'content-length' for name, _ in headers):
+        headers.append((b'content-length', str(len(body)).encode()))
+    response.raw_headers = headers
+    return response
@@ -0,0 +1,226 @@
+import asyncio
+from bisect import bisect_left
+from collections.abc import Callable, Iterable
+from time import perf_counter
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .tracing import record
+
+# In-process metrics in the Prometheus text exposition format.
+#
+# Everything here is touched from the event loop thread only, so recording is a few
+# integer/float updates with no locks: histogram buckets are preallocated lists and a
+# sample lands in its bucket via one bisect. Label sets are bounded by configuration
+# (routes, phases) or fixed sets (methods, status classes), never by request data.
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Where a proxied request's time goes
+PHASES = ('admission', 'route_match', 'rate_limit', 'upstream_connect', 'upstream_ttfb',
+          'upstream_body', 'response_write')
+
+_STATUS_CLASSES = ('1xx', '2xx', '3xx', '4xx', '5xx')
+# Method labels; anything else a client sends is counted as 'other'
+METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS',
+                     'CONNECT', 'TRACE'})
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str = '') -> Iterable[str]:
+        sep = ',' if labels else ''
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}'
+        suffix = f'{{{labels}}}' if labels else ''
+        yield f'{name}_sum{suffix} {self.sum}'
+        yield f'{name}_count{suffix} {self.count}'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    def __init__(self):
+        self.requests: dict[tuple[str, str, str], int] = {}
+        self.latency: dict[str, Histogram] = {}
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.rate_limit = {'allowed': 0, 'denied': 0}
+        self.loop_lag = Histogram()
+        self.in_flight = 0
+        # name -> a component's snapshot(), exported as gateway_<name>_* gauges
+        self.collectors: dict[str, Callable[[], dict]] = {}
+
+    def record_request(self, route: str, method: str, status: int, duration: float) -> None:
+        key = (route, method if method in METHODS else 'other', _STATUS_CLASSES[min(max(status // 100, 1), 5) - 1])
+        self.requests[key] = self.requests.get(key, 0) + 1
+        histogram = self.latency.get(route)
+        if histogram is None:
+            histogram = self.latency[route] = Histogram()
+        histogram.observe(duration)
+
+    def observe(self, phase: str, seconds: float) -> None:
+        self.phases[phase].observe(seconds)
+
+    def render(self) -> str:
+        lines = [
+            '# HELP gateway_requests_total Requests by route, method and status class.',
+            '# TYPE gateway_requests_total counter',
+        ]
+        for (route, method, status), count in sorted(self.requests.items()):
+            lines.append(f'gateway_requests_total{{route="{_escape(route)}",'
+                         f'method="{method}",status="{status}"}} {count}')
+
+        lines += ['# HELP gateway_requests_in_flight Requests currently being handled.',
+                  '# TYPE gateway_requests_in_flight gauge',
+                  f'gateway_requests_in_flight {self.in_flight}']
+
+        lines += ['# HELP gateway_request_duration_seconds Time from request to last body byte.',
+                  '# TYPE gateway_request_duration_seconds histogram']
+        for route, histogram in sorted(self.latency.items()):
+            lines.extend(histogram.render('gateway_request_duration_seconds',
+                                          f'route="{_escape(route)}"'))
+
+        lines += ['# HELP gateway_phase_duration_seconds Time spent per request phase.',
+                  '# TYPE gateway_phase_duration_seconds histogram']
+        for phase, histogram in self.phases.items():
+            lines.extend(histogram.render('gateway_phase_duration_seconds', f'phase="{phase}"'))
+
+        lines += ['# HELP gateway_rate_limit_decisions_total Rate limiter decisions.',
+                  '# TYPE gateway_rate_limit_decisions_total counter']
+        for result, count in self.rate_limit.items():
+            lines.append(f'gateway_rate_limit_decisions_total{{result="{result}"}} {count}')
+
+        lines += ['# HELP gateway_event_loop_lag_seconds Event loop scheduling delay.',
+                  '# TYPE gateway_event_loop_lag_seconds histogram']
+        lines.extend(self.loop_lag.render('gateway_event_loop_lag_seconds'))
+
+        for name, collect in self.collectors.items():
+            lines.extend(_render_snapshot(f'gateway_{name}', collect()))
+        return '\n'.join(lines) + '\n'
+
+
+def _render_snapshot(prefix: str, snapshot: dict) -> Iterable[str]:
+    """
+    Gauges from a component's snapshot() dict: flat {metric: number} or, keyed per
+    instance, {instance: {metric: number}} (rendered with an `instance` label).
+    """
+    for key, value in snapshot.items():
+        if isinstance(value, dict):
+            for metric, number in value.items():
+                if isinstance(number, (int, float)) and not isinstance(number, bool):
+                    yield f'{prefix}_{metric}{{instance="{_escape(str(key))}"}} {number}'
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f'{prefix}_{key} {value}'
+
+
+metrics = Metrics()
+
+
+class MetricsMiddleware:
+    """
+    Records per-route request counts, status classes and latency, plus the time
+    spent handing the response to the server (response_write).
+
+    The route label is the matched RouteRule prefix, which the proxy leaves in
+    scope['gateway.route']; other endpoints are recorded under an empty route.
+    """
+    def __init__(self,
+                 app: ASGIApp,
+                 exclude: Iterable[str] = ('/metrics', '/_gateway/health')):
+        self.app = app
+        self.exclude = frozenset(exclude)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or scope['path'] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        started = perf_counter()
+        status = 500
+        writing = 0.0
+
+        async def send_timed(message: Message) -> None:
+            nonlocal status, writing
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            sent = perf_counter()
+            await send(message)
+            writing += perf_counter() - sent
+
+        metrics.in_flight += 1
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            metrics.in_flight -= 1
+            metrics.record_request(scope.get('gateway.route', ''), scope['method'], status,
+                                   perf_counter() - started)
+            metrics.observe('response_write', writing)
+
+
+def connect_tracer():
+    """
+    httpcore 'trace' callback timing new upstream connections (TCP plus TLS), and
+    the wait for a pooled connection as a span of the request's trace.
+    """
+    sent = perf_counter()
+    connect_started = 0.0
+
+    async def trace(event: str, info: dict) -> None:
+        nonlocal connect_started
+        if event == 'connection.connect_tcp.started':
+            connect_started = perf_counter()
+            record('upstream_pool_wait', sent, connect_started)
+        elif event.endswith('send_request_headers.started'):
+            now = perf_counter()
+            if connect_started:
+                metrics.observe('upstream_connect', now - connect_started)
+                record('upstream_connect', connect_started, now)
+                connect_started = 0.0
+            else:
+                record('upstream_pool_wait', sent, now)
+
+    return trace
+
+
+class LoopLagMonitor:
+    """Measures how late a periodic sleep wakes up, i.e. event loop saturation."""
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            expected = perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            metrics.loop_lag.observe(max(0.0, perf_counter() - expected))
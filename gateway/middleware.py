@@ -1,44 +1,160 @@
-from fastapi import Request
+from math import ceil
+from time import perf_counter
+
+from starlette.datastructures import MutableHeaders
 from starlette.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import GLOBAL_BUCKET
+from .metrics import metrics
+from .policies import applicable_policies, consumer_tier
+from .rate_limit import bucket_key
+from .routing import match_route
+from .tracing import record
 
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
+class RateLimitMiddleware:
     """
     ASGI middleware for rate limiting all incoming requests.
     Implements token-bucket algorithm with Redis backend.
+
+    Every consumer has a global bucket (capacity/rate). Policies configured for the
+    request's route, method and consumer tier are checked together with it in a
+    single limiter call.
+
+    Written against the raw ASGI interface rather than BaseHTTPMiddleware, so
+    responses (including streamed ones) pass straight through without an extra task
+    and memory stream per request. Paths in `exempt` (operational endpoints such as
+    /metrics and health checks) are never limited. WebSocket connections are limited
+    once, at handshake, as a GET; a denied one gets the 429 as its handshake response
+    (or a 1008 close where the server can't send one).
     """
-    def __init__(self, app, capacity: int = 50, rate: float = 1.0):
-        super().__init__(app)
+    def __init__(self,
+                 app: ASGIApp,
+                 capacity: int = 50,
+                 rate: float = 1.0,
+                 exempt: tuple[str, ...] = ('/metrics', '/_gateway/health')):
+        self.app = app
         self.capacity = capacity
         self.rate = rate
+        self.exempt = frozenset(exempt)
 
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """Process each request through rate limiter"""
+        if scope['type'] not in ('http', 'websocket') or scope['path'] in self.exempt:
+            await self.app(scope, receive, send)
+            return
 
         # Get limiter from app state (set in lifespan)
-        limiter = request.app.state.limiter
+        limiter = scope['app'].state.limiter
 
         # Extract API key (or client IP)
-        api_key = request.headers.get('x-api-key') or request.client.host
-        key = f"rl:{api_key}:global"
+        api_key = client_identity(scope)
+        key = bucket_key(api_key, GLOBAL_BUCKET)
+
+        policies = applicable_policies(scope['path'], scope.get('method', 'GET'),
+                                       consumer_tier(api_key))
 
         # Check rate limit
-        allowed, remaining_tokens = await limiter.allow(
-            key,
-            capacity=self.capacity,
-            rate=self.rate,
-        )
+        started = perf_counter()
+        if not policies:
+            allowed, remaining_tokens = await limiter.allow(
+                key,
+                capacity=self.capacity,
+                rate=self.rate,
+            )
+        else:
+            checks = [(key, 'token_bucket', self.capacity, self.rate)]
+            checks.extend(
+                (bucket_key(api_key, policy.name), policy.algorithm, policy.capacity, policy.rate)
+                for policy in policies
+            )
+            allowed, remaining_tokens = await limiter.check(checks)
+        ended = perf_counter()
+        metrics.observe('rate_limit', ended - started)
+        record('rate_limit', started, ended, allowed=allowed)
+        metrics.rate_limit['allowed' if allowed else 'denied'] += 1
+        remaining = str(int(remaining_tokens))
 
         if not allowed:
-            return JSONResponse(
+            response = JSONResponse(
                 status_code=429,
                 content={"detail": "Rate limit exceeded"},
-                headers={"X-RateLimit-Remaining": str(int(remaining_tokens))},
+                headers={"X-RateLimit-Remaining": remaining},
             )
+            extensions = scope.get('extensions') or {}
+            if scope['type'] == 'http' or 'websocket.http.response' in extensions:
+                await response(scope, receive, send)
+            else:
+                await send({'type': 'websocket.close', 'code': 1008,
+                            'reason': 'Rate limit exceeded'})
+            return
 
         # Add rate limit information to response headers
-        response = await call_next(request)
-        response.headers["X-RateLimit-Remaining"] = str(int(remaining_tokens))
+        async def send_with_remaining(message: Message) -> None:
+            if message['type'] in ('http.response.start', 'websocket.accept'):
+                message.setdefault('headers', [])
+                headers = MutableHeaders(scope=message)
+                headers["X-RateLimit-Remaining"] = remaining
+            await send(message)
+
+        await self.app(scope, receive, send_with_remaining)
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware admitting requests through the app's AdmissionController.
+
+    Sits in front of RateLimitMiddleware: a request over the global or route cap
+    waits in its consumer's queue before costing a limiter call, and is shed with
+    503 and Retry-After once its priority class's queue timeout has passed. The slots
+    are held until the response, streamed or not, has been sent. WebSocket tunnels
+    are not admitted here; they hold no slot for their lifetime.
+    """
+    def __init__(self,
+                 app: ASGIApp,
+                 exempt: tuple[str, ...] = ('/metrics', '/_gateway/health')):
+        self.app = app
+        self.exempt = frozenset(exempt)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or scope['path'] in self.exempt:
+            await self.app(scope, receive, send)
+            return
+
+        admission = scope['app'].state.admission
+        if not admission.policy.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        consumer = client_identity(scope)
+        match = match_route(scope['path'])
+        started = perf_counter()
+        gates = await admission.admit(consumer, consumer_tier(consumer),
+                                      None if match is None else match.rule)
+        ended = perf_counter()
+        metrics.observe('admission', ended - started)
+        record('admission', started, ended, admitted=gates is not None)
+
+        if gates is None:
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "Gateway overloaded"},
+                headers={"Retry-After": str(ceil(admission.policy.retry_after))},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.release(gates)
+
 
-        return response
+def client_identity(scope: Scope) -> str:
+    """API key from the 'x-api-key' header, falling back to the client IP."""
+    for name, value in scope['headers']:
+        if name == b'x-api-key' and value:
+            return value.decode('latin-1')
+    client = scope.get('client')
+    return client[0] if client else 'unknown'
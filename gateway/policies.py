@@ -0,0 +1,40 @@
+from .config import settings, RateLimitPolicy
+from .routing import match_route
+
+# Resolution of the rate-limit policies that apply to a request
+
+
+def consumer_tier(api_key: str) -> str:
+    rate_limit = settings.rate_limit
+    return rate_limit.consumers.get(api_key, rate_limit.default_tier)
+
+
+def _prefix_matches(prefix: str, path: str) -> bool:
+    prefix = prefix.rstrip('/')
+    return path == prefix or path.startswith(prefix + '/') or not prefix
+
+
+def _applies(policy: RateLimitPolicy, method: str, tier: str) -> bool:
+    if policy.methods is not None and method not in policy.methods:
+        return False
+    if policy.tiers is not None and tier not in policy.tiers:
+        return False
+    return True
+
+
+def applicable_policies(path: str, method: str, tier: str) -> list[RateLimitPolicy]:
+    """Policies from Settings.rate_limit and from the matched route, in that order."""
+    policies = [
+        policy for policy in settings.rate_limit.policies
+        if (policy.prefix is None or _prefix_matches(policy.prefix, path))
+        and _applies(policy, method, tier)
+    ]
+
+    match = match_route(path)
+    if match is not None:
+        policies.extend(
+            policy for policy in match.rule.rate_limits
+            if _applies(policy, method, tier)
+        )
+
+    return policies
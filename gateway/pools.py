@@ -0,0 +1,147 @@
+import asyncio
+import time
+
+import httpx
+
+from .config import PoolSettings
+
+# Per-upstream httpx clients, each with its own connection pool.
+
+
+def build_client(pool: PoolSettings, **kwargs) -> httpx.AsyncClient:
+    """httpx client with the limits, timeouts and HTTP version from PoolSettings."""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=pool.max_connections,
+            max_keepalive_connections=pool.max_keepalive_connections,
+            keepalive_expiry=pool.keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(
+            connect=pool.connect_timeout,
+            read=pool.read_timeout,
+            write=pool.write_timeout,
+            pool=pool.pool_timeout,
+        ),
+        http2=pool.http2,   # needs the 'h2' package (pip install 'httpx[http2]')
+        **kwargs,
+    )
+
+
+def origin(url: str) -> str:
+    """'scheme://host[:port]' of a URL, the key used for per-upstream pools."""
+    u = httpx.URL(url)
+    return f"{u.scheme}://{u.netloc.decode('ascii')}"
+
+
+class PoolStats:
+    """
+    Connection acquisition figures for one pool, fed from httpcore trace events.
+
+    wait = time from handing the request to the pool until its headers start going
+    out, i.e. queueing for a free connection plus any new TCP/TLS handshake;
+    connect is the handshake part alone.
+    """
+    __slots__ = ('requests', 'new_connections', 'wait_total', 'wait_max', 'connect_total')
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.connect_total = 0.0
+
+    def tracer(self, inner=None):
+        """Per-request httpcore 'trace' callback, chaining to `inner` when given."""
+        started = time.perf_counter()
+        connect_started = 0.0
+
+        async def trace(event: str, info: dict) -> None:
+            nonlocal connect_started
+            if event == 'connection.connect_tcp.started':
+                connect_started = time.perf_counter()
+                self.new_connections += 1
+            elif event.endswith('send_request_headers.started'):
+                now = time.perf_counter()
+                if connect_started:
+                    # TCP connect plus TLS handshake, when there was one
+                    self.connect_total += now - connect_started
+                wait = now - started
+                self.requests += 1
+                self.wait_total += wait
+                if wait > self.wait_max:
+                    self.wait_max = wait
+            if inner is not None:
+                await inner(event, info)
+
+        return trace
+
+
+class UpstreamClients:
+    """
+    Dedicated clients for upstream origins listed in Settings.upstream_pools.
+
+    Origins without an entry keep using the shared client (app.state.http_client),
+    so get() returns None for them.
+    """
+    def __init__(self, pools: dict[str, PoolSettings]):
+        self.settings = {origin(url): pool for url, pool in pools.items()}
+        self.clients: dict[str, httpx.AsyncClient] = {}
+        self.stats: dict[str, PoolStats] = {}
+        self._by_url: dict[str, httpx.AsyncClient | None] = {}
+
+        for key, pool in self.settings.items():
+            stats = self.stats[key] = PoolStats()
+            self.clients[key] = build_client(pool, event_hooks={'request': [self._instrument(stats)]})
+
+    @staticmethod
+    def _instrument(stats: PoolStats):
+        async def hook(request: httpx.Request) -> None:
+            request.extensions['trace'] = stats.tracer(request.extensions.get('trace'))
+        return hook
+
+    def get(self, url: str) -> httpx.AsyncClient | None:
+        try:
+            return self._by_url[url]
+        except KeyError:
+            client = self._by_url[url] = self.clients.get(origin(url))
+            return client
+
+    async def warm_up(self) -> None:
+        """Open `warm_connections` keep-alive connections per pool before serving."""
+        async def touch(client: httpx.AsyncClient, url: str) -> None:
+            try:
+                await client.head(url)
+            except httpx.HTTPError:
+                pass    # a cold pool is no reason to refuse to start
+
+        await asyncio.gather(*(
+            touch(self.clients[key], key + pool.warm_path)
+            for key, pool in self.settings.items()
+            for _ in range(pool.warm_connections)
+        ))
+
+    def snapshot(self) -> dict[str, dict]:
+        """Utilization and acquisition figures per pool."""
+        result = {}
+        for key, client in self.clients.items():
+            pool = getattr(client._transport, '_pool', None)
+            connections = list(getattr(pool, 'connections', ()))
+            idle = sum(1 for c in connections if c.is_idle())
+            limit = self.settings[key].max_connections
+            stats = self.stats[key]
+            result[key] = {
+                'connections': len(connections),
+                'active': len(connections) - idle,
+                'idle': idle,
+                'max_connections': limit,
+                'utilization': round((len(connections) - idle) / limit, 4) if limit else None,
+                'requests': stats.requests,
+                'new_connections': stats.new_connections,
+                'wait_avg_ms': round(stats.wait_total / stats.requests * 1000, 3) if stats.requests else 0.0,
+                'wait_max_ms': round(stats.wait_max * 1000, 3),
+                'connect_total_ms': round(stats.connect_total * 1000, 3),
+            }
+        return result
+
+    async def aclose(self) -> None:
+        await asyncio.gather(*(client.aclose() for client in self.clients.values()))
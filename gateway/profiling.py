@@ -0,0 +1,100 @@
+import asyncio
+import itertools
+import os
+import sys
+import threading
+from collections import Counter
+from types import FrameType
+
+# On-demand sampling profiler behind /_gateway/profile.
+#
+# Two samplers run for the requested time. A thread takes the event loop thread's
+# Python stack at every interval, which shows where the loop spends its CPU or what
+# blocks it. A coroutine on the loop walks the await chain of every task, which
+# shows what pending requests are waiting on. Both are counted as collapsed stacks
+# ('outer;inner', outermost first), the input format of flame graph tools. Nothing
+# runs while no profile is being taken. The task walk holds the loop for as long as
+# it takes, so it runs at most every task_interval and visits at most max_tasks
+# tasks (an arbitrary subset when there are more).
+
+MAX_DEPTH = 64
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def thread_stack(frame: FrameType | None) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def await_stack(task: asyncio.Task) -> str:
+    """Coroutines `task` is suspended in, outermost first, ending with what it awaits."""
+    names = []
+    awaitable = task.get_coro()
+    while awaitable is not None and len(names) < MAX_DEPTH:
+        frame = (getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'ag_frame', None)
+                 or getattr(awaitable, 'gi_frame', None))
+        if frame is None:
+            names.append(type(awaitable).__name__)     # a Future, an async generator step...
+            break
+        names.append(_frame_name(frame))
+        awaitable = (getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'ag_await', None)
+                     or getattr(awaitable, 'gi_yieldfrom', None))
+    return ';'.join(names)
+
+
+class Profiler:
+    """Takes one profile at a time."""
+    def __init__(self, task_interval: float = 0.05, max_tasks: int = 1000):
+        self.task_interval = task_interval
+        self.max_tasks = max_tasks
+        self.running = False
+
+    async def profile(self, seconds: float, interval: float) -> dict[str, Counter]:
+        """
+        Stack counts for `seconds`: 'loop' sampled every `interval`, 'tasks' every
+        `interval` or task_interval, whichever is longer.
+        """
+        if self.running:
+            raise RuntimeError("a profile is already being taken")
+        self.running = True
+        loop_thread = threading.get_ident()
+        loop_stacks: Counter = Counter()
+        task_stacks: Counter = Counter()
+        stop = threading.Event()
+
+        def sample_loop_thread() -> None:
+            while not stop.wait(interval):
+                frame = sys._current_frames().get(loop_thread)
+                if frame is not None:
+                    loop_stacks[thread_stack(frame)] += 1
+
+        sampler = threading.Thread(target=sample_loop_thread, name='profiler', daemon=True)
+        sampler.start()
+        try:
+            me = asyncio.current_task()
+            task_interval = max(interval, self.task_interval)
+            deadline = asyncio.get_running_loop().time() + seconds
+            while asyncio.get_running_loop().time() < deadline:
+                await asyncio.sleep(task_interval)
+                others = (task for task in asyncio.all_tasks() if task is not me)
+                for task in itertools.islice(others, self.max_tasks):
+                    task_stacks[await_stack(task)] += 1
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+            self.running = False
+        return {'loop': loop_stacks, 'tasks': task_stacks}
+
+
+def collapsed(profile: dict[str, Counter]) -> str:
+    """'stack count' lines, each stack under its sampler's name, for flamegraph.pl & co."""
+    return ''.join(f"{kind};{stack} {count}\n"
+                   for kind, stacks in profile.items()
+                   for stack, count in stacks.most_common())
@@ -0,0 +1,142 @@
+import math
+
+from .config import CircuitBreakerPolicy, ConcurrencyLimit
+
+# Per-target overload protection: circuit breaking and adaptive concurrency limits.
+#
+# Both are fed by the UpstreamPool feedback calls the balancer already gets
+# (observe/report_failure) and consulted by UpstreamPool.pick() before a request is
+# sent, so a failing or saturated upstream costs a quick local 503 instead of a task
+# and a pooled connection held until the upstream timeout.
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class UpstreamRejected(Exception):
+    """A request refused locally to protect a failing or saturated upstream."""
+    def __init__(self, reason: str, retry_after: float | None = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    closed -> open when the failure rate over the rolling window reaches
+    policy.error_rate (with at least min_requests calls); open -> half-open after
+    open_seconds; half-open -> closed after half_open_requests successful probes, or
+    back to open on the first failure.
+
+    The window is a ring of per-interval counters, so recording is O(1).
+    """
+    BUCKETS = 10
+
+    def __init__(self, policy: CircuitBreakerPolicy):
+        self.policy = policy
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.times_opened = 0
+        self.probes = 0         # half-open requests admitted
+        self.successes = 0      # half-open requests that succeeded
+        self._width = policy.window / self.BUCKETS
+        self._calls = [0] * self.BUCKETS
+        self._failures = [0] * self.BUCKETS
+        self._bucket = 0        # absolute number of the newest bucket
+
+    def _slot(self, now: float) -> int:
+        bucket = int(now / self._width)
+        if bucket != self._bucket:
+            for stale in range(max(self._bucket + 1, bucket - self.BUCKETS + 1), bucket + 1):
+                self._calls[stale % self.BUCKETS] = 0
+                self._failures[stale % self.BUCKETS] = 0
+            self._bucket = bucket
+        return bucket % self.BUCKETS
+
+    def allow(self, now: float) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if now < self.open_until:
+                return False
+            self.state = HALF_OPEN
+            self.open_until = now   # probes get open_seconds from here to report back
+            self.probes = self.successes = 0
+        elif now >= self.open_until + self.policy.open_seconds:
+            # Probes that never reported back (e.g. cancelled) must not wedge half-open
+            self.open_until = now
+            self.probes = self.successes = 0
+        if self.probes >= self.policy.half_open_requests:
+            return False
+        self.probes += 1
+        return True
+
+    def record(self, ok: bool, now: float) -> bool:
+        """Feed one call's outcome. :return: True if this opened the breaker"""
+        if self.state == HALF_OPEN:
+            if not ok:
+                self._open(now)
+                return True
+            self.successes += 1
+            if self.successes >= self.policy.half_open_requests:
+                self.state = CLOSED
+                self._calls = [0] * self.BUCKETS
+                self._failures = [0] * self.BUCKETS
+            return False
+        if self.state == OPEN:
+            return False    # stragglers sent before the breaker opened
+
+        slot = self._slot(now)
+        self._calls[slot] += 1
+        if ok:
+            return False
+        self._failures[slot] += 1
+        calls = sum(self._calls)
+        if calls >= self.policy.min_requests and sum(self._failures) >= self.policy.error_rate * calls:
+            self._open(now)
+            return True
+        return False
+
+    def trip(self, now: float) -> None:
+        """Open without waiting for failures, e.g. when the dependency is known down."""
+        if self.state != OPEN:
+            self._open(now)
+
+    def _open(self, now: float) -> None:
+        self.state = OPEN
+        self.open_until = now + self.policy.open_seconds
+        self.times_opened += 1
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency limit, as in Netflix's concurrency-limits AIMDLimit.
+
+    No-load latency is the minimum seen over the last RTT_WINDOW samples (the current
+    window's minimum until the first one completes), so the baseline follows an
+    upstream that gets permanently slower or faster.
+    """
+    RTT_WINDOW = 500
+
+    def __init__(self, policy: ConcurrencyLimit):
+        self.policy = policy
+        self.limit = float(policy.initial_limit)
+        self.min_latency = 0.0
+        self._window_min = math.inf
+        self._samples = 0
+
+    def record(self, ok: bool, latency: float, in_flight: int) -> None:
+        policy = self.policy
+        if ok:
+            if latency < self._window_min:
+                self._window_min = latency
+            self._samples += 1
+            if self._samples >= self.RTT_WINDOW or self.min_latency == 0.0:
+                self.min_latency = self._window_min
+                if self._samples >= self.RTT_WINDOW:
+                    self._window_min, self._samples = math.inf, 0
+
+        if not ok or latency > policy.latency_tolerance * self.min_latency:
+            self.limit = max(float(policy.min_limit), self.limit * policy.backoff)
+        elif in_flight * 2 >= self.limit:
+            # +1 per `limit` successes, i.e. per round of calls at full concurrency
+            self.limit = min(float(policy.max_limit), self.limit + 1.0 / self.limit)
@@ -1,28 +1,107 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import math
+import os
+import socket
 import time
 from pathlib import Path
 import redis.exceptions
 from redis.asyncio import Redis
 
+from .config import RedisFailureSettings
+from .protection import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+logger = logging.getLogger('uvicorn.error')
+
 LUA_SCRIPT = Path(__file__).parent / 'redis/token_bucket.lua'
 LUA = LUA_SCRIPT.read_text()
+MULTI_LUA_SCRIPT = Path(__file__).parent / 'redis/multi_limit.lua'
+MULTI_LUA = MULTI_LUA_SCRIPT.read_text()
+
+SCRIPTS = {
+    'token_bucket': LUA,
+    'multi_limit': MULTI_LUA,
+}
+
+ALGORITHMS = ('token_bucket', 'sliding_window', 'gcra')
+
+# (key, algorithm, capacity, rate) for RateLimiter.check()
+LimitCheck = tuple[str, str, int, float]
+
+
+def bucket_key(identity: str, bucket: str) -> str:
+    """
+    Redis key of one of a consumer's buckets: 'rl:{identity}:bucket'.
+
+    The braces make the identity a hash tag, so every bucket of a consumer maps to
+    the same Redis Cluster slot (and the same ShardedRateLimiter shard), which lets
+    check() evaluate all of them in one script call.
+    """
+    return f"rl:{{{identity}}}:{bucket}"
+
+
+def hash_tag(key: str) -> str:
+    """The part of `key` Redis Cluster hashes: the first non-empty {...}, else all of it."""
+    start = key.find('{')
+    if start != -1:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
 
 class RateLimiter:
     """
     Redis-backed token-bucket rate limiter.
 
     Utilizes Lua script to implement atomic check-and-decrement semantics across
-    concurrent gateway instances.
+    concurrent gateway instances. Timestamps come from this process's clock, or from
+    Redis (TIME inside the script) with clock='redis', which removes skew between
+    instances for one extra in-script command.
     """
-    def __init__(self, redis_client: Redis):
+    def __init__(self, redis_client: Redis, clock: str = 'app'):
+        if clock not in ('app', 'redis'):
+            raise ValueError(f"unknown clock: {clock!r}")
         self.redis = redis_client
-        self.sha: str | None = None
+        self.clock = clock
+        self.shas: dict[str, str] = {}
+
+    def _now_ms(self) -> int | str:
+        """Script 'now' argument; empty tells the script to read the Redis clock."""
+        return int(time.time() * 1000) if self.clock == 'app' else ''
+
+    @property
+    def sha(self) -> str | None:
+        """SHA of the single-bucket token-bucket script."""
+        return self.shas.get('token_bucket')
 
     async def load(self) -> None:
         """
-        Load LUA script into Redis and cache the SHA.
+        Load LUA scripts into Redis and cache their SHAs.
         :return:
         """
-        self.sha = await self.redis.script_load(LUA)
+        for name, source in SCRIPTS.items():
+            self.shas[name] = await self.redis.script_load(source)
+
+    async def _eval(self, key: str, *args):
+        return await self._evalsha('token_bucket', (key,), args)
+
+    async def _evalsha(self, script: str, keys: tuple[str, ...], args: tuple):
+        if self.sha is None:
+            raise RuntimeError("RateLimiter not initialized. Call load() first.")
+
+        try:
+            return await self.redis.evalsha(self.shas[script],
+                                            len(keys),  # one hash tag, so one slot
+                                            *keys,
+                                            *args)
+        except redis.exceptions.NoScriptError:
+            await self.load()
+            return await self.redis.evalsha(self.shas[script],
+                                            len(keys),  # one hash tag, so one slot
+                                            *keys,
+                                            *args)
 
     async def allow(self,
                     key: str,
@@ -33,29 +112,589 @@ class RateLimiter:
         Attempt to consume tokens from the Redis bucket.
         :return: (allowed, remaining_tokens)
         """
+        now_ms = self._now_ms()
+        result = await self._eval(key, capacity, rate, now_ms, tokens)
+
+        allowed = bool(result[0])
+        remaining = float(result[1])
+
+        return allowed, remaining
+
+    async def lease(self,
+                    key: str,
+                    capacity: int,
+                    rate: float,
+                    tokens: int) -> tuple[int, float]:
+        """
+        Take up to `tokens` whole tokens from the Redis bucket in one call.
+        :return: (granted_tokens, remaining_tokens)
+        """
+        now_ms = self._now_ms()
+        result = await self._eval(key, capacity, rate, now_ms, tokens, 'lease')
+
+        return int(result[0]), float(result[1])
+
+    async def refund(self,
+                     key: str,
+                     capacity: int,
+                     rate: float,
+                     tokens: int) -> float:
+        """
+        Return unused leased tokens to the Redis bucket (capped at capacity).
+        :return: remaining_tokens
+        """
+        now_ms = self._now_ms()
+        result = await self._eval(key, capacity, rate, now_ms, tokens, 'refund')
+
+        return float(result[1])
+
+    async def check(self,
+                    checks: list[LimitCheck],
+                    tokens: int=1) -> tuple[bool, float]:
+        """
+        Check several buckets, possibly of different algorithms, in one Redis call.
+
+        Tokens are only spent when every bucket allows the request.
+        :return: (allowed, lowest remaining across buckets)
+        """
+        now_ms = self._now_ms()
+        keys = []
+        args: list = [now_ms, tokens]
+        for key, algorithm, capacity, rate in checks:
+            keys.append(key)
+            args.extend((algorithm, capacity, rate))
 
+        result = await self._evalsha('multi_limit', tuple(keys), tuple(args))
+
+        return bool(result[0]), float(result[1])
+
+
+class BatchingRateLimiter(RateLimiter):
+    """
+    RateLimiter that coalesces concurrent script calls into pipelined round trips.
+
+    Calls made within `max_delay` seconds of the first pending one (or until
+    `max_batch` calls are pending) are sent as one non-transactional pipeline, and
+    each caller's result is resolved individually. With max_delay=0 the batch closes
+    at the next event-loop iteration, which adds no timer latency.
+    """
+    def __init__(self,
+                 redis_client: Redis,
+                 max_delay: float = 0.001,
+                 max_batch: int = 128,
+                 clock: str = 'app'):
+        super().__init__(redis_client, clock=clock)
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._pending: list[tuple[str, tuple, tuple, asyncio.Future]] = []
+        self._flush_handle: asyncio.Handle | None = None
+        self._in_flight: set[asyncio.Task] = set()
+
+    async def _evalsha(self, script: str, keys: tuple[str, ...], args: tuple):
         if self.sha is None:
             raise RuntimeError("RateLimiter not initialized. Call load() first.")
 
-        now_ms = int(time.time() * 1000)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((script, keys, args, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            if self.max_delay > 0:
+                self._flush_handle = loop.call_later(self.max_delay, self._flush)
+            else:
+                self._flush_handle = loop.call_soon(self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _run(self, batch: list[tuple[str, tuple, tuple, asyncio.Future]]) -> None:
         try:
-            result = await self.redis.evalsha(self.sha,
-                                              1, # single node
-                                          key,
-                                          capacity,
-                                          rate,
-                                          now_ms,
-                                          tokens)
-        except redis.exceptions.NoScriptError:
-            await self.load()
-            result = await self.redis.evalsha(self.sha,
-                                              1,  # single node
-                                              key,
-                                              capacity,
-                                              rate,
-                                              now_ms,
-                                              tokens)
-        allowed = bool(result[0])
-        remaining = float(result[1])
+            results = await self._send(batch)
 
-        return allowed, remaining
+            # Script cache was flushed (e.g. Redis restart): reload once, retry those
+            retry = [i for i, result in enumerate(results)
+                     if isinstance(result, redis.exceptions.NoScriptError)]
+            if retry:
+                await self.load()
+                retried = await self._send([batch[i] for i in retry])
+                for i, result in zip(retry, retried):
+                    results[i] = result
+        except Exception as exc:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for (*_, future), result in zip(batch, results):
+            if future.done():   # caller was cancelled
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _send(self, batch: list[tuple[str, tuple, tuple, asyncio.Future]]) -> list:
+        """One Redis round trip for the whole batch."""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for script, keys, args, _ in batch:
+                pipe.evalsha(self.shas[script], len(keys), *keys, *args)
+            return await pipe.execute(raise_on_error=False)
+
+    async def close(self) -> None:
+        """Send anything still pending and wait for in-flight batches."""
+        self._flush()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+
+def _ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class ShardedRateLimiter:
+    """
+    Spreads buckets over independent Redis nodes by consistent hashing.
+
+    Each shard is a RateLimiter (or BatchingRateLimiter) with its own client and
+    connection pool. A key goes to the shard owning its hash tag, so the buckets of
+    one consumer (see bucket_key) share a node and a multi-bucket check is still one
+    script call. Every shard is placed VNODES times on the ring, keyed by its name
+    (its URL), so adding a shard moves only about 1/N of the consumers.
+
+    Keeps the RateLimiter allow/lease/refund/check signatures.
+    """
+    VNODES = 160
+
+    def __init__(self, shards: list[RateLimiter], names: list[str] | None = None):
+        if not shards:
+            raise ValueError("at least one shard is required")
+        names = names or [str(i) for i in range(len(shards))]
+        ring = sorted((_ring_hash(f"{name}#{vnode}"), i)
+                      for i, name in enumerate(names) for vnode in range(self.VNODES))
+        self.shards = shards
+        self._points = [point for point, _ in ring]
+        self._owners = [shards[i] for _, i in ring]
+
+    def shard(self, key: str) -> RateLimiter:
+        i = bisect.bisect(self._points, _ring_hash(hash_tag(key)))
+        return self._owners[i % len(self._owners)]
+
+    async def load(self) -> None:
+        """Load the scripts on every shard."""
+        await asyncio.gather(*(shard.load() for shard in self.shards))
+
+    async def allow(self,
+                    key: str,
+                    capacity: int,
+                    rate: float,
+                    tokens: int=1) -> tuple[bool, float]:
+        return await self.shard(key).allow(key, capacity, rate, tokens)
+
+    async def lease(self,
+                    key: str,
+                    capacity: int,
+                    rate: float,
+                    tokens: int) -> tuple[int, float]:
+        return await self.shard(key).lease(key, capacity, rate, tokens)
+
+    async def refund(self,
+                     key: str,
+                     capacity: int,
+                     rate: float,
+                     tokens: int) -> float:
+        return await self.shard(key).refund(key, capacity, rate, tokens)
+
+    async def check(self,
+                    checks: list[LimitCheck],
+                    tokens: int=1) -> tuple[bool, float]:
+        """All keys must share a hash tag; the first one picks the shard."""
+        return await self.shard(checks[0][0]).check(checks, tokens)
+
+    async def close(self) -> None:
+        await asyncio.gather(*(shard.close() for shard in self.shards
+                               if hasattr(shard, 'close')))
+
+
+class _Lease:
+    __slots__ = ('capacity', 'rate', 'tokens', 'remote', 'expires_at',
+                 'denied_until', 'refill')
+
+    def __init__(self, capacity: int, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = 0
+        self.remote = 0.0
+        self.expires_at = 0.0
+        self.denied_until = 0.0
+        self.refill: asyncio.Task | None = None
+
+
+class LeasedRateLimiter:
+    """
+    Serves rate-limit decisions from tokens leased in batches from a RateLimiter.
+
+    Each instance holds at most `max_drift` unspent tokens per key, which bounds how
+    far the cluster-wide limit can be exceeded at any moment (instances x max_drift).
+    When a local batch falls to `low_watermark` of its size, the next batch is leased
+    in the background so the hot path rarely waits on Redis. Leases older than
+    `lease_ttl` seconds are discarded; unspent tokens are refunded on close().
+
+    Keeps the RateLimiter.allow() signature and (allowed, remaining) return contract.
+    """
+    def __init__(self,
+                 limiter: RateLimiter,
+                 max_drift: int = 10,
+                 low_watermark: float = 0.25,
+                 lease_ttl: float = 1.0):
+        if max_drift < 1:
+            raise ValueError("max_drift must be at least 1")
+        self.limiter = limiter
+        self.max_drift = max_drift
+        self.low_watermark = low_watermark
+        self.lease_ttl = lease_ttl
+        self._leases: dict[str, _Lease] = {}
+        self._next_sweep = 0.0
+
+    async def load(self) -> None:
+        await self.limiter.load()
+
+    async def check(self,
+                    checks: list[LimitCheck],
+                    tokens: int=1) -> tuple[bool, float]:
+        """Multi-bucket checks are all-or-nothing across keys, so they bypass leases."""
+        return await self.limiter.check(checks, tokens)
+
+    async def allow(self,
+                    key: str,
+                    capacity: int,
+                    rate: float,
+                    tokens: int=1) -> tuple[bool, float]:
+        """
+        Attempt to consume tokens from the local lease, leasing more when dry.
+        :return: (allowed, remaining_tokens)
+        """
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        lease = self._leases.get(key)
+        if lease is None:
+            lease = self._leases[key] = _Lease(capacity, rate)
+        else:
+            lease.capacity, lease.rate = capacity, rate
+            if now >= lease.expires_at:
+                lease.tokens = 0
+
+        while lease.tokens < tokens:
+            if time.monotonic() < lease.denied_until:
+                return False, lease.remote
+            if lease.refill is None:
+                lease.refill = asyncio.create_task(self._refill(key, lease, tokens))
+            await asyncio.shield(lease.refill)
+
+        lease.tokens -= tokens
+        if lease.refill is None and lease.tokens <= self._batch_size(lease) * self.low_watermark:
+            lease.refill = asyncio.create_task(self._refill(key, lease, 0, background=True))
+
+        return True, lease.tokens + lease.remote
+
+    def _batch_size(self, lease: _Lease) -> int:
+        return min(self.max_drift, lease.capacity)
+
+    async def _refill(self,
+                      key: str,
+                      lease: _Lease,
+                      minimum: int,
+                      background: bool = False) -> None:
+        want = max(minimum, self._batch_size(lease)) - lease.tokens
+        try:
+            granted, remote = await self.limiter.lease(key, lease.capacity, lease.rate, want)
+        except Exception:
+            if background:
+                # Surfaced by the next foreground refill instead
+                return
+            raise
+        finally:
+            lease.refill = None
+
+        now = time.monotonic()
+        lease.tokens += granted
+        lease.remote = remote
+        lease.expires_at = now + self.lease_ttl
+        if not background and lease.tokens < minimum:
+            # Remote bucket is dry: answer locally until enough tokens are due
+            lease.denied_until = now + (minimum - lease.tokens - remote) / lease.rate
+
+    def _sweep(self, now: float) -> None:
+        """Forget keys whose leases have expired, bounding memory to active keys."""
+        self._leases = {
+            key: lease for key, lease in self._leases.items()
+            if lease.expires_at > now or lease.refill is not None
+        }
+        self._next_sweep = now + self.lease_ttl
+
+    async def close(self) -> None:
+        """Refund unspent leased tokens so they are not lost on shutdown."""
+        now = time.monotonic()
+        for key, lease in self._leases.items():
+            if lease.tokens > 0 and lease.expires_at > now:
+                await self.limiter.refund(key, lease.capacity, lease.rate, lease.tokens)
+                lease.tokens = 0
+        self._leases.clear()
+
+        if hasattr(self.limiter, 'close'):
+            await self.limiter.close()
+
+
+# Sorted set of gateway instances (member -> last heartbeat, unix seconds)
+INSTANCES_KEY = 'gateway:instances'
+
+
+class _LocalBucket:
+    __slots__ = ('capacity', 'rate', 'tokens', 'updated')
+
+    def __init__(self, capacity: float, rate: float, now: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class _Node:
+    """One Redis node behind a ResilientRateLimiter: its breaker, and what reconnects it."""
+    __slots__ = ('limiter', 'breaker')
+
+    def __init__(self, limiter, breaker: CircuitBreaker):
+        self.limiter = limiter
+        self.breaker = breaker
+
+
+class ResilientRateLimiter:
+    """
+    Keeps rate-limit decisions fast and available while Redis is slow or down.
+
+    Every call to the wrapped limiter is bounded by policy.timeout_ms. Errors and
+    timeouts feed a circuit breaker; once it opens, requests no longer touch Redis and
+    are decided by policy.mode: 'open' admits, 'closed' rejects, 'local' enforces
+    in-process token buckets holding 1/instances of each limit (every algorithm is
+    approximated by a token bucket with the same capacity and rate).
+
+    With `sharding`, each of its shards gets its own breaker, picked by the shard
+    owning the request's first key, so one node going down degrades only the
+    consumers it holds.
+
+    A background task reconnects every breaker.open_seconds by reloading the node's
+    scripts, which also restores them after a Redis restart. Only then does the
+    breaker let half-open calls through; when they succeed it closes and the node's
+    local buckets are dropped, so Redis is authoritative again. While the first node
+    is up, the same task heartbeats this instance into INSTANCES_KEY on it to keep the
+    instance count current.
+
+    Keeps the RateLimiter.allow()/check() signatures and return contract.
+    """
+    SWEEP_SECONDS = 10.0
+
+    def __init__(self,
+                 limiter,
+                 redis_client: Redis,
+                 policy: RedisFailureSettings,
+                 instance_id: str | None = None,
+                 sharding: ShardedRateLimiter | None = None):
+        self.limiter = limiter
+        self.redis = redis_client
+        self.policy = policy
+        self.timeout = policy.timeout_ms / 1000
+        self.sharding = sharding
+        shards = [limiter] if sharding is None else sharding.shards
+        self.nodes = [_Node(shard, CircuitBreaker(policy.breaker)) for shard in shards]
+        self._node_of = {id(node.limiter): node for node in self.nodes}
+        self.instance_id = instance_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.instances = policy.instances or 1
+        self.errors = 0
+        self.fallback_decisions = 0
+        self._buckets: dict[str, _LocalBucket] = {}
+        self._next_sweep = 0.0
+        self._task: asyncio.Task | None = None
+
+    def node(self, key: str) -> _Node:
+        if self.sharding is None:
+            return self.nodes[0]
+        return self._node_of[id(self.sharding.shard(key))]
+
+    async def load(self) -> None:
+        """Load the scripts, starting degraded instead of failing if Redis is down."""
+        await asyncio.gather(*(self._load(node) for node in self.nodes))
+
+    async def _load(self, node: _Node) -> None:
+        try:
+            await asyncio.wait_for(node.limiter.load(), self.policy.connect_timeout)
+        except Exception as exc:
+            node.breaker.trip(time.monotonic())
+            self._degraded(node, exc)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._maintain())
+
+    async def allow(self,
+                    key: str,
+                    capacity: int,
+                    rate: float,
+                    tokens: int=1) -> tuple[bool, float]:
+        return await self._decide(lambda: self.limiter.allow(key, capacity, rate, tokens),
+                                  ((key, capacity, rate),), tokens)
+
+    async def check(self,
+                    checks: list[LimitCheck],
+                    tokens: int=1) -> tuple[bool, float]:
+        return await self._decide(lambda: self.limiter.check(checks, tokens),
+                                  [(key, capacity, rate) for key, _, capacity, rate in checks],
+                                  tokens)
+
+    async def _decide(self, call, buckets, tokens: int) -> tuple[bool, float]:
+        node = self.node(buckets[0][0])
+        if node.breaker.allow(time.monotonic()):
+            try:
+                result = await asyncio.wait_for(call(), self.timeout)
+            except Exception as exc:
+                self.errors += 1
+                self._record(node, False, exc)
+            else:
+                self._record(node, True)
+                return result
+        return self._fallback(buckets, tokens)
+
+    def _record(self, node: _Node, ok: bool, exc: Exception | None = None) -> None:
+        breaker = node.breaker
+        state = breaker.state
+        if breaker.record(ok, time.monotonic()):
+            self._degraded(node, exc)
+        elif state == HALF_OPEN and breaker.state == CLOSED:
+            self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                             if self.node(key) is not node}
+            logger.info("Redis node %d is back; its rate limits use Redis again",
+                        self.nodes.index(node))
+
+    def _degraded(self, node: _Node, exc: Exception | None) -> None:
+        # Stay open until the background task has reconnected, not for a fixed time
+        node.breaker.open_until = math.inf
+        logger.warning("Redis node %d unavailable (%r); its rate limits degraded to '%s' mode",
+                       self.nodes.index(node), exc, self.policy.mode)
+
+    def _fallback(self, buckets, tokens: int) -> tuple[bool, float]:
+        self.fallback_decisions += 1
+        if self.policy.mode == 'open':
+            return True, float(min(capacity for _, capacity, _ in buckets))
+        if self.policy.mode == 'closed':
+            return False, 0.0
+
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+        share = 1 / self.instances
+        local = []
+        for key, capacity, rate in buckets:
+            capacity, rate = max(1.0, capacity * share), rate * share
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = _LocalBucket(capacity, rate, now)
+            else:
+                bucket.capacity, bucket.rate = capacity, rate
+                bucket.refill(now)
+            local.append(bucket)
+
+        allowed = all(bucket.tokens >= tokens for bucket in local)
+        if allowed:
+            for bucket in local:
+                bucket.tokens -= tokens
+        return allowed, min(bucket.tokens for bucket in local)
+
+    def _sweep(self, now: float) -> None:
+        """Forget local buckets that have refilled, bounding memory to active keys."""
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items()
+            if bucket.tokens + (now - bucket.updated) * bucket.rate < bucket.capacity
+        }
+        self._next_sweep = now + self.SWEEP_SECONDS
+
+    async def _maintain(self) -> None:
+        next_heartbeat = 0.0
+        while True:
+            now = time.monotonic()
+            down = [node for node in self.nodes
+                    if node.breaker.state == OPEN and node.breaker.open_until == math.inf]
+            if down:
+                await asyncio.gather(*(self._reconnect(node) for node in down))
+            if self.nodes[0].breaker.state == CLOSED and now >= next_heartbeat:
+                await self._heartbeat()
+                next_heartbeat = now + self.policy.heartbeat_seconds
+            await asyncio.sleep(self.policy.breaker.open_seconds)
+
+    async def _reconnect(self, node: _Node) -> None:
+        try:
+            await asyncio.wait_for(node.limiter.load(), self.policy.connect_timeout)
+        except Exception:
+            return
+        # Half-open from the next request on
+        node.breaker.open_until = time.monotonic()
+        logger.info("Reconnected to Redis node %d; probing before leaving degraded mode",
+                    self.nodes.index(node))
+
+    async def _heartbeat(self) -> None:
+        now = time.time()
+        expiry = 3 * self.policy.heartbeat_seconds
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.zadd(INSTANCES_KEY, {self.instance_id: now})
+                pipe.zremrangebyscore(INSTANCES_KEY, '-inf', now - expiry)
+                pipe.zcard(INSTANCES_KEY)
+                pipe.expire(INSTANCES_KEY, math.ceil(expiry))
+                results = await asyncio.wait_for(pipe.execute(), self.policy.connect_timeout)
+        except Exception:
+            return      # request traffic decides whether Redis is down
+        if self.policy.instances is None:
+            self.instances = max(1, int(results[2]))
+
+    def snapshot(self) -> dict:
+        return {
+            'nodes': len(self.nodes),
+            'degraded': sum(node.breaker.state != CLOSED for node in self.nodes),
+            'times_degraded': sum(node.breaker.times_opened for node in self.nodes),
+            'instances': self.instances,
+            'redis_errors': self.errors,
+            'fallback_decisions': self.fallback_decisions,
+            'local_buckets': len(self._buckets),
+        }
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        timeout = self.policy.connect_timeout
+        try:
+            if self.nodes[0].breaker.state == CLOSED:
+                await asyncio.wait_for(self.redis.zrem(INSTANCES_KEY, self.instance_id), timeout)
+            if hasattr(self.limiter, 'close'):
+                await asyncio.wait_for(self.limiter.close(), timeout)
+        except Exception as exc:
+            logger.warning("Rate limiter did not shut down cleanly: %r", exc)
@@ -0,0 +1,128 @@
+--Lua script for checking several rate-limit buckets in one call (used in ../rate_limit.py)
+--[[
+	KEYS[i]        bucket key for check i
+	ARGV[1]        now (ms, application clock; empty = Redis TIME; see token_bucket.lua)
+	ARGV[2]        requested tokens
+	ARGV[3i]       algorithm of check i: 'token_bucket' | 'sliding_window' | 'gcra'
+	ARGV[3i + 1]   capacity (bucket size / requests per window / burst)
+	ARGV[3i + 2]   rate (tokens per second)
+
+	Every check is evaluated first; state is only written when all of them allow the
+	request, so a request denied by one bucket does not spend tokens in the others.
+	Returns { allowed, min remaining across buckets }.
+]]
+
+local now = tonumber(ARGV[1])
+if now == nil then
+	if redis.replicate_commands then
+		redis.replicate_commands()
+	end
+	local time = redis.call('TIME')
+	now = tonumber(time[1]) * 1000 + tonumber(time[2]) / 1000
+end
+local requested = tonumber(ARGV[2])
+
+-- Each algorithm returns: allowed, remaining, commit function
+
+local function token_bucket(key, capacity, rate)
+	-- Same layout as token_bucket.lua (time the bucket is full again), so buckets
+	-- are interchangeable
+	local stored = redis.pcall('GET', key)
+	local full_at
+	if type(stored) == 'table' and stored.err then
+		-- Hash written by the previous {tokens, last_ts} layout
+		local state = redis.call('HMGET', key, 'tokens', 'last_ts')
+		local elapsed = math.max(0, (now - (tonumber(state[2]) or now)) / 1000.0)
+		local old_tokens = math.min(capacity, (tonumber(state[1]) or capacity) + elapsed * rate)
+		full_at = now + (capacity - old_tokens) * 1000.0 / rate
+	else
+		full_at = tonumber(stored) or now
+	end
+
+	local tokens = math.max(0, capacity - math.max(0, full_at - now) * rate / 1000.0)
+
+	local allowed = tokens >= requested
+	local remaining = tokens
+	if allowed then
+		remaining = tokens - requested
+	end
+
+	return allowed, remaining, function()
+		local refill_ms = (capacity - remaining) * 1000.0 / rate
+		if refill_ms > 0 then
+			redis.call('SET', key, string.format('%.17g', now + refill_ms), 'PX', math.ceil(refill_ms))
+		end
+	end
+end
+
+local function sliding_window(key, capacity, rate)
+	-- Log of admitted request timestamps in a sorted set; window = capacity / rate
+	local window = math.ceil((capacity / rate) * 1000)
+	redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+	local count = redis.call('ZCARD', key)
+
+	local allowed = count + requested <= capacity
+	local remaining = capacity - count
+	if allowed then
+		remaining = remaining - requested
+	end
+
+	return allowed, remaining, function()
+		for i = 1, requested do
+			redis.call('ZADD', key, now, now .. ':' .. (count + i))
+		end
+		redis.call('PEXPIRE', key, window)
+	end
+end
+
+local function gcra(key, capacity, rate)
+	-- Generic cell rate algorithm: one string holding the theoretical arrival time
+	local interval = 1000.0 / rate
+	local tolerance = capacity * interval
+
+	local tat = math.max(tonumber(redis.call('GET', key)) or now, now)
+	local new_tat = tat + requested * interval
+	local allow_at = new_tat - tolerance
+
+	local allowed = now >= allow_at
+	local remaining = 0
+	if allowed then
+		remaining = math.floor((now - allow_at) / interval)
+	end
+
+	return allowed, remaining, function()
+		redis.call('SET', key, new_tat, 'PX', math.max(1, math.ceil(new_tat - now)))
+	end
+end
+
+local algorithms = {
+	token_bucket = token_bucket,
+	sliding_window = sliding_window,
+	gcra = gcra,
+}
+
+local all_allowed = true
+local min_remaining = nil
+local commits = {}
+
+for i, key in ipairs(KEYS) do
+	local algorithm = algorithms[ARGV[3 * i]]
+	if algorithm == nil then
+		return redis.error_reply('unknown rate limit algorithm: ' .. tostring(ARGV[3 * i]))
+	end
+
+	local allowed, remaining, commit = algorithm(key, tonumber(ARGV[3 * i + 1]), tonumber(ARGV[3 * i + 2]))
+	all_allowed = all_allowed and allowed
+	if min_remaining == nil or remaining < min_remaining then
+		min_remaining = remaining
+	end
+	commits[i] = commit
+end
+
+if all_allowed then
+	for _, commit in ipairs(commits) do
+		commit()
+	end
+end
+
+return { (all_allowed and 1) or 0, min_remaining or 0 }
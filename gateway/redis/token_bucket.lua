@@ -5,35 +5,73 @@ local bucket_key = KEYS[1]
 local capacity = tonumber(ARGV[1])
 local rate = tonumber(ARGV[2])
 local now = tonumber(ARGV[3])	--[[
-	Currently using application clock (Python's "time" module). This will work well as
-		long as we don't have an issue with clock synchronization between multiple
-		application instances.
-	If application sync were a bigger issue, I would likely use Redis time instead. This would
-		result in greatly reduced clock skew but increased Redis CPU usage, as a new
-		Redis command would be required on each occasion.
+	ms timestamp from the application clock (Python's "time" module), which works as
+		long as the gateway instances' clocks agree.
+	Empty: use the Redis server clock (TIME) instead. No clock skew between instances,
+		for one extra (local, non-replicated) command per call.
 	]]
 local requested = tonumber(ARGV[4])
+local mode = ARGV[5]	--[[
+	nil:      all-or-nothing check of `requested` tokens (per-request limiting)
+	'lease':  grant up to `requested` whole tokens; returns the number granted
+	'refund': put `requested` unused leased tokens back, capped at capacity
+	]]
 
-local state = redis.call('HMGET', bucket_key, 'tokens', 'last_ts')
-local tokens = tonumber(state[1])
-local last_timestamp = tonumber(state[2])
-
-if tokens == nil then
-	tokens = capacity
-	last_timestamp = now
+if now == nil then
+	if redis.replicate_commands then
+		redis.replicate_commands()	-- no-op from Redis 5; needed before TIME on older ones
+	end
+	local time = redis.call('TIME')
+	now = tonumber(time[1]) * 1000 + tonumber(time[2]) / 1000
 end
 
-local elapsed = math.max(0, (now - last_timestamp) / 1000.0)
-local refill = elapsed * rate
+--[[
+	A bucket is one string: the ms timestamp at which it will be full again (GCRA-style),
+		so refill needs no stored state and a missing key is a full bucket. The key
+		expires exactly when the bucket refills.
+	tokens(now) = capacity - max(0, full_at - now) * rate / 1000
+	]]
+local stored = redis.pcall('GET', bucket_key)
+local full_at
+if type(stored) == 'table' and stored.err then
+	-- Hash written by the previous {tokens, last_ts} layout; converted on the next write
+	local state = redis.call('HMGET', bucket_key, 'tokens', 'last_ts')
+	local elapsed = math.max(0, (now - (tonumber(state[2]) or now)) / 1000.0)
+	local old_tokens = math.min(capacity, (tonumber(state[1]) or capacity) + elapsed * rate)
+	full_at = now + (capacity - old_tokens) * 1000.0 / rate
+else
+	full_at = tonumber(stored) or now
+end
 
-tokens = math.min(capacity, tokens + refill)
+local tokens = math.max(0, capacity - math.max(0, full_at - now) * rate / 1000.0)
 
-local allowed = tokens >= requested
-if allowed then
-	tokens = tokens - requested
+local result
+local spent = 0
+if mode == 'lease' then
+	local granted = math.max(0, math.min(requested, math.floor(tokens)))
+	spent = granted
+	result = granted
+elseif mode == 'refund' then
+	spent = -math.min(requested, capacity - tokens)
+	result = 1
+else
+	local allowed = tokens >= requested
+	if allowed then
+		spent = requested
+	end
+	result = (allowed and 1) or 0
 end
 
-redis.call('HMSET', bucket_key, 'tokens', tokens, 'last_ts', now)
-redis.call('PEXPIRE', bucket_key, math.ceil((capacity / rate) * 1000))
+-- Denials and empty leases leave the bucket as it was: no write at all
+if spent ~= 0 then
+	tokens = tokens - spent
+	local refill_ms = (capacity - tokens) * 1000.0 / rate
+	if refill_ms > 0 then
+		redis.call('SET', bucket_key, string.format('%.17g', now + refill_ms),
+			'PX', math.ceil(refill_ms))
+	else
+		redis.call('DEL', bucket_key)
+	end
+end
 
-return { (allowed and 1) or 0, tokens }
+return { result, tokens }
@@ -0,0 +1,34 @@
+from os import getenv
+
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.asyncio.cluster import RedisCluster
+
+from .config import RedisSettings
+
+# Redis clients for the configured topology, with per-node connection pools.
+
+
+def redis_urls(policy: RedisSettings) -> list[str]:
+    """One URL per rate-limit shard; a single one unless client-side sharding is on."""
+    return policy.shards or [policy.url or getenv("REDIS_URL", "redis://localhost:6379")]
+
+
+def build_redis(url: str, policy: RedisSettings) -> Redis | RedisCluster:
+    """Client for one node (or one cluster) with the pool limits and timeouts from RedisSettings."""
+    options = dict(
+        socket_timeout=policy.socket_timeout,
+        socket_connect_timeout=policy.socket_connect_timeout,
+        socket_keepalive=True,
+        health_check_interval=policy.health_check_interval,
+    )
+    if policy.cluster:
+        # One pool of max_connections per cluster node, created as nodes are discovered
+        return RedisCluster.from_url(url, max_connections=policy.max_connections, **options)
+
+    # Blocking pool: a burst past max_connections waits up to pool_timeout for a
+    # connection instead of failing outright
+    pool = BlockingConnectionPool.from_url(url,
+                                           max_connections=policy.max_connections,
+                                           timeout=policy.pool_timeout,
+                                           **options)
+    return Redis.from_pool(pool)
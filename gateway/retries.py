@@ -0,0 +1,282 @@
+import asyncio
+import math
+import random
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable, Mapping
+from typing import TYPE_CHECKING
+
+import httpx
+from fastapi import HTTPException
+
+from .config import RetryPolicy
+from .protection import UpstreamRejected
+
+if TYPE_CHECKING:
+    from .balancing import Target, UpstreamPool
+
+# Retries, failover and hedging of upstream attempts (routes with a RetryPolicy).
+#
+# An attempt is one send_streamed() call: it returns once response headers are in, so
+# retries and hedges never wait for or buffer a response body. Request bodies are not
+# buffered either: a streamed body is wrapped in a OnceBody, and an attempt that
+# failed after the body started flowing is not retried. Retries go to another target
+# when the pool has one, after a full-jitter backoff, and are capped by a per-route
+# budget so a struggling upstream doesn't get a retry storm on top of its load.
+
+# Transport errors raised before anything was sent: safe to retry for any method
+NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class OnceBody:
+    """A streamed request body that records whether sending it has started."""
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self.chunks = chunks
+        self.started = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        self.started = True
+        async for chunk in self.chunks:
+            yield chunk
+
+
+class RetryBudget:
+    """
+    Retries allowed as a fraction of recent requests, plus a floor per second.
+
+    Requests and retries are counted with exponential decay over WINDOW seconds, so
+    the budget follows current traffic without per-request bookkeeping.
+    """
+    WINDOW = 10.0
+
+    def __init__(self, ratio: float, min_per_second: float):
+        self.ratio = ratio
+        self.reserve = min_per_second * self.WINDOW
+        self.requests = 0.0
+        self.retries = 0.0
+        self._updated = time.monotonic()
+
+    def _decay(self, now: float) -> None:
+        elapsed = now - self._updated
+        if elapsed > 0:
+            factor = math.exp(-elapsed / self.WINDOW)
+            self.requests *= factor
+            self.retries *= factor
+            self._updated = now
+
+    def deposit(self) -> None:
+        self._decay(time.monotonic())
+        self.requests += 1
+
+    def withdraw(self) -> bool:
+        self._decay(time.monotonic())
+        if self.retries + 1 > self.ratio * self.requests + self.reserve:
+            return False
+        self.retries += 1
+        return True
+
+
+class LatencyTracker:
+    """The last SIZE latencies to response headers, and a percentile of them."""
+    SIZE = 1024
+    REFRESH = 64    # new samples before the percentile is recomputed
+
+    def __init__(self, q: float):
+        self.q = q
+        self.samples: list[float] = []
+        self._next = 0
+        self._fresh = 0
+        self._value: float | None = None
+
+    def add(self, latency: float) -> None:
+        if len(self.samples) < self.SIZE:
+            self.samples.append(latency)
+        else:
+            self.samples[self._next] = latency
+            self._next = (self._next + 1) % self.SIZE
+        self._fresh += 1
+
+    def percentile(self, min_samples: int) -> float | None:
+        if len(self.samples) < min_samples:
+            return None
+        if self._value is None or self._fresh >= self.REFRESH:
+            ordered = sorted(self.samples)
+            self._value = ordered[min(len(ordered) - 1, int(self.q * len(ordered)))]
+            self._fresh = 0
+        return self._value
+
+
+class RetryStats:
+    __slots__ = ('requests', 'retries', 'failovers', 'hedges', 'hedge_wins',
+                 'budget_exhausted')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+class Retrier:
+    """Retry/hedging state of one route: its policy, budget and latency history."""
+    def __init__(self, policy: RetryPolicy):
+        self.policy = policy
+        self.budget = RetryBudget(policy.budget_ratio, policy.budget_min_per_second)
+        self.latencies = LatencyTracker(policy.hedge.percentile) if policy.hedge else None
+        self.stats = RetryStats()
+        self._methods = frozenset(policy.methods)
+        self._statuses = frozenset(policy.statuses)
+        self._closing: set[asyncio.Task] = set()
+
+    def idempotent(self, method: str, headers: Mapping[str, str]) -> bool:
+        header = self.policy.idempotency_header
+        return method in self._methods or (header is not None and header in headers)
+
+    async def send(self,
+                   pool: 'UpstreamPool',
+                   target: 'Target',
+                   attempt: Callable[['Target'], Awaitable[httpx.Response]],
+                   idempotent: bool,
+                   body: OnceBody | None = None) -> httpx.Response:
+        """
+        Run `attempt` against `target`, then against other targets as the policy allows.
+
+        `attempt` raises HTTPException(502) chained to the transport error, as
+        send_streamed does. `body` is the request's streamed body, if it has one;
+        bodies in memory can always be sent again. The last failure is what the
+        caller gets when no attempt is left.
+        """
+        self.stats.requests += 1
+        self.budget.deposit()
+        tried = [target]
+        hedge = self.latencies is not None and idempotent and body is None
+        retries = 0
+        while True:
+            failure: HTTPException | None = None
+            resp: httpx.Response | None = None
+            try:
+                if hedge:
+                    resp = await self._hedged(pool, target, attempt, tried)
+                else:
+                    resp = await self._timed(attempt, target)
+            except HTTPException as exc:
+                if not self._retryable(exc, idempotent, body):
+                    raise
+                failure = exc
+            else:
+                if (not idempotent or resp.status_code not in self._statuses
+                        or (body is not None and body.started)):
+                    return resp     # a streamed body that has flowed can't be replayed
+
+            retries += 1
+            following = self._next_target(pool, tried, retries)
+            if following is None:
+                if failure is not None:
+                    raise failure
+                return resp
+            if resp is not None:
+                await resp.aclose()
+            self.stats.retries += 1
+            if following not in tried:
+                self.stats.failovers += 1
+            tried.append(following)
+            target = following
+            await asyncio.sleep(self.backoff(retries))
+
+    def backoff(self, retry: int) -> float:
+        cap = min(self.policy.backoff_max_ms, self.policy.backoff_base_ms * 2 ** (retry - 1))
+        return random.uniform(0, cap) / 1000
+
+    @staticmethod
+    def _retryable(exc: HTTPException, idempotent: bool, body: OnceBody | None) -> bool:
+        if body is not None and body.started:
+            return False
+        cause = exc.__cause__
+        if isinstance(cause, NOT_SENT):
+            return True
+        return idempotent and isinstance(cause, httpx.TransportError)
+
+    def _next_target(self, pool: 'UpstreamPool', tried: list['Target'],
+                     retries: int) -> 'Target | None':
+        if retries >= self.policy.attempts:
+            return None
+        return self._extra_target(pool, tried)
+
+    def _extra_target(self, pool: 'UpstreamPool', tried: list['Target']) -> 'Target | None':
+        """A target for one more attempt, within budget, preferring untried ones."""
+        if not self.budget.withdraw():
+            self.stats.budget_exhausted += 1
+            return None
+        try:
+            return pool.pick(exclude=tried)
+        except UpstreamRejected:
+            return None
+
+    async def _timed(self,
+                     attempt: Callable[['Target'], Awaitable[httpx.Response]],
+                     target: 'Target') -> httpx.Response:
+        started = time.perf_counter()
+        resp = await attempt(target)
+        if self.latencies is not None:
+            self.latencies.add(time.perf_counter() - started)
+        return resp
+
+    # ---- Hedging ----
+    async def _hedged(self,
+                      pool: 'UpstreamPool',
+                      target: 'Target',
+                      attempt: Callable[['Target'], Awaitable[httpx.Response]],
+                      tried: list['Target']) -> httpx.Response:
+        """
+        First response of `target` and, once it is slower than the policy percentile,
+        of a second target; the other attempt is cancelled (or its response closed).
+        """
+        hedge = self.policy.hedge
+        tasks = [asyncio.ensure_future(self._timed(attempt, target))]
+        winner = None
+        try:
+            delay = self.latencies.percentile(hedge.min_samples)
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks,
+                                             timeout=max(delay, hedge.min_delay_ms / 1000))
+                if not done:
+                    second = self._extra_target(pool, tried)
+                    if second is not None:
+                        tried.append(second)
+                        tasks.append(asyncio.ensure_future(self._timed(attempt, second)))
+                        self.stats.hedges += 1
+            winner = await self._first_response(tasks)
+            if winner is not tasks[0]:
+                self.stats.hedge_wins += 1
+            return winner.result()
+        finally:
+            for task in tasks:
+                if task is not winner:
+                    task.add_done_callback(self._discard)
+                    task.cancel()
+
+    @staticmethod
+    async def _first_response(tasks: list[asyncio.Task]) -> asyncio.Task:
+        """The first attempt that got a response; the first error if none did."""
+        pending = set(tasks)
+        error: BaseException | None = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                if task in done:
+                    if task.exception() is None:
+                        return task
+                    error = error or task.exception()
+        raise error
+
+    def _discard(self, task: asyncio.Task) -> None:
+        """Close the response of an attempt that lost the race."""
+        if task.cancelled() or task.exception() is not None:
+            return
+        closing = asyncio.ensure_future(task.result().aclose())
+        self._closing.add(closing)
+        closing.add_done_callback(self._closing.discard)
+
+    def snapshot(self) -> dict:
+        stats = {name: getattr(self.stats, name) for name in RetryStats.__slots__}
+        if self.latencies is not None and self.policy.hedge is not None:
+            delay = self.latencies.percentile(self.policy.hedge.min_samples)
+            stats['hedge_delay_ms'] = None if delay is None else round(delay * 1000, 3)
+        return stats
@@ -1,10 +1,163 @@
-from .config import settings
+from functools import lru_cache
+from typing import NamedTuple
+
+from .balancing import UpstreamPool
+from .config import settings, RouteRule
+
+# Segment-aware prefix matching.
+#
+# Route prefixes are compiled once into a trie keyed by path segment, so a lookup
+# walks the request path a single time instead of sorting and scanning every rule.
+# A prefix segment written as '{name}' captures any single path segment as a
+# parameter; '*' does the same without keeping the value.
+
+
+class RouteMatch(NamedTuple):
+    rule: RouteRule
+    suffix: str
+    params: dict[str, str]
+    pool: UpstreamPool
+
+
+class _Node:
+    __slots__ = ('children', 'param', 'rule', 'param_names')
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        self.param: _Node | None = None
+        self.rule: RouteRule | None = None
+        self.param_names: tuple[str | None, ...] = ()
+
+
+def _split(path: str) -> list[str]:
+    return path[1:].split('/') if path.startswith('/') else path.split('/')
+
+
+class Router:
+    """
+    Routing table compiled from a list of RouteRules.
+
+    The longest matching prefix wins, where length is counted in whole path segments
+    ('/api/users' matches '/api/users/1' but not '/api/usersX'). Literal segments take
+    precedence over parameters at the same depth. Results for recently seen paths are
+    kept in an LRU cache.
+
+    Each rule gets its own UpstreamPool, so balancing state lives as long as the
+    compiled table it belongs to. When recompiling, pools of rules that are unchanged
+    in `previous` are carried over, keeping their in-flight counts, latency and
+    breaker state.
+    """
+    def __init__(self,
+                 routes: list[RouteRule],
+                 cache_size: int = 4096,
+                 previous: 'Router | None' = None):
+        self.routes = routes
+        self.root = _Node()
+        self.pools: dict[int, UpstreamPool] = {}
+        reusable = {} if previous is None else {
+            pool.rule.prefix: pool for pool in previous.pools.values()
+        }
+        for rule in routes:
+            self._insert(rule, reusable)
+        self.match = lru_cache(maxsize=cache_size)(self._match)
+
+    def _insert(self, rule: RouteRule, reusable: dict[str, UpstreamPool]) -> None:
+        node = self.root
+        names: list[str | None] = []
+        for segment in _split(rule.prefix):
+            if not segment:
+                continue
+            if segment == '*' or (segment.startswith('{') and segment.endswith('}')):
+                names.append(None if segment == '*' else segment[1:-1])
+                if node.param is None:
+                    node.param = _Node()
+                node = node.param
+            else:
+                node = node.children.setdefault(segment, _Node())
+        # First rule registered for a prefix wins, as with the previous linear scan
+        if node.rule is None:
+            node.rule = rule
+            node.param_names = tuple(names)
+            pool = reusable.get(rule.prefix)
+            self.pools[id(rule)] = pool if pool is not None and pool.rule == rule else UpstreamPool(rule)
+
+    def _match(self, path: str) -> RouteMatch | None:
+        segments = _split(path)
+        found = self._search(self.root, segments, 0, [])
+        if found is None:
+            return None
+
+        depth, node, values = found
+        suffix = '/' + '/'.join(segments[depth:])
+        params = {
+            name: value for name, value in zip(node.param_names, values)
+            if name is not None
+        }
+        return RouteMatch(node.rule, suffix, params, self.pools[id(node.rule)])
+
+    def _search(self,
+                node: _Node,
+                segments: list[str],
+                depth: int,
+                values: list[str]) -> tuple[int, _Node, tuple[str, ...]] | None:
+        best = (depth, node, tuple(values)) if node.rule is not None else None
+        if depth == len(segments):
+            return best
+
+        segment = segments[depth]
+        child = node.children.get(segment)
+        if child is not None:
+            found = self._search(child, segments, depth + 1, values)
+            if found is not None and (best is None or found[0] > best[0]):
+                best = found
+
+        if node.param is not None and segment:
+            values.append(segment)
+            found = self._search(node.param, segments, depth + 1, values)
+            values.pop()
+            # strictly deeper only: literal matches win ties
+            if found is not None and (best is None or found[0] > best[0]):
+                best = found
+
+        return best
+
+
+_router: Router | None = None
+
+
+def get_router() -> Router:
+    """
+    Router for the current settings.routes, recompiled when the list is replaced.
+
+    The new router is built aside and published with a single assignment, so
+    concurrent lookups always see either the old or the new table.
+    """
+    global _router
+    router = _router
+    if router is None or router.routes is not settings.routes:
+        router = Router(settings.routes, cache_size=settings.route_cache_size)
+        _router = router
+    return router
+
+
+def publish_router(router: Router) -> None:
+    """
+    Make a router compiled aside (e.g. by a config reload) the current one.
+
+    settings.routes and the router are replaced together, without awaiting in
+    between, so get_router() never sees them disagree and never recompiles.
+    """
+    global _router
+    settings.routes = router.routes
+    _router = router
+
+
+def match_route(path: str) -> RouteMatch | None:
+    return get_router().match(path)
 
-# Basic prefix matching
 
 def find_upstream(path: str) -> tuple[str | None, str | None]:
-    for rule in sorted(settings.routes, key=lambda r: len(r.prefix), reverse=True):
-        if path.startswith(rule.prefix):
-            suffix = path[len(rule.prefix):] or '/'
-            return rule.upstream, suffix
-    return None, None
+    match = match_route(path)
+    if match is None:
+        return None, None
+    return match.rule.upstream, match.suffix
@@ -0,0 +1,246 @@
+"""
+Production entry point: N single-threaded gateway workers behind one port.
+
+    python -m gateway.serve --host 0.0.0.0 --port 8000 --workers 16
+
+Every worker is a separate interpreter running the app under uvicorn (with uvloop
+and httptools when installed) and its own lifespan, so each has its own Redis
+connection pool, httpx clients, compiled router, caches and metrics; nothing is
+shared between them. Workers bind the port themselves with SO_REUSEPORT and the
+kernel spreads connections across them. Where SO_REUSEPORT is missing, the
+supervisor binds once and the workers inherit the socket.
+
+The supervisor restarts workers that die. SIGHUP reloads without downtime: a full
+set of new workers is started and must be accepting before the old ones get SIGTERM.
+The old workers then stop accepting and drain in-flight requests for up to
+--graceful-timeout seconds. SIGTERM/SIGINT drain all workers and exit.
+"""
+import argparse
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import uvicorn
+
+logger = logging.getLogger('uvicorn.error')
+
+REUSE_PORT = hasattr(socket, 'SO_REUSEPORT')
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', default='gateway.main:application',
+                        help='ASGI app import string (module:attribute)')
+    parser.add_argument('--factory', action='store_true',
+                        help='--app names a function returning the app')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int,
+                        default=int(os.getenv('WEB_CONCURRENCY', os.cpu_count() or 1)))
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--graceful-timeout', type=float, default=30.0,
+                        help='seconds a stopping worker may spend draining requests')
+    parser.add_argument('--startup-timeout', type=float, default=30.0,
+                        help='seconds a new worker may take to start accepting')
+    parser.add_argument('--log-level', default='info')
+    parser.add_argument('--ws-per-message-deflate', action='store_true',
+                        help='offer WebSocket compression to clients (a zlib context per '
+                             'tunnel)')
+    # Internal: set by the supervisor on the worker command line
+    parser.add_argument('--worker', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--fd', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--ready-fd', type=int, default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def bind(host: str, port: int, backlog: int, reuse_port: bool) -> socket.socket:
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+# ---- Worker ----
+
+class WorkerServer(uvicorn.Server):
+    """uvicorn server that tells the supervisor once it is accepting connections."""
+    def __init__(self, config: uvicorn.Config, ready_fd: int | None):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets: list[socket.socket] | None = None) -> None:
+        await super().startup(sockets=sockets)
+        if self.started and self.ready_fd is not None:
+            os.write(self.ready_fd, b'1')
+            os.close(self.ready_fd)
+            self.ready_fd = None
+
+
+def run_worker(args: argparse.Namespace) -> None:
+    if args.fd is not None:
+        sock = socket.socket(fileno=args.fd)
+    else:
+        sock = bind(args.host, args.port, args.backlog, reuse_port=True)
+
+    config = uvicorn.Config(
+        args.app,
+        factory=args.factory,
+        loop='auto',            # uvloop when installed
+        http='auto',            # httptools when installed
+        lifespan='on',
+        log_level=args.log_level,
+        access_log=False,
+        backlog=args.backlog,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        ws_per_message_deflate=args.ws_per_message_deflate,
+    )
+    WorkerServer(config, args.ready_fd).run(sockets=[sock])
+
+
+# ---- Supervisor ----
+
+class Supervisor:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.workers: dict[int, subprocess.Popen] = {}     # slot -> process
+        self.retiring: list[subprocess.Popen] = []          # draining after a reload
+        self.listener: socket.socket | None = None
+        self.stopping = False
+        self.reload_requested = False
+
+    def command(self, slot: int, ready_fd: int) -> list[str]:
+        args = self.args
+        command = [sys.executable, '-m', 'gateway.serve',
+                   '--app', args.app, '--host', args.host, '--port', str(args.port),
+                   '--backlog', str(args.backlog),
+                   '--graceful-timeout', str(args.graceful_timeout),
+                   '--log-level', args.log_level,
+                   '--worker', str(slot), '--ready-fd', str(ready_fd)]
+        if args.factory:
+            command.append('--factory')
+        if args.ws_per_message_deflate:
+            command.append('--ws-per-message-deflate')
+        if self.listener is not None:
+            command += ['--fd', str(self.listener.fileno())]
+        return command
+
+    def spawn(self, slot: int) -> subprocess.Popen | None:
+        """Start a worker and wait until it accepts connections; None if it doesn't."""
+        read_fd, write_fd = os.pipe()
+        pass_fds = [write_fd] + ([self.listener.fileno()] if self.listener is not None else [])
+        process = subprocess.Popen(self.command(slot, write_fd), pass_fds=pass_fds,
+                                   env={**os.environ, 'GATEWAY_WORKER_ID': str(slot)})
+        os.close(write_fd)
+        try:
+            ready, _, _ = select.select([read_fd], [], [], self.args.startup_timeout)
+            if ready and os.read(read_fd, 1) == b'1':
+                return process
+        finally:
+            os.close(read_fd)
+
+        logger.error("Worker %d (pid %d) failed to start", slot, process.pid)
+        process.kill()
+        process.wait()
+        return None
+
+    def reload(self) -> None:
+        """Replace every worker; old ones are only stopped once all new ones are up."""
+        logger.info("Reloading %d workers", len(self.workers))
+        fresh: dict[int, subprocess.Popen] = {}
+        for slot in self.workers:
+            process = self.spawn(slot)
+            if process is None:
+                logger.error("Reload aborted; keeping the running workers")
+                for started in fresh.values():
+                    started.terminate()
+                self.retiring.extend(fresh.values())
+                return
+            fresh[slot] = process
+        for process in self.workers.values():
+            process.terminate()     # uvicorn drains in-flight requests on SIGTERM
+            self.retiring.append(process)
+        self.workers = fresh
+
+    def reap(self) -> None:
+        self.retiring = [process for process in self.retiring if process.poll() is None]
+        for slot, process in list(self.workers.items()):
+            if process.poll() is not None and not self.stopping:
+                logger.warning("Worker %d (pid %d) exited with %s; restarting",
+                               slot, process.pid, process.returncode)
+                replacement = self.spawn(slot)
+                if replacement is not None:
+                    self.workers[slot] = replacement
+
+    def shutdown(self) -> None:
+        processes = list(self.workers.values()) + self.retiring
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        for process in processes:
+            try:
+                process.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    def run(self) -> None:
+        args = self.args
+        if not REUSE_PORT:
+            self.listener = bind(args.host, args.port, args.backlog, reuse_port=False)
+
+        def on_stop(signum, frame):
+            self.stopping = True
+
+        def on_reload(signum, frame):
+            self.reload_requested = True
+
+        signal.signal(signal.SIGTERM, on_stop)
+        signal.signal(signal.SIGINT, on_stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, on_reload)
+
+        for slot in range(args.workers):
+            process = self.spawn(slot)
+            if process is None:
+                self.shutdown()
+                sys.exit(1)
+            self.workers[slot] = process
+        logger.info("Serving on %s:%d with %d workers (SO_REUSEPORT %s)",
+                    args.host, args.port, args.workers, 'on' if REUSE_PORT else 'off')
+
+        try:
+            while not self.stopping:
+                if self.reload_requested:
+                    self.reload_requested = False
+                    self.reload()
+                self.reap()
+                time.sleep(0.2)
+        finally:
+            self.shutdown()
+            if self.listener is not None:
+                self.listener.close()
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    if args.worker is not None:
+        run_worker(args)
+        return
+    logging.basicConfig(level=args.log_level.upper(), format='%(levelname)s:     %(message)s')
+    Supervisor(args).run()
+
+
+if __name__ == '__main__':
+    main()
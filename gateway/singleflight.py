@@ -0,0 +1,211 @@
+import asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable, Mapping
+
+import httpx
+
+from .config import CoalescePolicy
+
+# Single-flight request coalescing.
+#
+# Identical GET/HEAD requests that arrive while an upstream call for the same key is
+# in flight join that call instead of opening their own. A background task reads the
+# upstream body once into a list of chunks, and every request gets an httpx.Response
+# whose stream walks that list, so the bytes objects are shared rather than copied
+# per waiter. The pump runs independently of any single client, so a disconnecting
+# client doesn't cut the response short for the others. Once nobody can join anymore,
+# it pauses while the slowest reader is more than max_body_bytes behind, so a flight
+# never holds much more than that in memory.
+
+
+class FlightStream(httpx.AsyncByteStream):
+    """One request's view of a flight's body."""
+    def __init__(self, flight: 'Flight'):
+        self.flight = flight
+        self.pos = flight.base      # absolute index of the next chunk to yield
+        flight.readers.add(self)
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        flight = self.flight
+        while True:
+            index = self.pos - flight.base
+            if index < len(flight.chunks):
+                self.pos += 1
+                flight.read.set()
+                yield flight.chunks[index]
+            elif flight.done:
+                break
+            else:
+                await flight.changed.wait()
+        if flight.error is not None:
+            raise flight.error
+
+    async def aclose(self) -> None:
+        self.flight.readers.discard(self)
+        self.flight.read.set()
+
+
+class Flight:
+    __slots__ = ('key', 'response', 'error', 'chunks', 'base', 'size', 'buffered', 'done',
+                 'joinable', 'readers', 'ready', 'changed', 'read')
+
+    def __init__(self, key: str):
+        self.key = key
+        self.response: httpx.Response | None = None
+        self.error: BaseException | None = None
+        self.chunks: list[bytes] = []
+        self.base = 0               # absolute index of chunks[0] once trimming starts
+        self.size = 0
+        self.buffered = 0           # bytes in chunks
+        self.done = False
+        self.joinable = True
+        self.readers: set[FlightStream] = set()
+        self.ready = asyncio.Event()        # response headers (or an error) are in
+        self.changed = asyncio.Event()      # replaced on every new chunk
+        self.read = asyncio.Event()         # a reader moved on or left
+
+    def notify(self) -> None:
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    def trim(self) -> None:
+        """Drop chunks every reader is past; only valid once nobody can join at 0."""
+        low = min((reader.pos for reader in self.readers), default=self.base + len(self.chunks))
+        if low > self.base:
+            dropped = self.chunks[:low - self.base]
+            del self.chunks[:low - self.base]
+            self.buffered -= sum(map(len, dropped))
+            self.base = low
+
+    def share(self, stream: FlightStream) -> httpx.Response:
+        upstream = self.response
+        return httpx.Response(upstream.status_code,
+                              headers=upstream.headers,
+                              stream=stream,
+                              request=upstream.request)
+
+
+class CoalesceStats:
+    __slots__ = ('flights', 'coalesced', 'bypassed')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+class SingleFlight:
+    """Registry of in-flight upstream calls keyed by method, URL and key headers."""
+    def __init__(self):
+        self._flights: dict[str, Flight] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.stats = CoalesceStats()
+
+    @staticmethod
+    def key(method: str,
+            path: str,
+            query: str,
+            headers: Mapping[str, str],
+            names: list[str]) -> str:
+        parts = [method, path + ('?' + query if query else '')]
+        parts.extend(headers.get(name, '') for name in names)
+        return '\n'.join(parts)
+
+    async def fetch(self,
+                    key: str,
+                    fetch: Callable[[], Awaitable[httpx.Response]],
+                    policy: CoalescePolicy) -> httpx.Response:
+        """
+        Response for `key`, shared with identical requests already in flight.
+
+        The first request for a key starts the upstream call; up to policy.max_waiters
+        requests share it, later ones call `fetch` themselves. Every returned response
+        must be closed.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight(key)
+            self._flights[key] = flight
+            self.stats.flights += 1
+            task = asyncio.ensure_future(self._pump(flight, fetch, policy.max_body_bytes))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        elif len(flight.readers) >= policy.max_waiters:
+            self.stats.bypassed += 1
+            return await fetch()
+        else:
+            self.stats.coalesced += 1
+
+        stream = FlightStream(flight)
+        try:
+            await flight.ready.wait()
+        except BaseException:
+            await stream.aclose()
+            raise
+        if flight.response is None:
+            await stream.aclose()
+            raise flight.error
+        return flight.share(stream)
+
+    def _detach(self, flight: Flight) -> None:
+        """Stop new requests from joining; they start a flight of their own."""
+        flight.joinable = False
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    async def _pump(self,
+                    flight: Flight,
+                    fetch: Callable[[], Awaitable[httpx.Response]],
+                    max_body_bytes: int) -> None:
+        try:
+            try:
+                resp = await fetch()
+            except BaseException as exc:
+                flight.error = exc
+                return
+
+            flight.response = resp
+            flight.ready.set()
+            try:
+                declared = resp.headers.get('content-length', '')
+                if declared.isdigit() and int(declared) > max_body_bytes:
+                    self._detach(flight)
+                async for chunk in resp.aiter_raw():
+                    flight.chunks.append(chunk)
+                    flight.size += len(chunk)
+                    flight.buffered += len(chunk)
+                    if flight.joinable and flight.size > max_body_bytes:
+                        self._detach(flight)
+                    if not flight.joinable:
+                        if not flight.readers:
+                            break
+                        # Nobody can start from chunk 0 anymore: keep only the unread tail
+                        flight.trim()
+                    flight.notify()
+                    if not flight.joinable:
+                        await self._wait_for_readers(flight, max_body_bytes)
+            except Exception as exc:
+                flight.error = exc
+            finally:
+                await resp.aclose()
+        finally:
+            flight.done = True
+            self._detach(flight)
+            flight.ready.set()
+            flight.notify()
+
+    @staticmethod
+    async def _wait_for_readers(flight: Flight, max_buffered: int) -> None:
+        """Pause the pump until the slowest reader is within `max_buffered` bytes."""
+        while flight.buffered > max_buffered and flight.readers:
+            flight.read.clear()
+            await flight.read.wait()
+            flight.trim()
+
+    def snapshot(self) -> dict:
+        stats = {name: getattr(self.stats, name) for name in CoalesceStats.__slots__}
+        stats['in_flight'] = len(self._flights)
+        return stats
+
+    async def aclose(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,73 @@
+from collections.abc import AsyncIterator, Callable
+
+import httpx
+from fastapi import Request
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+def request_body_stream(request: Request) -> AsyncIterator[bytes] | None:
+    """
+    Client body as an async iterator for httpx, or None when the client sent no body.
+
+    Skipping bodiless requests keeps httpx from adding 'Transfer-Encoding: chunked'
+    to plain GETs.
+    """
+    headers = request.headers
+    if 'content-length' not in headers and 'transfer-encoding' not in headers:
+        return None
+    return request.stream()
+
+
+class UpstreamStreamingResponse(StreamingResponse):
+    """
+    Relays a streamed httpx response to the client chunk by chunk.
+
+    Each chunk is pulled from upstream only after the previous one was handed to the
+    server, so a slow client applies backpressure all the way to the upstream socket.
+    The upstream response is always closed, including when the client disconnects
+    mid-stream (Starlette skips background tasks in that case). `content` replaces
+    the upstream body iterator, e.g. with a wrapper around upstream.aiter_bytes().
+    `headers` are raw (name, value) pairs and are relayed as given.
+    """
+    def __init__(self,
+                 upstream: httpx.Response,
+                 headers: list[tuple[bytes, bytes]] | None = None,
+                 content: AsyncIterator[bytes] | None = None):
+        super().__init__(
+            content=upstream.aiter_bytes() if content is None else content,
+            status_code=upstream.status_code,
+        )
+        self.raw_headers = [] if headers is None else headers
+        self.upstream = upstream
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.upstream.aclose()
+
+
+class ReleasingStream(httpx.AsyncByteStream):
+    """
+    Wraps an httpx response stream to run `release` exactly once when it is closed.
+
+    Installed as `response.stream`, it ties per-request bookkeeping (such as an
+    upstream target's in-flight count) to the response's lifetime, whoever ends up
+    closing it.
+    """
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]):
+        self.stream = stream
+        self.release: Callable[[], None] | None = release
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self.stream.aclose()
+        finally:
+            release, self.release = self.release, None
+            if release is not None:
+                release()
@@ -10,3 +10,8 @@ class FakeRateLimiter:
         self.calls.append((key, capacity, rate, tokens))
 
         return self.allow_next, capacity
+
+    async def check(self, checks: list[tuple[str, str, int, float]], tokens: int = 1):
+        self.calls.append((checks, tokens))
+
+        return self.allow_next, min(capacity for _, _, capacity, _ in checks)
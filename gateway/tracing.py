@@ -0,0 +1,323 @@
+import asyncio
+import json
+import logging
+import random
+import re
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from contextvars import ContextVar
+from time import perf_counter
+
+import httpx
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import TracingSettings
+from .headers import RawHeaders
+
+logger = logging.getLogger('uvicorn.error')
+
+# Request tracing with W3C Trace Context and tail-based sampling.
+#
+# Every proxied request gets a Trace. It joins the caller's trace when the request
+# has a valid traceparent and starts a new one otherwise. The gateway's span is sent
+# upstream as the parent. Stages (admission, rate limiting, route matching, pool
+# wait, connect, upstream attempts, body transfer) add spans to the current request's
+# Trace, found through a context variable, so nothing is threaded through call
+# signatures. Recording a span appends one tuple. Whether a trace is worth keeping is
+# decided once the request has finished: slow and failed requests go to a bounded
+# ring buffer and the exporter, and everything else is dropped with no further cost.
+
+_TRACEPARENT = re.compile(rb'([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?')
+_ZERO_TRACE = b'0' * 32
+_ZERO_SPAN = b'0' * 16
+
+# OTLP span kinds
+_INTERNAL, _SERVER, _CLIENT = 1, 2, 3
+
+current: ContextVar['Trace | None'] = ContextVar('gateway_trace', default=None)
+
+
+def new_id(bits: int) -> str:
+    """Random non-zero trace (128 bits) or span (64 bits) id, as lower-case hex."""
+    return f'{random.getrandbits(bits) or 1:0{bits // 4}x}'
+
+
+def parse_traceparent(value: bytes) -> tuple[str, str, str] | None:
+    """(trace_id, parent_id, flags) of a valid traceparent header value, else None."""
+    match = _TRACEPARENT.fullmatch(value.strip())
+    if match is None:
+        return None
+    version, trace_id, parent_id, flags, rest = match.groups()
+    # Version 00 has exactly four fields; later versions may append more
+    if version == b'ff' or (version == b'00' and rest) \
+            or trace_id == _ZERO_TRACE or parent_id == _ZERO_SPAN:
+        return None
+    return trace_id.decode(), parent_id.decode(), flags.decode()
+
+
+class Trace:
+    """One request's root span and the spans of its stages."""
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'flags', 'name', 'status',
+                 'started', 'ended', 'wall_ns', 'spans')
+
+    def __init__(self, trace_id: str | None = None, parent_id: str | None = None,
+                 flags: str = '01'):
+        self.trace_id = trace_id or new_id(128)
+        self.span_id = new_id(64)
+        self.parent_id = parent_id
+        # A new trace is marked sampled, so upstreams record spans it may keep
+        self.flags = flags
+        self.name = ''
+        self.status = 0
+        self.started = perf_counter()
+        self.ended: float | None = None
+        self.wall_ns = time.time_ns()
+        self.spans: list[tuple[str, float, float, dict | None]] = []
+
+    @classmethod
+    def from_headers(cls, raw: RawHeaders) -> 'Trace':
+        for name, value in raw:
+            if name == b'traceparent':
+                parsed = parse_traceparent(value)
+                if parsed is not None:
+                    return cls(*parsed)
+                break
+        return cls()
+
+    def traceparent(self) -> bytes:
+        """Header value for upstream requests, with the gateway's span as their parent."""
+        return f'00-{self.trace_id}-{self.span_id}-{self.flags}'.encode('latin-1')
+
+    def add(self, name: str, started: float, ended: float, attributes: dict | None) -> None:
+        # Background work spawned by a request (e.g. cache revalidation) may outlive it
+        if self.ended is None:
+            self.spans.append((name, started, ended, attributes))
+
+    @property
+    def duration(self) -> float:
+        return (perf_counter() if self.ended is None else self.ended) - self.started
+
+    def summary(self) -> dict:
+        def ms(seconds: float) -> float:
+            return round(seconds * 1000, 3)
+
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'status': self.status,
+            'duration_ms': ms(self.duration),
+            'spans': [{'name': name, 'offset_ms': ms(started - self.started),
+                       'duration_ms': ms(ended - started), **(attributes or {})}
+                      for name, started, ended, attributes in self.spans],
+        }
+
+
+def record(name: str, started: float, ended: float | None = None, **attributes) -> None:
+    """Add a span for a stage of the request being handled, if it is traced."""
+    trace = current.get()
+    if trace is not None:
+        trace.add(name, started, perf_counter() if ended is None else ended, attributes or None)
+
+
+def current_traceparent() -> bytes | None:
+    trace = current.get()
+    return None if trace is None else trace.traceparent()
+
+
+# ---- OTLP/JSON ----
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        encoded = {'boolValue': value}
+    elif isinstance(value, int):
+        encoded = {'intValue': str(value)}     # int64 is a string in OTLP/JSON
+    elif isinstance(value, float):
+        encoded = {'doubleValue': value}
+    else:
+        encoded = {'stringValue': str(value)}
+    return {'key': key, 'value': encoded}
+
+
+def _attributes(attributes: dict | None) -> list[dict]:
+    return [_attribute(key, value) for key, value in (attributes or {}).items()]
+
+
+def otlp_spans(trace: Trace) -> Iterator[dict]:
+    def nanos(moment: float) -> str:
+        return str(trace.wall_ns + int((moment - trace.started) * 1e9))
+
+    root = {
+        'traceId': trace.trace_id,
+        'spanId': trace.span_id,
+        'name': trace.name,
+        'kind': _SERVER,
+        'startTimeUnixNano': nanos(trace.started),
+        'endTimeUnixNano': nanos(trace.ended),
+        'attributes': _attributes({'http.response.status_code': trace.status}),
+        'status': {'code': 2 if trace.status >= 500 else 0},
+    }
+    if trace.parent_id is not None:
+        root['parentSpanId'] = trace.parent_id
+    yield root
+    for name, started, ended, attributes in trace.spans:
+        yield {
+            'traceId': trace.trace_id,
+            'spanId': new_id(64),
+            'parentSpanId': trace.span_id,
+            'name': name,
+            'kind': _CLIENT if name == 'upstream' else _INTERNAL,
+            'startTimeUnixNano': nanos(started),
+            'endTimeUnixNano': nanos(ended),
+            'attributes': _attributes(attributes),
+        }
+
+
+def otlp_json(traces: Iterable[Trace], service_name: str) -> dict:
+    """An OTLP ExportTraceServiceRequest in its JSON encoding."""
+    return {'resourceSpans': [{
+        'resource': {'attributes': _attributes({'service.name': service_name})},
+        'scopeSpans': [{
+            'scope': {'name': 'gateway'},
+            'spans': [span for trace in traces for span in otlp_spans(trace)],
+        }],
+    }]}
+
+
+def _append(path: str, line: str) -> None:
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write(line)
+
+
+class TracingStats:
+    __slots__ = ('traced', 'kept', 'exported', 'dropped', 'export_errors')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+class Tracer:
+    """Tail sampling of finished traces, the ring buffer of kept ones and their export."""
+    def __init__(self, policy: TracingSettings):
+        self.policy = policy
+        self.stats = TracingStats()
+        self.recent: deque[Trace] = deque(maxlen=policy.buffer_size)
+        self._pending: deque[Trace] = deque(maxlen=policy.max_pending)
+        self._task: asyncio.Task | None = None
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def exporting(self) -> bool:
+        return self.policy.export_file is not None or self.policy.otlp_endpoint is not None
+
+    def start(self) -> None:
+        if self.exporting and self._task is None:
+            self._task = asyncio.create_task(self._export_loop())
+
+    def begin(self, raw: RawHeaders) -> Trace:
+        self.stats.traced += 1
+        return Trace.from_headers(raw)
+
+    def finish(self, trace: Trace, status: int) -> None:
+        trace.ended = perf_counter()
+        trace.status = status
+        if not self.keep(trace):
+            return
+        self.stats.kept += 1
+        self.recent.append(trace)
+        if self.exporting:
+            if len(self._pending) == self._pending.maxlen:
+                self.stats.dropped += 1
+            self._pending.append(trace)
+
+    def keep(self, trace: Trace) -> bool:
+        policy = self.policy
+        if trace.duration * 1000 >= policy.slow_ms:
+            return True
+        if policy.keep_errors and trace.status >= 500:
+            return True
+        return policy.sample_ratio > 0 and random.random() < policy.sample_ratio
+
+    async def _export_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.policy.export_interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Export the traces kept since the last flush."""
+        if not self._pending:
+            return
+        traces = list(self._pending)
+        self._pending.clear()
+        document = otlp_json(traces, self.policy.service_name)
+        try:
+            if self.policy.export_file is not None:
+                line = json.dumps(document, separators=(',', ':')) + '\n'
+                await asyncio.to_thread(_append, self.policy.export_file, line)
+            if self.policy.otlp_endpoint is not None:
+                if self._client is None:
+                    self._client = httpx.AsyncClient(timeout=5.0)
+                resp = await self._client.post(self.policy.otlp_endpoint, json=document)
+                resp.raise_for_status()
+        except (OSError, httpx.HTTPError) as exc:
+            self.stats.export_errors += 1
+            logger.warning("Trace export failed: %r", exc)
+            return
+        self.stats.exported += len(traces)
+
+    def snapshot(self) -> dict:
+        stats = {name: getattr(self.stats, name) for name in TracingStats.__slots__}
+        stats['buffered'] = len(self.recent)
+        stats['pending'] = len(self._pending)
+        return stats
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class TracingMiddleware:
+    """
+    Traces each HTTP request through the app's Tracer.
+
+    Outermost, so the root span covers admission and rate limiting too. It is named
+    after the matched route prefix the proxy leaves in scope['gateway.route'], or
+    after the path for other endpoints.
+    """
+    def __init__(self,
+                 app: ASGIApp,
+                 exclude: Iterable[str] = ('/metrics', '/_gateway/health')):
+        self.app = app
+        self.exclude = frozenset(exclude)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or scope['path'] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+        tracer: Tracer = scope['app'].state.tracer
+        if not tracer.policy.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        trace = tracer.begin(scope['headers'])
+        status = 500
+
+        async def send_traced(message: Message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        token = current.set(trace)
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            current.reset(token)
+            trace.name = f"{scope['method']} {scope.get('gateway.route') or scope['path']}"
+            tracer.finish(trace, status)
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import time
+
+from starlette.responses import JSONResponse
+from starlette.websockets import WebSocket
+from websockets.asyncio.client import ClientConnection, connect
+from websockets.exceptions import ConnectionClosed
+
+from .config import WebSocketPolicy
+from .headers import RawHeaders
+
+logger = logging.getLogger('uvicorn.error')
+
+# WebSocket tunnels: a client's upgraded connection relayed to an upstream WebSocket.
+#
+# Each leg negotiates its own handshake; only the subprotocol chosen upstream is
+# passed back to the client. A tunnel is two relay tasks, one per direction, each
+# awaiting its write before reading the next message, so a slow reader on one side
+# stops reading on the other instead of queueing: buffering is bounded by max_queue
+# messages on the upstream connection and the servers' write buffers. Idle and
+# lifetime timeouts are enforced by one sweeper for all tunnels rather than a timer
+# per tunnel, so an idle tunnel costs its two suspended tasks and nothing else.
+
+# Close codes that may not be sent in a close frame (RFC 6455 section 7.4.1)
+_RESERVED_CODES = {1005: 1000, 1006: 1011, 1015: 1011}
+
+
+class TunnelStats:
+    __slots__ = ('opened', 'active', 'refused', 'upstream_errors', 'idle_closed',
+                 'lifetime_closed', 'messages_up', 'messages_down')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+class Tunnel:
+    __slots__ = ('websocket', 'upstream', 'policy', 'stats', 'opened_at', 'last_active',
+                 'tasks', 'client_close', 'expired')
+
+    def __init__(self,
+                 websocket: WebSocket,
+                 upstream: ClientConnection,
+                 policy: WebSocketPolicy,
+                 stats: TunnelStats):
+        self.websocket = websocket
+        self.upstream = upstream
+        self.policy = policy
+        self.stats = stats
+        self.opened_at = self.last_active = time.monotonic()
+        self.tasks: tuple[asyncio.Task, ...] = ()
+        self.client_close: tuple[int, str] | None = None
+        self.expired: tuple[int, str] | None = None
+
+    async def run(self) -> None:
+        self.tasks = (asyncio.ensure_future(self._to_upstream()),
+                      asyncio.ensure_future(self._to_client()))
+        try:
+            await asyncio.wait(self.tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.wait(self.tasks)
+            for task in self.tasks:
+                if not task.cancelled() and task.exception() is not None:
+                    logger.debug("WebSocket tunnel relay failed: %r", task.exception())
+            await self._close()
+
+    def expire(self, reason: str, code: int = 1001) -> None:
+        """End the tunnel on both sides; 1001 is 'going away'."""
+        if self.expired is None:
+            self.expired = (code, reason)
+            for task in self.tasks:
+                task.cancel()
+
+    async def _to_upstream(self) -> None:
+        receive, upstream, stats = self.websocket.receive, self.upstream, self.stats
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                self.client_close = (message.get('code', 1000), message.get('reason') or '')
+                return
+            self.last_active = time.monotonic()
+            stats.messages_up += 1
+            data = message.get('text')
+            if data is None:
+                data = message.get('bytes') or b''
+            if len(data) > self.policy.max_message_bytes:
+                self.expire('message too big', 1009)
+                return
+            await upstream.send(data)
+
+    async def _to_client(self) -> None:
+        send, stats = self.websocket.send, self.stats
+        try:
+            async for message in self.upstream:
+                self.last_active = time.monotonic()
+                stats.messages_down += 1
+                if isinstance(message, str):
+                    await send({'type': 'websocket.send', 'text': message})
+                else:
+                    await send({'type': 'websocket.send', 'bytes': message})
+        except ConnectionClosed:
+            pass
+
+    async def _close(self) -> None:
+        """Close both legs, passing the first side's close code on to the other."""
+        if self.expired is not None:
+            code, reason = self.expired
+        elif self.client_close is not None:
+            code, reason = self.client_close
+        else:
+            code = self.upstream.close_code or 1000
+            reason = self.upstream.close_reason or ''
+        code = _RESERVED_CODES.get(code, code)
+
+        if self.client_close is None:
+            try:
+                await self.websocket.send({'type': 'websocket.close', 'code': code,
+                                           'reason': reason})
+            except (RuntimeError, OSError):
+                pass    # the client went away in the meantime
+        await self.upstream.close(code, reason)
+
+
+class Tunnels:
+    """Open tunnels of this worker and the sweeper enforcing their timeouts."""
+    SWEEP_INTERVAL = 1.0
+
+    def __init__(self):
+        self.stats = TunnelStats()
+        self._open: set[Tunnel] = set()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._sweep())
+
+    async def relay(self, websocket: WebSocket, upstream: ClientConnection,
+                    policy: WebSocketPolicy) -> None:
+        """Accept the client with the upstream's subprotocol and relay until either closes."""
+        await websocket.accept(subprotocol=upstream.subprotocol)
+        tunnel = Tunnel(websocket, upstream, policy, self.stats)
+        self._open.add(tunnel)
+        self.stats.opened += 1
+        self.stats.active += 1
+        try:
+            await tunnel.run()
+        finally:
+            self._open.discard(tunnel)
+            self.stats.active -= 1
+
+    async def _sweep(self) -> None:
+        while True:
+            await asyncio.sleep(self.SWEEP_INTERVAL)
+            self.sweep(time.monotonic())
+
+    def sweep(self, now: float) -> None:
+        for tunnel in list(self._open):
+            policy = tunnel.policy
+            if now - tunnel.last_active >= policy.idle_timeout:
+                self.stats.idle_closed += 1
+                tunnel.expire('idle timeout')
+            elif policy.max_lifetime is not None and now - tunnel.opened_at >= policy.max_lifetime:
+                self.stats.lifetime_closed += 1
+                tunnel.expire('maximum lifetime reached')
+
+    def snapshot(self) -> dict:
+        return {name: getattr(self.stats, name) for name in TunnelStats.__slots__}
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for tunnel in list(self._open):
+            tunnel.expire('gateway shutting down')
+
+
+def websocket_url(upstream: str, suffix: str, query: str) -> str:
+    """ws(s):// URL of an upstream given as http(s)://."""
+    if upstream.startswith('https://'):
+        upstream = 'wss://' + upstream[len('https://'):]
+    elif upstream.startswith('http://'):
+        upstream = 'ws://' + upstream[len('http://'):]
+    return upstream.rstrip('/') + suffix + ('?' + query if query else '')
+
+
+async def connect_upstream(url: str,
+                           headers: RawHeaders,
+                           subprotocols: list[str],
+                           policy: WebSocketPolicy) -> ClientConnection:
+    """Open the upstream leg; raises OSError, TimeoutError or websockets' InvalidHandshake."""
+    return await connect(
+        url,
+        additional_headers=[(name.decode('latin-1'), value.decode('latin-1'))
+                            for name, value in headers],
+        subprotocols=subprotocols or None,
+        compression='deflate' if policy.compression else None,
+        user_agent_header=None,     # the client's User-Agent is forwarded
+        proxy=None,
+        open_timeout=policy.open_timeout,
+        ping_interval=None,         # liveness is the idle timeout's job
+        max_size=policy.max_message_bytes,
+        max_queue=policy.max_queue,
+        write_limit=policy.write_limit,
+    )
+
+
+async def deny(websocket: WebSocket, status: int, detail: str) -> None:
+    """Refuse a WebSocket handshake with an HTTP error, where the server supports it."""
+    if 'websocket.http.response' in (websocket.scope.get('extensions') or {}):
+        await websocket.send_denial_response(JSONResponse({'detail': detail}, status_code=status))
+    else:
+        await websocket.close(code=1011 if status >= 500 else 1008, reason=detail[:120])
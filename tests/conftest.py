@@ -1,7 +1,7 @@
 # Centralized pytest configuration file (fixtures, hooks, plugins, etc.)
 import pytest
 from asgi_lifespan import LifespanManager
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
 from httpx import AsyncClient, ASGITransport
 from redis.asyncio import Redis
 
@@ -62,6 +62,11 @@ def upstream_app() -> FastAPI:
     async def echo(payload: dict): # tests body forwarding and proxy correctness
         return payload
 
+    @app.put("/")
+    async def echo_raw(request: Request):  # tests streamed body forwarding
+        return Response(content=await request.body(),
+                        media_type="application/octet-stream")
+
     return app
 
 
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+
+from gateway.admission import AdmissionController
+from gateway.config import settings, AdmissionSettings, PriorityClass, RouteRule
+
+
+@pytest.fixture
+def release_upstream() -> asyncio.Event:
+    return asyncio.Event()
+
+
+@pytest.fixture
+def upstream_app(release_upstream) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/")
+    async def fast():
+        return {"ok": True}
+
+    @app.get("/held")
+    async def held():
+        await release_upstream.wait()
+        return {"ok": True}
+
+    return app
+
+
+@pytest.fixture
+def admission(gateway_client, monkeypatch):
+    """One slot, requests shed after 50 ms in the queue; restored after the test."""
+    monkeypatch.setattr(settings, 'routes', [
+        RouteRule(prefix="/limited", upstream="http://upstream", max_in_flight=1),
+        RouteRule(prefix="/open", upstream="http://upstream"),
+    ])
+    app = gateway_client._transport.app
+    monkeypatch.setattr(app.state, 'admission', AdmissionController(AdmissionSettings(
+        max_in_flight=10, retry_after=2,
+        classes=[PriorityClass(name='default', queue_timeout=0.05)])))
+    return app.state.admission
+
+
+async def wait_for_in_flight(admission: AdmissionController, prefix: str) -> None:
+    while prefix not in admission.routes or not admission.routes[prefix].in_flight:
+        await asyncio.sleep(0.001)
+
+
+async def test_request_over_the_route_cap_is_shed_with_503(gateway_client, admission,
+                                                           release_upstream):
+    """Test: a request queued past its deadline gets 503 with Retry-After."""
+    first = asyncio.ensure_future(gateway_client.get("/limited/held"))
+    await wait_for_in_flight(admission, "/limited")
+
+    resp = await gateway_client.get("/limited/held")
+    release_upstream.set()
+
+    assert resp.status_code == 503
+    assert resp.json() == {"detail": "Gateway overloaded"}
+    assert resp.headers["retry-after"] == "2"
+    assert (await first).status_code == 200
+    assert admission.stats.shed_timeout == 1
+
+
+async def test_queued_request_is_admitted_when_a_slot_frees(gateway_client, admission,
+                                                            release_upstream):
+    """Test: a request that gets a slot within its queue timeout is proxied."""
+    first = asyncio.ensure_future(gateway_client.get("/limited/held"))
+    await wait_for_in_flight(admission, "/limited")
+    second = asyncio.ensure_future(gateway_client.get("/limited/held"))
+    while not admission.waiting:
+        await asyncio.sleep(0.001)
+
+    release_upstream.set()
+
+    assert [(await first).status_code, (await second).status_code] == [200, 200]
+    assert admission.stats.queued == 1
+    assert admission.routes["/limited"].in_flight == 0
+
+
+async def test_saturated_route_does_not_block_other_routes(gateway_client, admission,
+                                                           release_upstream):
+    """Test: requests to other routes are admitted while one route is at its cap."""
+    first = asyncio.ensure_future(gateway_client.get("/limited/held"))
+    await wait_for_in_flight(admission, "/limited")
+
+    resp = await gateway_client.get("/open/")
+    release_upstream.set()
+    await first
+
+    assert resp.status_code == 200
+
+
+async def test_admission_stats_endpoint(gateway_client, admission):
+    """Test: /_gateway/admission reports counters and per-cap slots."""
+    await gateway_client.get("/limited/")
+
+    stats = (await gateway_client.get("/_gateway/admission")).json()
+
+    assert stats["admitted"] >= 1
+    assert stats["/limited"] == {"limit": 1, "in_flight": 0, "queued": 0}
+    assert stats["global"]["limit"] == 10
@@ -0,0 +1,166 @@
+import asyncio
+import gzip
+import json
+
+import pytest
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+
+from gateway.bodies import BodyTooLarge
+from gateway.cache import ResponseCache
+from gateway.config import settings, CachePolicy, JsonTransform, RouteRule
+
+USER = {"id": 7, "name": "ada", "password": "hunter2",
+        "cards": [{"number": "4111", "brand": "visa"}]}
+
+
+@pytest.fixture
+def upstream_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.put("/echo")
+    async def echo(request: Request):
+        return Response(await request.body(),
+                        media_type=request.headers.get("content-type", "application/octet-stream"))
+
+    @app.get("/user")
+    async def user():
+        return Response(json.dumps(USER).encode(), media_type="application/json",
+                        headers={"etag": '"u7"', "cache-control": "max-age=60"})
+
+    @app.get("/user-gzip")
+    async def user_gzip():
+        return Response(gzip.compress(json.dumps(USER).encode()), media_type="application/json",
+                        headers={"content-encoding": "gzip"})
+
+    @app.get("/big")
+    async def big():
+        return Response(bytes(5000), media_type="application/octet-stream")
+
+    @app.get("/big-chunked")
+    async def big_chunked():
+        async def chunks():
+            for _ in range(5):
+                yield bytes(1000)
+        return StreamingResponse(chunks(), media_type="application/octet-stream")
+
+    return app
+
+
+@pytest.fixture
+def body_routes(gateway_client, monkeypatch):
+    hide = JsonTransform(redact=["password", "cards.*.number"])
+    monkeypatch.setattr(settings, 'routes', [
+        RouteRule(prefix="/limited", upstream="http://upstream",
+                  max_request_bytes=100, max_response_bytes=1000),
+        RouteRule(prefix="/buffered", upstream="http://upstream", buffered=True,
+                  max_request_bytes=100, max_response_bytes=1000),
+        RouteRule(prefix="/redacted", upstream="http://upstream",
+                  request_transform=JsonTransform(remove=["is_admin"]),
+                  response_transform=hide),
+        RouteRule(prefix="/projected", upstream="http://upstream",
+                  response_transform=JsonTransform(include=["id", "name"])),
+        RouteRule(prefix="/cached", upstream="http://upstream", response_transform=hide,
+                  cache=CachePolicy(max_entry_bytes=1 << 20)),
+    ])
+    app = gateway_client._transport.app
+    app.state.response_cache = ResponseCache(max_bytes=1 << 20)
+    return app
+
+
+async def chunked(*parts: bytes):
+    for part in parts:
+        yield part
+
+
+@pytest.mark.parametrize("prefix", ["/limited", "/buffered"])
+async def test_declared_request_length_over_limit_is_refused(gateway_client, body_routes, prefix):
+    resp = await gateway_client.put(f"{prefix}/echo", content=bytes(101))
+
+    assert resp.status_code == 413
+
+
+@pytest.mark.parametrize("prefix", ["/limited", "/buffered"])
+async def test_chunked_request_over_limit_is_cut_off(gateway_client, body_routes, prefix):
+    resp = await gateway_client.put(f"{prefix}/echo", content=chunked(bytes(60), bytes(60)))
+
+    assert resp.status_code == 413
+
+
+@pytest.mark.parametrize("prefix", ["/limited", "/buffered"])
+async def test_request_within_limit_is_forwarded(gateway_client, body_routes, prefix):
+    resp = await gateway_client.put(f"{prefix}/echo", content=chunked(bytes(60), bytes(40)))
+
+    assert resp.status_code == 200
+    assert resp.content == bytes(100)
+
+
+@pytest.mark.parametrize("prefix", ["/limited", "/buffered"])
+async def test_declared_response_length_over_limit_is_a_bad_gateway(gateway_client, body_routes,
+                                                                    prefix):
+    resp = await gateway_client.get(f"{prefix}/big")
+
+    assert resp.status_code == 502
+
+
+async def test_buffered_chunked_response_over_limit_is_a_bad_gateway(gateway_client, body_routes):
+    resp = await gateway_client.get("/buffered/big-chunked")
+
+    assert resp.status_code == 502
+
+
+async def test_streamed_chunked_response_over_limit_is_cut_off(gateway_client, body_routes):
+    # Headers are already sent: the stream is aborted
+    with pytest.raises(BodyTooLarge):
+        await gateway_client.get("/limited/big-chunked")
+
+
+async def test_request_json_is_rewritten_before_upstream(gateway_client, body_routes):
+    resp = await gateway_client.put("/redacted/echo",
+                                    json={"name": "ada", "is_admin": True, "tags": [1, 2]})
+
+    assert resp.json() == {"name": "ada", "tags": [1, 2]}
+
+
+async def test_request_that_is_not_json_is_forwarded_unchanged(gateway_client, body_routes):
+    resp = await gateway_client.put("/redacted/echo", content=b'{"is_admin": true',
+                                    headers={"content-type": "text/plain"})
+
+    assert resp.content == b'{"is_admin": true'
+
+
+async def test_malformed_request_json_is_rejected(gateway_client, body_routes):
+    resp = await gateway_client.put("/redacted/echo", content=b'{"is_admin": true',
+                                    headers={"content-type": "application/json"})
+
+    assert resp.status_code == 400
+
+
+@pytest.mark.parametrize("path", ["/redacted/user", "/redacted/user-gzip"])
+async def test_response_json_is_redacted(gateway_client, body_routes, path):
+    resp = await gateway_client.get(path)
+
+    assert resp.json() == {**USER, "password": "[REDACTED]",
+                           "cards": [{"number": "[REDACTED]", "brand": "visa"}]}
+
+
+async def test_response_projection_keeps_included_members(gateway_client, body_routes):
+    resp = await gateway_client.get("/projected/user")
+
+    assert resp.json() == {"id": 7, "name": "ada"}
+    assert "content-length" not in resp.headers
+    assert resp.headers["etag"] == 'W/"u7"'
+
+
+async def test_cached_entry_holds_the_transformed_body(gateway_client, body_routes):
+    cache: ResponseCache = body_routes.state.response_cache
+    first = await gateway_client.get("/cached/user")
+    for _ in range(100):
+        if cache.stats.stores:
+            break
+        await asyncio.sleep(0.01)
+    second = await gateway_client.get("/cached/user")
+
+    assert cache.stats.hits == 1
+    assert second.json() == first.json()
+    assert second.json()["password"] == "[REDACTED]"
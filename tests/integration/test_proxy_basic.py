@@ -38,3 +38,33 @@ async def test_proxy_preserves_headers(gateway_client: AsyncClient):
     )
 
     assert resp.status_code == 200
+
+
+async def test_proxy_balances_across_upstreams(gateway_client, monkeypatch):
+    """Test: a route with several upstream targets spreads requests over them."""
+    from gateway.config import settings, RouteRule, UpstreamTarget
+
+    monkeypatch.setattr(settings, 'routes', [
+        RouteRule(prefix="/hello", upstreams=[
+            UpstreamTarget(url="http://upstream-a"),
+            UpstreamTarget(url="http://upstream-b"),
+        ]),
+    ])
+
+    hosts = set()
+    for _ in range(4):
+        resp = await gateway_client.get("/hello")
+        assert resp.status_code == 200
+        hosts.add(resp.json()["received_headers"]["host"])
+
+    assert hosts == {"upstream-a", "upstream-b"}
+
+
+async def test_health_endpoint_is_not_rate_limited(gateway_client: AsyncClient):
+    gateway_client._transport.app.state.limiter.allow_next = False
+
+    resp = await gateway_client.get("/_gateway/health")
+
+    assert resp.status_code == 200
+    assert resp.json()["status"] == "ok"
+    assert resp.json()["in_flight"] == 0
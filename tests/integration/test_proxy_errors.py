@@ -12,13 +12,39 @@ async def test_upstream_connection_failure_returns_502(gateway_client):
     from gateway.main import application as gateway_app
     from unittest.mock import AsyncMock
 
-    # Mock http_client to raise exception
+    # Mock http_client to raise exception (buffered and streamed paths)
     gateway_app.state.http_client.request = AsyncMock(
         side_effect=Exception("Connection refused")
     )
+    gateway_app.state.http_client.send = AsyncMock(
+        side_effect=Exception("Connection refused")
+    )
 
     resp = await gateway_client.get("/hello")  # valid route
 
     assert resp.status_code == 502
     assert 'Connection refused' in resp.json()['detail']
 
+
+
+async def test_open_circuit_fails_fast_with_503(gateway_client, monkeypatch):
+    """Test: once an upstream's breaker opens, requests get 503 without being sent."""
+    from gateway.main import application as gateway_app
+    from gateway.config import settings, CircuitBreakerPolicy, RouteRule
+    from unittest.mock import AsyncMock
+
+    monkeypatch.setattr(settings, 'routes', [
+        RouteRule(prefix="/hello", upstream="http://upstream",
+                  circuit_breaker=CircuitBreakerPolicy(min_requests=2, open_seconds=30)),
+    ])
+    send = gateway_app.state.http_client.send = AsyncMock(
+        side_effect=Exception("Connection refused")
+    )
+
+    statuses = [(await gateway_client.get("/hello")).status_code for _ in range(4)]
+
+    assert statuses == [502, 502, 503, 503]
+    assert send.await_count == 2
+    resp = await gateway_client.get("/hello")
+    assert 'circuit open' in resp.json()['detail']
+    assert int(resp.headers['retry-after']) > 0
@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from gateway.config import settings, HedgePolicy, RetryPolicy, RouteRule, UpstreamTarget
+from gateway.routing import match_route
+
+TARGETS = [UpstreamTarget(url="http://a"), UpstreamTarget(url="http://b")]
+
+
+class Targets(httpx.AsyncBaseTransport):
+    """Like httpx.MockTransport, without reading the request body before the handler."""
+    def __init__(self, handler):
+        self.handler = handler
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self.handler(request)
+
+
+@pytest.fixture
+def upstreams(gateway_client, monkeypatch):
+    """Two mock targets; `behaviour[host]` decides how each answers."""
+    app = gateway_client._transport.app
+    calls: list[str] = []
+    behaviour = {}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        calls.append(host)
+        return await behaviour[host](request)
+
+    monkeypatch.setattr(app.state, 'http_client',
+                        httpx.AsyncClient(transport=Targets(handler)))
+    monkeypatch.setattr(settings, 'routes', [
+        RouteRule(prefix="/retry", upstreams=TARGETS,
+                  retry=RetryPolicy(backoff_base_ms=0)),
+        RouteRule(prefix="/hedged", upstreams=TARGETS,
+                  retry=RetryPolicy(hedge=HedgePolicy(min_samples=1, min_delay_ms=0))),
+    ])
+    return behaviour, calls
+
+
+async def refuse(request: httpx.Request) -> httpx.Response:
+    raise httpx.ConnectError("connection refused", request=request)
+
+
+async def reset(request: httpx.Request) -> httpx.Response:
+    await request.aread()
+    raise httpx.ReadError("connection reset", request=request)
+
+
+def respond(body: bytes) -> httpx.Response:
+    # An explicit stream: httpx reads `content=` bodies eagerly, unlike real responses
+    return httpx.Response(200, stream=httpx.ByteStream(body))
+
+
+async def ok(request: httpx.Request) -> httpx.Response:
+    return respond(await request.aread() or b"ok")
+
+
+async def test_get_fails_over_to_healthy_target(gateway_client, upstreams):
+    behaviour, calls = upstreams
+    behaviour.update(a=refuse, b=ok)
+
+    statuses = [(await gateway_client.get("/retry")).status_code for _ in range(4)]
+
+    assert statuses == [200] * 4
+    assert calls.count('b') == 4
+
+
+async def test_post_not_retried_once_sent(gateway_client, upstreams):
+    behaviour, calls = upstreams
+    behaviour.update(a=reset, b=reset)
+
+    resp = await gateway_client.post("/retry", content=b"payload")
+
+    assert resp.status_code == 502
+    assert len(calls) == 1
+
+
+async def test_streamed_put_retried_when_never_sent(gateway_client, upstreams):
+    async def chunks():
+        yield b"part one, "
+        yield b"part two"
+
+    behaviour, calls = upstreams
+    behaviour.update(a=refuse, b=ok)
+
+    responses = [await gateway_client.put("/retry", content=chunks()) for _ in range(2)]
+
+    assert [resp.text for resp in responses] == ["part one, part two"] * 2
+
+
+async def test_streamed_put_not_retried_on_status_once_sent(gateway_client, upstreams):
+    async def chunks():
+        yield b"part one, "
+        yield b"part two"
+
+    seen = []
+
+    async def first_unavailable(request: httpx.Request) -> httpx.Response:
+        seen.append(await request.aread())
+        if len(seen) == 1:
+            return httpx.Response(503, stream=httpx.ByteStream(b"busy"))
+        return respond(b"ok")
+
+    behaviour, calls = upstreams
+    behaviour.update(a=first_unavailable, b=first_unavailable)
+
+    resp = await gateway_client.put("/retry", content=chunks())
+
+    assert resp.status_code == 503
+    assert seen == [b"part one, part two"] and len(calls) == 1
+
+
+async def test_hedge_cuts_slow_attempt(gateway_client, upstreams):
+    async def slow(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(1)
+        return respond(b"slow")
+
+    behaviour, _ = upstreams
+    behaviour.update(a=slow, b=ok)
+    retrier = match_route("/hedged").pool.retrier
+    retrier.latencies.add(0.005)
+
+    started = time.perf_counter()
+    bodies = [(await gateway_client.get("/hedged")).text for _ in range(2)]
+
+    assert time.perf_counter() - started < 0.8
+    assert bodies == ["ok", "ok"]
+    assert retrier.stats.hedges == retrier.stats.hedge_wins == 1
@@ -0,0 +1,66 @@
+import pytest
+from starlette.requests import ClientDisconnect
+
+from gateway.config import settings, RouteRule
+from gateway.streaming import UpstreamStreamingResponse
+
+
+async def test_proxy_streams_large_body_round_trip(gateway_client):
+    """Test: a multi-chunk request body reaches upstream and comes back intact."""
+    payload = bytes(range(256)) * 4096  # 1 MiB
+
+    async def chunks():
+        for i in range(0, len(payload), 65536):
+            yield payload[i:i + 65536]
+
+    resp = await gateway_client.put("/echo", content=chunks())
+
+    assert resp.status_code == 200
+    assert resp.content == payload
+
+
+async def test_proxy_buffered_route(gateway_client, monkeypatch):
+    """Test: routes flagged as buffered still proxy bodies correctly."""
+    monkeypatch.setattr(settings, 'routes', [
+        RouteRule(prefix="/echo", upstream="http://upstream", buffered=True),
+    ])
+
+    resp = await gateway_client.post("/echo", json={"foo": "bar"})
+
+    assert resp.status_code == 200
+    assert resp.json() == {"foo": "bar"}
+
+
+class _FakeUpstream:
+    status_code = 200
+
+    def __init__(self):
+        self.closed = False
+
+    async def aiter_bytes(self):
+        for _ in range(10):
+            yield b'x' * 1024
+
+    async def aclose(self):
+        self.closed = True
+
+
+async def test_streaming_response_closes_upstream_on_client_disconnect():
+    """Test: upstream response is released when the client goes away mid-stream."""
+    upstream = _FakeUpstream()
+    response = UpstreamStreamingResponse(upstream)
+    sent = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and sent:
+            raise OSError("client went away")
+        sent.append(message)
+
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+    with pytest.raises(ClientDisconnect):
+        await response(scope, receive, send)
+
+    assert upstream.closed is True
@@ -1,5 +1,7 @@
-from asyncio import sleep
-from gateway.rate_limit import RateLimiter
+import pytest
+from asyncio import gather, sleep
+from time import time
+from gateway.rate_limit import RateLimiter, BatchingRateLimiter, ShardedRateLimiter, bucket_key
 
 
 async def test_redis_connection(redis_client):
@@ -98,3 +100,166 @@ async def test_rate_limiter_state_persistence(redis_client):
     allowed, remaining_tokens = await limiter2.allow(key, capacity, rate, tokens=1)
     assert allowed is True
     assert remaining_tokens <= capacity
+
+
+async def test_rate_limiter_lease_and_refund(rate_limiter):
+    """Test: lease grants whole tokens up to availability; refund puts them back"""
+    key = 'test:user:lease'
+    capacity = 10
+    rate = 0.001
+
+    granted, remaining = await rate_limiter.lease(key, capacity, rate, tokens=6)
+    assert granted == 6
+    assert remaining == 4
+
+    granted, remaining = await rate_limiter.lease(key, capacity, rate, tokens=6)
+    assert granted == 4
+    assert remaining == 0
+
+    remaining = await rate_limiter.refund(key, capacity, rate, tokens=3)
+    assert remaining == 3
+
+    allowed, _ = await rate_limiter.allow(key, capacity, rate, tokens=3)
+    assert allowed is True
+
+
+async def test_batching_rate_limiter_coalesces_concurrent_calls(redis_client):
+    """Test: concurrent allow() calls share round trips and keep per-call results"""
+    limiter = BatchingRateLimiter(redis_client, max_delay=0.005, max_batch=100)
+    await limiter.load()
+
+    round_trips = 0
+    send = limiter._send
+
+    async def counting_send(batch):
+        nonlocal round_trips
+        round_trips += 1
+        return await send(batch)
+
+    limiter._send = counting_send
+
+    results = await gather(*(
+        limiter.allow('test:user:batch', capacity=5, rate=0.001) for _ in range(20)
+    ))
+
+    assert round_trips == 1
+    assert [allowed for allowed, _ in results].count(True) == 5
+    await limiter.close()
+
+
+async def test_batching_rate_limiter_reloads_flushed_script(redis_client):
+    """Test: batched calls recover when Redis loses the script cache"""
+    limiter = BatchingRateLimiter(redis_client, max_delay=0)
+    await limiter.load()
+    limiter.shas['token_bucket'] = '0' * 40  # as if Redis restarted and lost the script cache
+
+    allowed, remaining = await limiter.allow('test:user:flushed', capacity=10, rate=1.0)
+
+    assert allowed is True
+    assert remaining == 9
+
+
+@pytest.mark.parametrize('algorithm', ['token_bucket', 'sliding_window', 'gcra'])
+async def test_rate_limiter_check_enforces_capacity(rate_limiter, algorithm):
+    """Test: each algorithm admits `capacity` requests, then blocks"""
+    checks = [(f'test:user:{algorithm}', algorithm, 3, 0.001)]
+
+    for expected_remaining in (2, 1, 0):
+        allowed, remaining = await rate_limiter.check(checks)
+        assert allowed is True
+        assert remaining == expected_remaining
+
+    allowed, remaining = await rate_limiter.check(checks)
+    assert allowed is False
+    assert remaining == 0
+
+
+async def test_rate_limiter_check_is_all_or_nothing(rate_limiter):
+    """Test: a denial from one bucket does not spend tokens in the others"""
+    roomy = ('test:user:roomy', 'token_bucket', 10, 0.001)
+    tight = ('test:user:tight', 'gcra', 1, 0.001)
+
+    allowed, _ = await rate_limiter.check([roomy, tight])
+    assert allowed is True
+
+    for _ in range(3):
+        allowed, _ = await rate_limiter.check([roomy, tight])
+        assert allowed is False
+
+    allowed, remaining = await rate_limiter.allow('test:user:roomy', 10, 0.001)
+    assert allowed is True
+    assert remaining == 8
+
+
+async def test_sharded_rate_limiter_spreads_consumers(redis_client):
+    """Test: consumers are spread over shards, each enforcing its own buckets"""
+    second = redis_client.__class__.from_url("redis://localhost:6379/1", decode_responses=True)
+    limiter = ShardedRateLimiter([RateLimiter(redis_client), RateLimiter(second)],
+                                 names=['db0', 'db1'])
+    try:
+        await second.flushdb()
+        await limiter.load()    # scripts on every shard
+
+        for i in range(20):
+            checks = [(bucket_key(f'user{i}', 'global'), 'token_bucket', 2, 0.001),
+                      (bucket_key(f'user{i}', 'writes'), 'gcra', 2, 0.001)]
+            assert (await limiter.check(checks))[0] is True
+            assert (await limiter.check(checks))[0] is True
+            assert (await limiter.check(checks))[0] is False
+
+        first_keys = await redis_client.keys('rl:*')
+        second_keys = await second.keys('rl:*')
+        assert first_keys and second_keys
+        assert len(first_keys) + len(second_keys) == 40
+    finally:
+        await second.flushdb()
+        await second.aclose()
+
+
+async def test_bucket_is_one_string_expiring_when_full(rate_limiter, redis_client):
+    """Test: a bucket is stored as a single string whose TTL is its refill time"""
+    key = 'test:user:compact'
+
+    await rate_limiter.allow(key, capacity=10, rate=10.0, tokens=4)
+
+    assert await redis_client.type(key) == 'string'
+    assert 0 < await redis_client.pttl(key) <= 400
+
+
+async def test_denied_request_does_not_write(rate_limiter, redis_client):
+    """Test: denials leave the stored bucket untouched"""
+    key = 'test:user:denied'
+    await rate_limiter.allow(key, capacity=2, rate=0.001, tokens=2)
+    stored = await redis_client.get(key)
+
+    allowed, remaining = await rate_limiter.allow(key, capacity=2, rate=0.001)
+
+    assert allowed is False
+    assert remaining == 0
+    assert await redis_client.get(key) == stored
+
+
+async def test_legacy_hash_bucket_is_converted(rate_limiter, redis_client):
+    """Test: buckets written by the old {tokens, last_ts} layout keep their level"""
+    key = 'test:user:legacy'
+    await redis_client.hset(key, mapping={'tokens': 2, 'last_ts': int(time() * 1000)})
+
+    allowed, remaining = await rate_limiter.allow(key, capacity=10, rate=0.001)
+
+    assert allowed is True
+    assert remaining == 1
+    assert await redis_client.type(key) == 'string'
+
+
+async def test_rate_limiter_with_redis_clock(redis_client):
+    """Test: clock='redis' takes timestamps from Redis TIME"""
+    limiter = RateLimiter(redis_client, clock='redis')
+    await limiter.load()
+
+    for _ in range(3):
+        assert (await limiter.allow('test:user:clock', capacity=3, rate=0.001))[0] is True
+    assert (await limiter.allow('test:user:clock', capacity=3, rate=0.001))[0] is False
+
+    checks = [('test:user:clock', 'token_bucket', 3, 0.001),
+              ('test:user:clock-gcra', 'gcra', 3, 0.001)]
+    assert (await limiter.check(checks))[0] is False
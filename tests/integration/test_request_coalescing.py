@@ -0,0 +1,159 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+
+from gateway.config import settings, CoalescePolicy, RouteRule
+from gateway.singleflight import SingleFlight
+
+
+@pytest.fixture
+def upstream_app() -> FastAPI:
+    """Upstream that holds each response until the test releases it."""
+    app = FastAPI()
+    app.state.hits = 0
+    app.state.release = asyncio.Event()
+
+    @app.get("/slow")
+    async def slow(request: Request):
+        app.state.hits += 1
+        await app.state.release.wait()
+        return Response(f"v{app.state.hits} {request.headers.get('accept', '')}")
+
+    @app.get("/chunks")
+    async def chunks():
+        app.state.hits += 1
+
+        async def body():
+            await app.state.release.wait()
+            for i in range(5):
+                yield f"chunk{i};".encode()
+
+        return StreamingResponse(body())
+
+    return app
+
+
+@pytest.fixture
+def coalesced_routes(gateway_client, monkeypatch):
+    monkeypatch.setattr(settings, 'routes', [
+        RouteRule(prefix="/shared", upstream="http://upstream",
+                  coalesce=CoalescePolicy(max_waiters=3)),
+        RouteRule(prefix="/solo", upstream="http://upstream"),
+    ])
+    app = gateway_client._transport.app
+    app.state.singleflight = SingleFlight()
+    return app
+
+
+async def _gather_released(upstream_app, *requests):
+    tasks = [asyncio.ensure_future(request) for request in requests]
+    await asyncio.sleep(0.05)   # every request reaches the gateway before upstream answers
+    upstream_app.state.release.set()
+    return await asyncio.gather(*tasks)
+
+
+async def test_concurrent_gets_share_one_upstream_call(gateway_client, coalesced_routes,
+                                                       upstream_app):
+    responses = await _gather_released(
+        upstream_app, *(gateway_client.get("/shared/slow") for _ in range(3))
+    )
+
+    assert [r.text for r in responses] == ["v1 */*"] * 3
+    assert upstream_app.state.hits == 1
+    assert coalesced_routes.state.singleflight.stats.coalesced == 2
+
+
+async def test_streamed_body_fans_out_to_every_waiter(gateway_client, coalesced_routes,
+                                                      upstream_app):
+    responses = await _gather_released(
+        upstream_app, *(gateway_client.get("/shared/chunks") for _ in range(3))
+    )
+
+    expected = "".join(f"chunk{i};" for i in range(5))
+    assert [r.text for r in responses] == [expected] * 3
+    assert upstream_app.state.hits == 1
+
+
+async def test_waiters_over_the_cap_go_upstream(gateway_client, coalesced_routes,
+                                                upstream_app):
+    await _gather_released(
+        upstream_app, *(gateway_client.get("/shared/slow") for _ in range(5))
+    )
+
+    assert upstream_app.state.hits == 3
+    assert coalesced_routes.state.singleflight.stats.bypassed == 2
+
+
+async def test_key_headers_separate_flights(gateway_client, coalesced_routes, upstream_app):
+    json_resp, html_resp = await _gather_released(
+        upstream_app,
+        gateway_client.get("/shared/slow", headers={"accept": "application/json"}),
+        gateway_client.get("/shared/slow", headers={"accept": "text/html"}),
+    )
+
+    assert upstream_app.state.hits == 2
+    assert json_resp.text.endswith("application/json")
+    assert html_resp.text.endswith("text/html")
+
+
+async def test_routes_without_policy_are_not_coalesced(gateway_client, coalesced_routes,
+                                                       upstream_app):
+    await _gather_released(
+        upstream_app, *(gateway_client.get("/solo/slow") for _ in range(3))
+    )
+
+    assert upstream_app.state.hits == 3
+
+
+async def test_next_request_after_completion_starts_a_new_flight(gateway_client,
+                                                                  coalesced_routes,
+                                                                  upstream_app):
+    upstream_app.state.release.set()
+    first = await gateway_client.get("/shared/slow")
+    second = await gateway_client.get("/shared/slow")
+
+    assert (first.text, second.text) == ("v1 */*", "v2 */*")
+    assert coalesced_routes.state.singleflight.snapshot()['in_flight'] == 0
+
+
+async def test_consumers_do_not_share_responses(gateway_client, coalesced_routes, upstream_app):
+    await _gather_released(
+        upstream_app,
+        gateway_client.get("/shared/slow", headers={"x-api-key": "k1"}),
+        gateway_client.get("/shared/slow", headers={"x-api-key": "k2"}),
+    )
+
+    assert upstream_app.state.hits == 2
+
+
+async def test_slow_reader_bounds_what_a_flight_buffers():
+    sent = []
+
+    class Body(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            for i in range(100):
+                sent.append(i)
+                yield b"x" * 10
+
+    async def fetch():
+        return httpx.Response(200, stream=Body(),
+                              request=httpx.Request("GET", "http://upstream/"))
+
+    flights = SingleFlight()
+    policy = CoalescePolicy(max_body_bytes=50)
+    fast, slow = await asyncio.gather(flights.fetch("k", fetch, policy),
+                                      flights.fetch("k", fetch, policy))
+    slow_chunks = slow.aiter_raw()
+    await slow_chunks.__anext__()
+
+    fast_body = asyncio.ensure_future(fast.aread())
+    await asyncio.sleep(0.05)
+
+    assert not fast_body.done() and len(sent) < 20     # paused for the slow reader
+    rest = b"".join([chunk async for chunk in slow_chunks])
+    assert len(rest) == 990 and len(await fast_body) == 1000
+    await fast.aclose()
+    await slow.aclose()
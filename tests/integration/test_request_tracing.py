@@ -0,0 +1,101 @@
+import pytest
+
+from gateway.config import settings, AdminSettings, TracingSettings
+from gateway.tracing import Tracer
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+TRACEPARENT = f'00-{TRACE_ID}-00f067aa0ba902b7-01'
+
+
+@pytest.fixture
+def tracer(gateway_client, monkeypatch) -> Tracer:
+    """Keeps every trace (slow_ms=0); restored after the test."""
+    app = gateway_client._transport.app
+    monkeypatch.setattr(app.state, 'tracer', Tracer(TracingSettings(slow_ms=0)))
+    return app.state.tracer
+
+
+async def test_traceparent_is_propagated_upstream(gateway_client, tracer):
+    """Test: the upstream sees the caller's trace id with the gateway's span as parent."""
+    resp = await gateway_client.get("/hello", headers={"traceparent": TRACEPARENT,
+                                                       "tracestate": "vendor=1"})
+
+    received = resp.json()["received_headers"]
+    trace = tracer.recent[-1]
+    assert received["traceparent"] == f"00-{TRACE_ID}-{trace.span_id}-01"
+    assert received["tracestate"] == "vendor=1"
+
+
+async def test_request_without_traceparent_starts_a_trace(gateway_client, tracer):
+    """Test: a new trace id is generated and sent upstream."""
+    resp = await gateway_client.get("/hello")
+
+    trace = tracer.recent[-1]
+    assert resp.json()["received_headers"]["traceparent"] == trace.traceparent().decode()
+    assert trace.parent_id is None
+
+
+async def test_kept_trace_has_a_span_per_stage(gateway_client, tracer):
+    """Test: /_gateway/traces lists the request with its stages in order."""
+    await gateway_client.get("/hello", headers={"traceparent": TRACEPARENT})
+
+    recent = (await gateway_client.get("/_gateway/traces")).json()
+
+    proxied = next(trace for trace in recent if trace["name"] == "GET /hello")
+    assert proxied["trace_id"] == TRACE_ID and proxied["status"] == 200
+    names = [span["name"] for span in proxied["spans"]]
+    assert names == ["admission", "rate_limit", "route_match", "upstream", "upstream_body"]
+    upstream = proxied["spans"][3]
+    assert upstream["target"] == "http://upstream" and upstream["status"] == 200
+
+
+async def test_fast_requests_are_not_kept(gateway_client, monkeypatch):
+    """Test: with the default threshold, a quick successful request is dropped."""
+    app = gateway_client._transport.app
+    monkeypatch.setattr(app.state, 'tracer', Tracer(TracingSettings(slow_ms=10_000)))
+
+    await gateway_client.get("/hello")
+
+    assert app.state.tracer.stats.traced == 1
+    assert not app.state.tracer.recent
+
+
+async def test_profile_endpoint_returns_sampled_stacks(gateway_client):
+    """Test: /_gateway/profile samples for the requested time, JSON or collapsed."""
+    resp = await gateway_client.get("/_gateway/profile",
+                                    params={"seconds": 0.05, "interval_ms": 5})
+    text = await gateway_client.get("/_gateway/profile",
+                                    params={"seconds": 0.05, "format": "collapsed"})
+
+    assert resp.status_code == 200
+    assert set(resp.json()) == {"loop", "tasks"}
+    assert all(line.startswith(("loop;", "tasks;")) for line in text.text.splitlines())
+
+
+async def test_profile_endpoint_rejects_out_of_range_durations(gateway_client):
+    resp = await gateway_client.get("/_gateway/profile", params={"seconds": 3600})
+
+    assert resp.status_code == 400
+
+
+@pytest.mark.parametrize("path", ["/_gateway/traces", "/_gateway/profile?seconds=0.05"])
+async def test_admin_endpoints_need_an_allowed_address_or_the_token(gateway_client, monkeypatch,
+                                                                    path):
+    """Test: outside the allow-list, only the admin bearer token gets in."""
+    monkeypatch.setattr(settings, 'admin', AdminSettings(allow=["10.0.0.0/8"], token="s3cret"))
+
+    refused = await gateway_client.get(path)
+    wrong = await gateway_client.get(path, headers={"authorization": "Bearer nope"})
+    allowed = await gateway_client.get(path, headers={"authorization": "Bearer s3cret"})
+
+    assert refused.status_code == 403 and wrong.status_code == 403
+    assert allowed.status_code == 200
+
+
+async def test_admin_endpoints_admit_allow_listed_clients(gateway_client, monkeypatch):
+    """Test: the test client's loopback address is let in by default, and refused without it."""
+    assert (await gateway_client.get("/_gateway/traces")).status_code == 200
+
+    monkeypatch.setattr(settings, 'admin', AdminSettings(allow=[]))
+
+    assert (await gateway_client.get("/_gateway/traces")).status_code == 403
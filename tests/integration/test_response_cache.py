@@ -0,0 +1,204 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, Request, Response
+
+from gateway.cache import CacheEntry, MemoryTier, ResponseCache
+from gateway.config import settings, CachePolicy, RouteRule
+
+
+@pytest.fixture
+def upstream_app() -> FastAPI:
+    """Upstream whose endpoints exercise the different caching headers."""
+    app = FastAPI()
+    app.state.hits = 0
+
+    @app.middleware("http")
+    async def count(request: Request, call_next):
+        app.state.hits += 1
+        return await call_next(request)
+
+    @app.get("/fresh")
+    async def fresh():
+        return Response(f"v{app.state.hits}", headers={"cache-control": "max-age=60"})
+
+    @app.get("/no-store")
+    async def no_store():
+        return Response(f"v{app.state.hits}", headers={"cache-control": "no-store"})
+
+    @app.get("/etag")
+    async def etag(request: Request):
+        if request.headers.get("if-none-match") == '"v1"':
+            return Response(status_code=304, headers={"etag": '"v1"'})
+        return Response("etag body", headers={"cache-control": "max-age=0", "etag": '"v1"'})
+
+    @app.get("/vary")
+    async def vary(request: Request):
+        return Response(request.headers.get("accept-language", "none"),
+                        headers={"cache-control": "max-age=60", "vary": "Accept-Language"})
+
+    @app.get("/swr")
+    async def swr():
+        return Response(f"v{app.state.hits}",
+                        headers={"cache-control": "max-age=0, stale-while-revalidate=60"})
+
+    @app.get("/big")
+    async def big():
+        return Response(b"x" * 4096, headers={"cache-control": "max-age=60"})
+
+    return app
+
+
+@pytest.fixture
+def cached_routes(gateway_client, monkeypatch):
+    monkeypatch.setattr(settings, 'routes', [
+        RouteRule(prefix="/cached", upstream="http://upstream",
+                  cache=CachePolicy(max_entry_bytes=1024)),
+    ])
+    app = gateway_client._transport.app
+    app.state.response_cache = ResponseCache(max_bytes=1 << 20)
+    return app
+
+
+async def test_fresh_response_served_from_cache(gateway_client, cached_routes, upstream_app):
+    first = await gateway_client.get("/cached/fresh")
+    second = await gateway_client.get("/cached/fresh")
+
+    assert first.text == second.text == "v1"
+    assert upstream_app.state.hits == 1
+    assert 'age' in second.headers
+    assert cached_routes.state.response_cache.stats.hits == 1
+
+
+async def test_head_served_from_cached_get(gateway_client, cached_routes, upstream_app):
+    await gateway_client.get("/cached/fresh")
+    resp = await gateway_client.head("/cached/fresh")
+
+    assert resp.status_code == 200
+    assert resp.content == b""
+    assert upstream_app.state.hits == 1
+
+
+async def test_no_store_is_not_cached(gateway_client, cached_routes, upstream_app):
+    await gateway_client.get("/cached/no-store")
+    resp = await gateway_client.get("/cached/no-store")
+
+    assert resp.text == "v2"
+    assert upstream_app.state.hits == 2
+
+
+async def test_request_no_store_bypasses_cache(gateway_client, cached_routes, upstream_app):
+    await gateway_client.get("/cached/fresh")
+    resp = await gateway_client.get("/cached/fresh", headers={"cache-control": "no-store"})
+
+    assert resp.text == "v2"
+
+
+@pytest.mark.parametrize("credentials", [{"authorization": "Bearer t1"}, {"x-api-key": "k1"}])
+async def test_authenticated_requests_are_not_cached(gateway_client, cached_routes, upstream_app,
+                                                     credentials):
+    await gateway_client.get("/cached/fresh", headers=credentials)
+    await asyncio.sleep(0.01)       # stores run in the background
+    again = await gateway_client.get("/cached/fresh", headers=credentials)
+    anonymous = await gateway_client.get("/cached/fresh")
+
+    assert (again.text, anonymous.text) == ("v2", "v3")
+    assert cached_routes.state.response_cache.stats.hits == 0
+
+
+async def test_etag_revalidation_uses_cached_body(gateway_client, cached_routes, upstream_app):
+    await gateway_client.get("/cached/etag")
+    resp = await gateway_client.get("/cached/etag")
+
+    assert resp.status_code == 200
+    assert resp.text == "etag body"
+    assert upstream_app.state.hits == 2
+    assert cached_routes.state.response_cache.stats.revalidated == 1
+
+
+async def test_vary_keeps_separate_variants(gateway_client, cached_routes, upstream_app):
+    en = await gateway_client.get("/cached/vary", headers={"accept-language": "en"})
+    fr = await gateway_client.get("/cached/vary", headers={"accept-language": "fr"})
+    en_again = await gateway_client.get("/cached/vary", headers={"accept-language": "en"})
+
+    assert (en.text, fr.text, en_again.text) == ("en", "fr", "en")
+    assert upstream_app.state.hits == 2
+
+
+async def test_stale_while_revalidate_refreshes_in_background(gateway_client, cached_routes,
+                                                              upstream_app):
+    await gateway_client.get("/cached/swr")
+    stale = await gateway_client.get("/cached/swr")
+    await asyncio.sleep(0.05)  # let the background refresh land
+    refreshed = await gateway_client.get("/cached/swr")
+
+    assert stale.text == "v1"
+    assert refreshed.text == "v2"
+    assert cached_routes.state.response_cache.stats.stale_hits == 2
+
+
+async def test_oversized_response_streams_without_caching(gateway_client, cached_routes,
+                                                          upstream_app):
+    first = await gateway_client.get("/cached/big")
+    await gateway_client.get("/cached/big")
+
+    assert len(first.content) == 4096
+    assert upstream_app.state.hits == 2
+
+
+def test_memory_tier_is_bounded_by_bytes():
+    tier = MemoryTier(max_bytes=100)
+    tier.put('a', 'A', 40)
+    tier.put('b', 'B', 40)
+    tier.get('a')               # 'b' becomes least recently used
+    tier.put('c', 'C', 40)
+
+    assert tier.get('b') is None
+    assert tier.get('a') == 'A'
+    assert tier.bytes == 80
+    assert tier.evictions == 1
+
+
+def test_one_revalidation_per_key_at_a_time():
+    cache = ResponseCache(max_bytes=100)
+
+    assert cache.begin_revalidation('k')
+    assert not cache.begin_revalidation('k')
+    assert cache.begin_revalidation('other')
+    cache.end_revalidation('k')
+    assert cache.begin_revalidation('k')
+
+
+async def test_shared_tier_round_trips_through_redis(redis_client):
+    from redis.asyncio import Redis
+
+    redis = Redis.from_url("redis://localhost:6379")
+    writer = ResponseCache(max_bytes=1 << 20, redis=redis)
+    reader = ResponseCache(max_bytes=1 << 20, redis=redis)
+    entry = CacheEntry(200, [('content-type', 'text/plain')], b'shared', 1.0, 2e9, 2e9, 2e9)
+
+    await writer.put('/x', (), {}, entry, shared=True)
+    _, found = await reader.get('/x', {}, shared=True)
+
+    assert found is not None
+    assert found.body == b'shared'
+    assert reader.stats.redis_hits == 1
+    await redis.aclose()
+
+
+async def test_shared_tier_failures_are_misses():
+    """Test: with Redis unreachable, lookups miss and stores keep the memory tier only."""
+    from redis.asyncio import Redis
+
+    redis = Redis.from_url("redis://127.0.0.1:1")      # nothing listens there
+    cache = ResponseCache(max_bytes=1 << 20, redis=redis)
+    entry = CacheEntry(200, [('content-type', 'text/plain')], b'local', 1.0, 2e9, 2e9, 2e9)
+
+    _, missing = await cache.get('/x', {}, shared=True)
+    await cache.put('/x', (), {}, entry, shared=True)
+    _, found = await cache.get('/x', {}, shared=True)
+
+    assert missing is None
+    assert found is entry
+    assert cache.snapshot()['redis_errors'] == 2
+    await redis.aclose()
@@ -0,0 +1,140 @@
+import asyncio
+import gzip
+import json
+
+import pytest
+from fastapi import FastAPI, Response
+
+from gateway.cache import ResponseCache
+from gateway.config import settings, CachePolicy, RouteRule
+
+DOCUMENT = json.dumps({"items": [{"id": i, "name": f"item {i}"} for i in range(200)]}).encode()
+
+
+@pytest.fixture
+def upstream_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/json")
+    async def document():
+        return Response(DOCUMENT, media_type="application/json",
+                        headers={"cache-control": "max-age=60", "etag": '"doc"'})
+
+    @app.get("/gzipped")
+    async def gzipped():
+        return Response(gzip.compress(DOCUMENT), media_type="application/json",
+                        headers={"content-encoding": "gzip", "cache-control": "max-age=60"})
+
+    @app.get("/small")
+    async def small():
+        return Response(b'{"ok": true}', media_type="application/json")
+
+    @app.get("/png")
+    async def png():
+        return Response(b"\x89PNG" + bytes(4096), media_type="image/png")
+
+    return app
+
+
+@pytest.fixture
+def compressed_routes(gateway_client, monkeypatch):
+    monkeypatch.setattr(settings, 'routes', [
+        RouteRule(prefix="/stream", upstream="http://upstream"),
+        RouteRule(prefix="/buffered", upstream="http://upstream", buffered=True),
+        RouteRule(prefix="/cached", upstream="http://upstream",
+                  cache=CachePolicy(max_entry_bytes=1 << 20)),
+    ])
+    app = gateway_client._transport.app
+    app.state.response_cache = ResponseCache(max_bytes=1 << 20)
+    return app
+
+
+async def raw_get(client, path: str, accept_encoding: str):
+    """Status, headers and body bytes exactly as the gateway sent them."""
+    async with client.stream("GET", path, headers={"accept-encoding": accept_encoding}) as resp:
+        body = b''.join([chunk async for chunk in resp.aiter_raw()])
+    return resp, body
+
+
+async def stored(cache: ResponseCache) -> None:
+    """Wait for the background store of a cache miss."""
+    for _ in range(100):
+        if cache.stats.stores:
+            return
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.parametrize("prefix", ["/stream", "/buffered"])
+async def test_compresses_for_accepting_client(gateway_client, compressed_routes, prefix):
+    resp, body = await raw_get(gateway_client, f"{prefix}/json", "gzip")
+
+    assert resp.headers["content-encoding"] == "gzip"
+    assert resp.headers["etag"] == 'W/"doc"'
+    assert "accept-encoding" in resp.headers["vary"].lower()
+    assert gzip.decompress(body) == DOCUMENT
+    assert len(body) < len(DOCUMENT)
+
+
+@pytest.mark.parametrize("prefix", ["/stream", "/buffered"])
+async def test_identity_for_client_without_accept_encoding(gateway_client, compressed_routes,
+                                                           prefix):
+    resp, body = await raw_get(gateway_client, f"{prefix}/json", "identity")
+
+    assert "content-encoding" not in resp.headers
+    assert resp.headers["etag"] == '"doc"'
+    assert body == DOCUMENT
+
+
+async def test_small_and_binary_bodies_left_alone(gateway_client, compressed_routes):
+    small, _ = await raw_get(gateway_client, "/stream/small", "gzip")
+    png, _ = await raw_get(gateway_client, "/stream/png", "gzip")
+
+    assert "content-encoding" not in small.headers
+    assert "content-encoding" not in png.headers
+
+
+@pytest.mark.parametrize("prefix", ["/stream", "/buffered", "/cached"])
+async def test_encoded_upstream_body_passes_through(gateway_client, compressed_routes, prefix):
+    resp, body = await raw_get(gateway_client, f"{prefix}/gzipped", "gzip, br")
+
+    assert resp.headers["content-encoding"] == "gzip"
+    assert body == gzip.compress(DOCUMENT)
+    assert compressed_routes.state.content_encoder.stats.passthrough >= 1
+
+
+@pytest.mark.parametrize("prefix", ["/stream", "/buffered"])
+async def test_encoded_upstream_body_decoded_for_client(gateway_client, compressed_routes,
+                                                        prefix):
+    resp, body = await raw_get(gateway_client, f"{prefix}/gzipped", "identity")
+
+    assert "content-encoding" not in resp.headers
+    assert body == DOCUMENT
+
+
+async def test_cache_serves_precompressed_variant(gateway_client, compressed_routes):
+    await raw_get(gateway_client, "/cached/json", "gzip")
+    await stored(compressed_routes.state.response_cache)
+    encoder = compressed_routes.state.content_encoder
+    compressed = encoder.stats.compressed
+
+    hit, body = await raw_get(gateway_client, "/cached/json", "gzip")
+    plain, plain_body = await raw_get(gateway_client, "/cached/json", "identity")
+
+    assert compressed_routes.state.response_cache.stats.hits == 2
+    assert encoder.stats.compressed == compressed
+    assert hit.headers["content-encoding"] == "gzip"
+    assert int(hit.headers["content-length"]) == len(body)
+    assert gzip.decompress(body) == plain_body == DOCUMENT
+    assert "content-encoding" not in plain.headers
+
+
+async def test_cached_upstream_gzip_decoded_for_identity_client(gateway_client,
+                                                               compressed_routes):
+    await raw_get(gateway_client, "/cached/gzipped", "gzip")
+    await stored(compressed_routes.state.response_cache)
+
+    resp, body = await raw_get(gateway_client, "/cached/gzipped", "identity")
+
+    assert compressed_routes.state.response_cache.stats.hits == 1
+    assert "content-encoding" not in resp.headers
+    assert body == DOCUMENT
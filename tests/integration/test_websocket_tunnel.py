@@ -0,0 +1,125 @@
+import asyncio
+import socket
+import time
+
+import pytest
+import uvicorn
+from websockets.asyncio.client import connect
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed, InvalidStatus
+
+from gateway.config import settings, RouteRule, WebSocketPolicy
+
+
+def listening_socket() -> socket.socket:
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen()
+    return sock
+
+
+@pytest.fixture
+async def ws_upstream():
+    """Echo server; /close ends with 4001, and client close codes are recorded."""
+    seen = {'headers': [], 'closed': []}
+
+    async def handler(connection):
+        seen['headers'].append(connection.request.headers)
+        if connection.request.path == '/close':
+            await connection.close(4001, 'done')
+            return
+        try:
+            async for message in connection:
+                await connection.send(message)
+        finally:
+            seen['closed'].append(connection.close_code)
+
+    def select_subprotocol(connection, offered):
+        return 'chat' if 'chat' in offered else None
+
+    async with serve(handler, '127.0.0.1', 0, select_subprotocol=select_subprotocol) as server:
+        port = server.sockets[0].getsockname()[1]
+        yield f"http://127.0.0.1:{port}", seen
+
+
+@pytest.fixture
+async def gateway_url(gateway_client, ws_upstream, monkeypatch):
+    """The gateway app (state set up by gateway_client) served over a real socket."""
+    upstream, _ = ws_upstream
+    monkeypatch.setattr(settings, 'routes', [
+        RouteRule(prefix="/ws", upstream=upstream, websocket=WebSocketPolicy()),
+        RouteRule(prefix="/plain", upstream=upstream),
+        RouteRule(prefix="/down", upstream="http://127.0.0.1:1",
+                  websocket=WebSocketPolicy(open_timeout=1)),
+    ])
+    sock = listening_socket()
+    server = uvicorn.Server(uvicorn.Config(gateway_client._transport.app, lifespan='off',
+                                           log_level='warning'))
+    task = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        await asyncio.sleep(0.01)
+    yield f"ws://127.0.0.1:{sock.getsockname()[1]}"
+    server.should_exit = True
+    await task
+
+
+async def test_messages_relayed_both_ways(gateway_url, ws_upstream):
+    _, seen = ws_upstream
+    async with connect(gateway_url + "/ws/echo", subprotocols=['chat'],
+                       additional_headers={'x-api-key': 'k1'}) as ws:
+        await ws.send("hello")
+        assert await ws.recv() == "hello"
+        await ws.send(b"\x00\x01")
+        assert await ws.recv() == b"\x00\x01"
+        assert ws.subprotocol == 'chat'
+
+    headers = seen['headers'][0]
+    assert headers['x-api-key'] == 'k1'
+    assert headers['x-forwarded-for'] == '127.0.0.1'
+    assert 'upgrade' in headers     # set by the upstream leg's own handshake
+
+
+async def test_close_codes_cross_the_tunnel(gateway_url, ws_upstream):
+    _, seen = ws_upstream
+    async with connect(gateway_url + "/ws/close") as ws:
+        with pytest.raises(ConnectionClosed) as closed:
+            await ws.recv()
+    assert closed.value.rcvd.code == 4001
+
+    async with connect(gateway_url + "/ws/echo") as ws:
+        await ws.close(4002, 'bye')
+    for _ in range(100):
+        if seen['closed']:
+            break
+        await asyncio.sleep(0.01)
+    assert seen['closed'] == [4002]
+
+
+async def test_handshake_rate_limited(gateway_url, gateway_client):
+    gateway_client._transport.app.state.limiter.allow_next = False
+
+    with pytest.raises(InvalidStatus) as refused:
+        async with connect(gateway_url + "/ws/echo"):
+            pass
+    assert refused.value.response.status_code == 429
+
+
+@pytest.mark.parametrize("path, status", [("/nowhere", 404), ("/plain", 404), ("/down", 502)])
+async def test_handshake_refused(gateway_url, path, status):
+    with pytest.raises(InvalidStatus) as refused:
+        async with connect(gateway_url + path):
+            pass
+    assert refused.value.response.status_code == status
+
+
+async def test_idle_tunnel_closed(gateway_url, gateway_client):
+    tunnels = gateway_client._transport.app.state.tunnels
+    async with connect(gateway_url + "/ws/echo") as ws:
+        await ws.send("ping")
+        await ws.recv()
+        tunnels.sweep(time.monotonic() + 301)
+
+        with pytest.raises(ConnectionClosed) as closed:
+            await ws.recv()
+    assert closed.value.rcvd.code == 1001
+    assert tunnels.stats.idle_closed == 1
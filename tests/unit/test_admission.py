@@ -0,0 +1,152 @@
+import asyncio
+
+from gateway.admission import AdmissionController, FairQueue
+from gateway.config import AdmissionSettings, PriorityClass, RouteRule
+
+
+def grant_order(queue: FairQueue, waiters: dict[asyncio.Future, str], slots: int) -> list[str]:
+    order = []
+    for _ in range(slots):
+        queue.release()
+        granted = [waiter for waiter in waiters if waiter.done()]
+        for waiter in granted:
+            order.append(waiters.pop(waiter))
+    return order
+
+
+async def test_fair_queue_hands_slots_out_up_to_its_limit():
+    """Test: slots are free up to the limit; a released one goes to a waiter first."""
+    queue = FairQueue(2)
+
+    assert queue.try_acquire() and queue.try_acquire()
+    assert not queue.try_acquire()
+
+    waiter = queue.enqueue('a', 1.0)
+    queue.release()
+
+    assert waiter.done()
+    assert queue.in_flight == 2 and queue.queued == 0
+    queue.release()
+    assert queue.in_flight == 1
+    assert queue.try_acquire()
+
+
+async def test_fair_queue_alternates_between_consumers():
+    """Test: a consumer with many queued requests does not starve one with few."""
+    queue = FairQueue(1)
+    queue.try_acquire()
+    waiters = {queue.enqueue('noisy', 1.0): 'noisy' for _ in range(6)}
+    waiters.update({queue.enqueue('quiet', 1.0): 'quiet' for _ in range(2)})
+
+    assert grant_order(queue, waiters, 5) == ['noisy', 'quiet', 'noisy', 'quiet', 'noisy']
+
+
+async def test_fair_queue_shares_slots_by_weight():
+    """Test: a consumer of weight 2 gets two slots per round, one of weight 0.5 one in two."""
+    queue = FairQueue(1)
+    queue.try_acquire()
+    waiters = {queue.enqueue('gold', 2.0): 'gold' for _ in range(8)}
+    waiters.update({queue.enqueue('bronze', 0.5): 'bronze' for _ in range(8)})
+
+    order = grant_order(queue, waiters, 10)
+
+    assert order.count('gold') == 8
+    assert order.count('bronze') == 2
+
+
+async def test_fair_queue_skips_withdrawn_waiters():
+    """Test: an abandoned waiter leaves the queue and never receives a slot."""
+    queue = FairQueue(1)
+    queue.try_acquire()
+    first = queue.enqueue('a', 1.0)
+    second = queue.enqueue('b', 1.0)
+
+    queue.abandon('a', first)
+    queue.release()
+
+    assert first.cancelled()
+    assert second.done() and not second.cancelled()
+    assert queue.queued == 0 and queue.in_flight == 1
+
+
+async def test_fair_queue_raising_the_limit_wakes_waiters():
+    """Test: slots added by a new limit go to queued requests at once."""
+    queue = FairQueue(1)
+    queue.try_acquire()
+    waiters = [queue.enqueue('a', 1.0), queue.enqueue('b', 1.0)]
+
+    queue.set_limit(3)
+
+    assert all(waiter.done() for waiter in waiters)
+    assert queue.in_flight == 3
+
+
+async def test_controller_sheds_requests_after_their_queue_timeout():
+    """Test: a request still queued after the class's queue_timeout is refused."""
+    admission = AdmissionController(AdmissionSettings(
+        max_in_flight=1, classes=[PriorityClass(name='default', queue_timeout=0.01)]))
+    held = await admission.admit('a', 'default', None)
+
+    assert await admission.admit('b', 'default', None) is None
+    assert admission.stats.shed_timeout == 1
+    assert admission.gate.queued == 0
+
+    admission.release(held)
+    assert admission.gate.in_flight == 0
+
+
+async def test_controller_sheds_at_once_when_the_consumer_queue_is_full():
+    """Test: requests beyond max_queued_per_consumer are shed without waiting."""
+    admission = AdmissionController(AdmissionSettings(max_in_flight=1,
+                                                      max_queued_per_consumer=1))
+    held = await admission.admit('a', 'default', None)
+    queued = asyncio.ensure_future(admission.admit('a', 'default', None))
+    await asyncio.sleep(0)
+
+    assert await admission.admit('a', 'default', None) is None
+    assert admission.stats.shed_queue_full == 1
+
+    admission.release(held)
+    assert await queued == [admission.gate]
+
+
+async def test_controller_priority_class_follows_the_consumer_tier():
+    """Test: tiers listed by a class get its settings; others get the default class."""
+    gold = PriorityClass(name='gold', tiers=['premium'], weight=4.0, queue_timeout=5.0)
+    admission = AdmissionController(AdmissionSettings(classes=[PriorityClass(name='default'),
+                                                               gold]))
+
+    assert admission.priority_class('premium') is gold
+    assert admission.priority_class('free').name == 'default'
+
+
+async def test_controller_takes_the_route_slot_before_the_global_one():
+    """Test: requests queued for a saturated route hold no global slot."""
+    admission = AdmissionController(AdmissionSettings(max_in_flight=2))
+    slow = RouteRule(prefix='/slow', upstream='http://upstream', max_in_flight=1)
+    held = await admission.admit('a', 'default', slow)
+    queued = asyncio.ensure_future(admission.admit('b', 'default', slow))
+    await asyncio.sleep(0)
+
+    assert admission.gate.in_flight == 1
+    assert await admission.admit('c', 'default', None) == [admission.gate]
+
+    admission.release(held)
+    assert await queued == [admission.routes['/slow'], admission.gate]
+
+
+async def test_controller_cancelled_waiter_passes_its_slot_on():
+    """Test: a request cancelled while queued (client gone) does not leak a slot."""
+    admission = AdmissionController(AdmissionSettings(max_in_flight=1))
+    held = await admission.admit('a', 'default', None)
+    cancelled = asyncio.ensure_future(admission.admit('b', 'default', None))
+    queued = asyncio.ensure_future(admission.admit('c', 'default', None))
+    await asyncio.sleep(0)
+
+    cancelled.cancel()
+    await asyncio.gather(cancelled, return_exceptions=True)
+    admission.release(held)
+
+    assert await queued == [admission.gate]
+    assert admission.waiting == 0
+    assert admission.gate.in_flight == 1
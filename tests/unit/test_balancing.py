@@ -0,0 +1,120 @@
+import httpx
+
+from gateway.balancing import HealthChecker, UpstreamPool
+from gateway.config import HealthCheck, OutlierDetection, RouteRule, UpstreamTarget
+
+
+def make_pool(balancer: str, *urls: str, **kwargs) -> UpstreamPool:
+    return UpstreamPool(RouteRule(
+        prefix='/svc',
+        upstreams=[UpstreamTarget(url=url) for url in urls],
+        balancer=balancer,
+        **kwargs,
+    ))
+
+
+def test_single_upstream_shorthand_becomes_target():
+    rule = RouteRule(prefix='/svc', upstream='http://a')
+    assert [t.url for t in rule.upstreams] == ['http://a']
+
+    rule = RouteRule(prefix='/svc', upstreams=[UpstreamTarget(url='http://b')])
+    assert rule.upstream == 'http://b'
+
+
+def test_round_robin_cycles_targets():
+    pool = make_pool('round_robin', 'http://a', 'http://b', 'http://c')
+
+    picked = [pool.select().url for _ in range(6)]
+
+    assert sorted(picked) == ['http://a', 'http://a', 'http://b', 'http://b',
+                              'http://c', 'http://c']
+
+
+def test_weighted_respects_weights():
+    pool = UpstreamPool(RouteRule(prefix='/svc', balancer='weighted', upstreams=[
+        UpstreamTarget(url='http://heavy', weight=9),
+        UpstreamTarget(url='http://light', weight=1),
+    ]))
+
+    picked = [pool.select().url for _ in range(2000)]
+
+    assert 1600 < picked.count('http://heavy') < 1990
+
+
+def test_least_outstanding_tracks_in_flight_requests():
+    pool = make_pool('least_outstanding', 'http://a', 'http://b', 'http://c')
+
+    held = []
+    for _ in range(3):
+        target = pool.select()
+        pool.acquire(target)
+        held.append(target)
+
+    # one request each, in some order
+    assert sorted(t.url for t in held) == ['http://a', 'http://b', 'http://c']
+
+    pool.release(held[1])
+    assert pool.select() is held[1]
+
+
+def test_p2c_prefers_faster_target():
+    pool = make_pool('p2c', 'http://fast', 'http://slow')
+    fast, slow = pool.targets
+    pool.observe(fast, 0.01)
+    pool.observe(slow, 0.5)
+
+    assert all(pool.select() is fast for _ in range(20))
+
+
+def test_consecutive_failures_eject_target():
+    pool = make_pool('round_robin', 'http://a', 'http://b',
+                     outlier=OutlierDetection(consecutive_failures=2))
+    bad = pool.targets[0]
+
+    pool.report_failure(bad)
+    pool.report_failure(bad)
+
+    assert all(pool.select().url == 'http://b' for _ in range(4))
+
+
+def test_all_targets_unusable_falls_back_to_all():
+    pool = make_pool('round_robin', 'http://a')
+    pool.mark_health(pool.targets[0], False)
+
+    assert pool.select().url == 'http://a'
+
+
+async def test_health_checker_marks_targets():
+    pool = make_pool('round_robin', 'http://up', 'http://down',
+                     health_check=HealthCheck(unhealthy_threshold=1))
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200 if request.url.host == 'up' else 503)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    checker = HealthChecker(pools=lambda: [pool], client=lambda: client)
+
+    await checker.check_due(now=0.0)
+
+    assert [t.healthy for t in pool.targets] == [True, False]
+    assert all(pool.select().url == 'http://up' for _ in range(4))
+    await client.aclose()
+
+
+async def test_health_checker_keeps_probe_state_on_each_pool():
+    pools = [make_pool('round_robin', 'http://down',
+                       health_check=HealthCheck(interval=5.0, unhealthy_threshold=2))]
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda _: httpx.Response(503)))
+    checker = HealthChecker(pools=lambda: pools, client=lambda: client)
+
+    await checker.check_due(now=0.0)
+    await checker.check_due(now=1.0)        # not due yet
+    assert pools[0].targets[0].probe_failures == 1 and pools[0].targets[0].healthy
+
+    pools[0] = make_pool('round_robin', 'http://down',     # e.g. the route was replaced
+                         health_check=HealthCheck(interval=5.0, unhealthy_threshold=2))
+    await checker.check_due(now=1.0)
+
+    assert pools[0].next_health_check == 6.0
+    assert pools[0].targets[0].probe_failures == 1 and pools[0].targets[0].healthy
+    await client.aclose()
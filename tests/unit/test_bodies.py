@@ -0,0 +1,150 @@
+import json
+import random
+
+import pytest
+
+from gateway.bodies import (BodyTooLarge, JsonStreamTransformer, TransformError, declared_length,
+                            is_json, limited, rewritten_headers, transformed)
+from gateway.config import JsonTransform
+
+DOCUMENT = {
+    "id": 7,
+    "user": {"name": "ada \"lovelace\"", "password": "hunter2", "tags": ["a", "b\\c"]},
+    "items": [{"id": 1, "price": 2.5e3, "secret": None}, {"id": 2, "price": -1, "secret": True}],
+    "empty": {},
+    "unicode": "é☃",
+}
+
+
+def rewrite(document, chunk_size: int | None = None, **policy) -> object:
+    data = json.dumps(document, indent=1).encode()
+    transformer = JsonStreamTransformer(JsonTransform(**policy))
+    size = chunk_size or len(data)
+    out = b''.join(transformer.feed(data[i:i + size]) for i in range(0, len(data), size))
+    return json.loads(out + transformer.close())
+
+
+async def chunks(*parts: bytes):
+    for part in parts:
+        yield part
+
+
+def test_without_rules_the_document_is_unchanged():
+    assert rewrite(DOCUMENT) == DOCUMENT
+
+
+def test_include_keeps_listed_paths_and_their_parents():
+    assert rewrite(DOCUMENT, include=["id", "user.name", "items.*.id"]) == {
+        "id": 7, "user": {"name": "ada \"lovelace\""}, "items": [{"id": 1}, {"id": 2}]}
+
+
+def test_remove_drops_members():
+    expected = json.loads(json.dumps(DOCUMENT))
+    del expected["user"]["password"]
+    for item in expected["items"]:
+        del item["secret"]
+
+    assert rewrite(DOCUMENT, remove=["user.password", "items.*.secret"]) == expected
+
+
+def test_redact_replaces_values_of_any_type():
+    result = rewrite(DOCUMENT, redact=["user", "items.1.price"], redaction=None)
+
+    assert result["user"] is None
+    assert result["items"][1]["price"] is None and result["items"][0]["price"] == 2.5e3
+
+
+@pytest.mark.parametrize("document, policy, expected", [
+    ({"a": ["s"], "c": "xxx"}, {"include": ["c.a"], "remove": ["a.*"]}, {}),
+    ({"a": {"b": 1}, "c": {"a": 2}}, {"include": ["c.a"], "redact": ["a.b"]}, {"c": {"a": 2}}),
+    ({"a": 1, "c": 2}, {"include": ["c"], "redact": ["a"]}, {"c": 2}),
+])
+def test_rules_off_the_include_paths_emit_nothing(document, policy, expected):
+    assert rewrite(document, **policy) == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64])
+def test_output_does_not_depend_on_chunk_boundaries(chunk_size):
+    policy = {"include": ["user", "items.*.id", "unicode"], "redact": ["user.password"]}
+
+    assert rewrite(DOCUMENT, chunk_size, **policy) == rewrite(DOCUMENT, **policy)
+
+
+def test_random_documents_match_a_reference_rewrite():
+    rng = random.Random(25)
+
+    def value(depth):
+        kind = rng.randrange(6 if depth < 4 else 4)
+        if kind == 0:
+            return rng.choice([0, -3, 1.5e-7, True, False, None])
+        if kind in (1, 2, 3):
+            return rng.choice(["", "x", "q\"uote", "back\\slash", "é"])
+        if kind == 4:
+            return [value(depth + 1) for _ in range(rng.randrange(4))]
+        return {rng.choice("abc"): value(depth + 1) for _ in range(rng.randrange(4))}
+
+    def reference(node, path):
+        if path in ("a", "b.c"):
+            return "[REDACTED]"
+        if isinstance(node, dict):
+            return {k: reference(v, f"{path}.{k}" if path else k)
+                    for k, v in node.items() if (f"{path}.{k}" if path else k) != "c"}
+        return node
+
+    for _ in range(200):
+        document = {rng.choice("abc"): value(0) for _ in range(3)}
+        result = rewrite(document, rng.randrange(1, 16), redact=["a", "b.c"], remove=["c"])
+        assert result == reference(document, "")
+
+
+@pytest.mark.parametrize("data", [b'{"a": 1', b'{"a" 1 , }', b'[1, 2,]', b'{"a": tru}',
+                                  b'{"a": 1}}', b'"unterminated'])
+def test_malformed_documents_are_rejected(data):
+    transformer = JsonStreamTransformer(JsonTransform(include=["a"]))
+
+    with pytest.raises(TransformError):
+        transformer.feed(data)
+        transformer.close()
+
+
+def test_member_names_are_bounded():
+    transformer = JsonStreamTransformer(JsonTransform(redact=["a"], max_key_bytes=8))
+
+    with pytest.raises(TransformError):
+        transformer.feed(b'{"' + b'k' * 100)
+
+
+async def test_transformed_stream_leaves_an_empty_body_empty():
+    policy = JsonTransform(redact=["a"])
+
+    assert [chunk async for chunk in transformed(chunks(), policy)] == []
+    assert b''.join([chunk async for chunk in transformed(chunks(b'{"a"', b': 1}'), policy)]) \
+        == b'{"a":"[REDACTED]"}'
+
+
+@pytest.mark.parametrize("data", [b'42', b'-1.5e3', b'true', b'null', b'"s"', b'42\n'])
+async def test_top_level_literals_are_kept(data):
+    policy = JsonTransform(redact=["a"])
+
+    out = b''.join([chunk async for chunk in transformed(chunks(data[:1], data[1:]), policy)])
+
+    assert out == data.strip()
+
+
+async def test_limited_raises_before_the_chunk_over_the_limit():
+    received = []
+
+    with pytest.raises(BodyTooLarge):
+        async for chunk in limited(chunks(b'aaaa', b'bbbb', b'cc'), 9):
+            received.append(chunk)
+
+    assert received == [b'aaaa', b'bbbb']
+
+
+def test_helpers():
+    assert declared_length({'content-length': '12'}) == 12
+    assert declared_length({'content-length': 'x'}) is None
+    assert is_json('application/json; charset=utf-8') and is_json('application/problem+json')
+    assert not is_json('text/plain') and not is_json(None)
+    assert rewritten_headers([(b'content-length', b'3'), (b'etag', b'"x"')]) == [
+        (b'etag', b'W/"x"')]
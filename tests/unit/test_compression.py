@@ -0,0 +1,114 @@
+import asyncio
+import gzip
+import zlib
+
+import httpx
+
+from gateway.compression import (ContentEncoder, accepts, decode_body, encoded_headers,
+                                 parse_accept_encoding, with_vary)
+from gateway.config import CompressionSettings
+
+
+def encoder(**kwargs) -> ContentEncoder:
+    return ContentEncoder(CompressionSettings(encodings=['gzip'], **kwargs))
+
+
+def test_accept_encoding_q_values():
+    accepted = parse_accept_encoding('gzip;q=0.5, br, identity;q=0, zstd;q=bogus')
+
+    assert accepted == {'gzip': 0.5, 'br': 1.0, 'identity': 0.0, 'zstd': 0.0}
+    assert accepts(accepted, 'gzip')
+    assert not accepts(accepted, 'zstd')
+    assert not accepts(accepted, 'deflate')
+    assert accepts(parse_accept_encoding('*'), 'deflate')
+
+
+def test_choose_skips_refused_and_unavailable_encodings():
+    enc = ContentEncoder(CompressionSettings(encodings=['zstd', 'br', 'gzip']))
+
+    assert enc.choose('gzip, br;q=0.9') in ('br', 'gzip')
+    assert enc.choose('gzip;q=0') is None
+    assert enc.choose(None) is None
+    assert encoder(enabled=False).choose('gzip') is None
+
+
+def test_compressible_checks_type_size_status_and_no_transform():
+    enc = encoder(min_bytes=100)
+    json = {'content-type': 'application/json'}
+
+    assert enc.compressible(200, json, 100)
+    assert enc.compressible(200, json, None)
+    assert enc.compressible(200, {'content-type': 'text/html; charset=utf-8'}, None)
+    assert enc.compressible(200, {'content-type': 'application/problem+json'}, None)
+    assert not enc.compressible(200, json, 99)
+    assert not enc.compressible(206, json, None)
+    assert not enc.compressible(200, {'content-type': 'image/png'}, None)
+    assert not enc.compressible(200, {'content-type': 'text/event-stream'}, None)
+    assert not enc.compressible(200, {**json, 'cache-control': 'no-transform'}, None)
+
+
+def test_encoded_headers_weaken_etag_and_drop_length():
+    headers = encoded_headers([(b'etag', b'"v1"'), (b'content-length', b'10'),
+                               (b'vary', b'Accept-Language')], 'gzip')
+
+    assert headers == [(b'etag', b'W/"v1"'), (b'vary', b'Accept-Language'),
+                       (b'content-encoding', b'gzip'), (b'vary', b'accept-encoding')]
+    assert with_vary(headers) == headers
+
+
+async def test_compress_offloads_large_bodies():
+    enc = encoder(thread_threshold=1024)
+    small, large = b'a' * 100, b'b' * 4096
+
+    assert gzip.decompress(await enc.compress(small, 'gzip')) == small
+    assert gzip.decompress(await enc.compress(large, 'gzip')) == large
+    assert enc.stats.thread_offloads == 1
+    assert await enc.decode(gzip.compress(large), 'gzip') == large
+    enc.close()
+
+
+async def test_relay_streams_compressed_chunks():
+    async def chunks():
+        yield b'chunk one '
+        yield b'chunk two'
+
+    enc = encoder(min_bytes=0, thread_threshold=8)
+    resp = httpx.Response(200, headers={'content-type': 'text/plain'}, content=chunks())
+
+    headers, content = enc.relay(resp, 'gzip')
+    body = b''.join([chunk async for chunk in content])
+
+    assert dict(headers)[b'content-encoding'] == b'gzip'
+    assert gzip.decompress(body) == b'chunk one chunk two'
+    assert enc.snapshot()['thread_offloads'] == 2
+    enc.close()
+
+
+async def test_relay_sends_each_chunk_of_an_unsized_body_before_the_next():
+    more = asyncio.Event()
+
+    async def chunks():
+        yield b'event one\n'
+        await more.wait()
+        yield b'event two\n'
+
+    enc = encoder(min_bytes=0)
+    resp = httpx.Response(200, headers={'content-type': 'text/plain'}, content=chunks())
+    _, content = enc.relay(resp, 'gzip')
+    decoder = zlib.decompressobj(31)
+
+    first = await asyncio.wait_for(content.__anext__(), 1)
+    assert decoder.decompress(first) == b'event one\n'
+
+    more.set()
+    rest = b''.join([chunk async for chunk in content])
+    assert decoder.decompress(rest) == b'event two\n' and decoder.eof
+    enc.close()
+
+
+def test_decode_body_accepts_raw_deflate():
+    raw = zlib.compressobj(6, zlib.DEFLATED, -15)
+    body = raw.compress(b'payload') + raw.flush()
+
+    assert decode_body(body, 'deflate') == b'payload'
+    assert decode_body(zlib.compress(b'payload'), 'deflate') == b'payload'
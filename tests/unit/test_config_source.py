@@ -0,0 +1,140 @@
+import asyncio
+import json
+
+import pytest
+
+from gateway.admission import AdmissionController
+from gateway.config import AdmissionSettings, RouteRule, Settings, settings
+from gateway.config_source import (FileConfigWatcher, RedisConfigWatcher, apply_settings,
+                                   parse_settings, publish_config, replace_settings)
+from gateway.policies import applicable_policies
+from gateway.routing import find_upstream, get_router
+
+
+@pytest.fixture(autouse=True)
+def restore_settings():
+    saved = {name: getattr(settings, name) for name in Settings.model_fields}
+    yield
+    for name, value in saved.items():
+        setattr(settings, name, value)
+
+
+def document(*routes: tuple[str, str], **extra) -> str:
+    return json.dumps({'routes': [{'prefix': prefix, 'upstream': upstream}
+                                  for prefix, upstream in routes], **extra})
+
+
+def test_parse_settings_json_and_yaml():
+    from_json = parse_settings(document(('/a', 'http://a')), 'json')
+    from_yaml = parse_settings("routes:\n  - prefix: /a\n    upstream: http://a\n", 'yaml')
+    assert from_json == from_yaml
+    assert from_json.routes[0].prefix == '/a'
+
+
+def test_parse_settings_rejects_invalid_document():
+    with pytest.raises(ValueError):
+        parse_settings(json.dumps({'routes': [{'prefix': '/a'}]}), 'json')
+
+
+def test_replace_settings_adopts_every_section():
+    replace_settings(parse_settings(document(('/a', 'http://a'), route_cache_size=7), 'json'))
+    assert find_upstream('/a/x') == ('http://a', '/x')
+    assert settings.route_cache_size == 7
+
+
+def test_apply_settings_swaps_routes_and_policies():
+    apply_settings(parse_settings(document(
+        ('/a', 'http://a'),
+        rate_limit={'policies': [{'name': 'p', 'capacity': 5, 'rate': 1.0}],
+                    'consumers': {'k1': 'gold'}},
+    ), 'json'))
+
+    assert find_upstream('/a') == ('http://a', '/')
+    assert find_upstream('/hello') == (None, None)
+    assert [policy.name for policy in applicable_policies('/a', 'GET', 'default')] == ['p']
+    assert settings.rate_limit.consumers == {'k1': 'gold'}
+    # Published together with the routes, so nothing is recompiled on lookup
+    assert get_router().routes is settings.routes
+
+
+def test_apply_settings_keeps_lease_and_batch():
+    lease = settings.rate_limit.lease
+    apply_settings(parse_settings(document(rate_limit={'lease': {'max_drift': 3}}), 'json'))
+    assert settings.rate_limit.lease == lease
+
+
+def test_apply_settings_reuses_pools_of_unchanged_routes():
+    settings.routes = [RouteRule(prefix='/a', upstream='http://a'),
+                       RouteRule(prefix='/b', upstream='http://b')]
+    before = get_router()
+    kept = before.pools[id(settings.routes[0])]
+    replaced = before.pools[id(settings.routes[1])]
+
+    apply_settings(parse_settings(document(('/a', 'http://a'), ('/b', 'http://b2')), 'json'))
+
+    after = get_router()
+    assert after.pools[id(settings.routes[0])] is kept
+    assert after.pools[id(settings.routes[1])] is not replaced
+
+
+def test_apply_settings_prunes_admission_gates_of_removed_routes():
+    admission = AdmissionController(AdmissionSettings())
+    for prefix in ('/a', '/b', '/c'):
+        admission.gates(RouteRule(prefix=prefix, upstream='http://x', max_in_flight=2))
+    new = parse_settings(json.dumps({'routes': [
+        {'prefix': '/a', 'upstream': 'http://x', 'max_in_flight': 2},
+        {'prefix': '/b', 'upstream': 'http://x'},
+    ]}), 'json')
+
+    apply_settings(new, admission)
+
+    assert list(admission.routes) == ['/a']
+
+
+async def test_file_watcher_reloads_on_change(tmp_path):
+    path = tmp_path / 'gateway.json'
+    path.write_text(document(('/a', 'http://a')))
+    watcher = FileConfigWatcher(str(path), interval=0.01)
+    replace_settings(await watcher.read())
+    watcher.start()
+    try:
+        path.write_text(document(('/a', 'http://a'), ('/new', 'http://new')))
+        for _ in range(200):
+            if find_upstream('/new')[0] is not None:
+                break
+            await asyncio.sleep(0.01)
+        assert find_upstream('/new') == ('http://new', '/')
+    finally:
+        await watcher.stop()
+
+
+async def test_file_watcher_keeps_config_when_document_is_invalid(tmp_path):
+    path = tmp_path / 'gateway.json'
+    path.write_text(document(('/a', 'http://a')))
+    watcher = FileConfigWatcher(str(path))
+    replace_settings(await watcher.read())
+    routes = settings.routes
+
+    path.write_text('{"routes": [{"prefix": ')
+    assert await watcher.reload() is False
+    assert settings.routes is routes
+    assert find_upstream('/a') == ('http://a', '/')
+
+
+async def test_redis_watcher_reloads_on_publish(redis_client):
+    await redis_client.set('gateway:config', document(('/a', 'http://a')))
+    watcher = RedisConfigWatcher(redis_client.__class__.from_url('redis://localhost:6379'),
+                                 'gateway:config')
+    replace_settings(await watcher.read())
+    watcher.start()
+    try:
+        await asyncio.sleep(0.1)    # let it subscribe
+        await publish_config(redis_client, 'gateway:config', document(('/b', 'http://b')))
+        for _ in range(200):
+            if find_upstream('/b')[0] is not None:
+                break
+            await asyncio.sleep(0.01)
+        assert find_upstream('/b') == ('http://b', '/')
+        assert find_upstream('/a') == (None, None)
+    finally:
+        await watcher.stop()
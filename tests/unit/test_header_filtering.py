@@ -1,5 +1,7 @@
 from httpx import AsyncClient
 
+from gateway.headers import forward_request_headers, replace_headers, response_headers
+
 
 async def test_proxy_filters_hop_by_hop_headers(gateway_client: AsyncClient):
     """Test that hop-by-hop headers are filtered out before proxy process."""
@@ -69,3 +71,102 @@ async def test_gateway_preserves_original_client_headers(gateway_client: AsyncCl
     assert received_headers.get('x-forwarded-host') == 'testhost.com'
     assert received_headers['host'] == 'upstream'
 
+
+
+async def test_connection_listed_headers_are_not_forwarded(gateway_client: AsyncClient):
+    resp = await gateway_client.get(
+        "/hello",
+        headers={'connection': 'x-session-hint', 'x-session-hint': 'drop me'}
+    )
+
+    assert 'x-session-hint' not in resp.json()['received_headers']
+
+
+# ---- Raw header pipeline ----
+
+CLIENT_HEADERS = [
+    (b'host', b'api.example.com'),
+    (b'user-agent', b'Mozilla/5.0 (X11; Linux x86_64)'),
+    (b'accept', b'application/json'),
+    (b'accept-encoding', b'gzip, br'),
+    (b'cookie', b'a=1'),
+    (b'cookie', b'b=2'),
+    (b'authorization', b'Bearer abc.def.ghi'),
+    (b'x-request-id', b'8d7f2c'),
+    (b'connection', b'keep-alive'),
+    (b'x-forwarded-for', b'10.0.0.1'),
+]
+
+UPSTREAM_HEADERS = [
+    (b'content-type', b'application/json'),
+    (b'content-length', b'512'),
+    (b'cache-control', b'max-age=60'),
+    (b'set-cookie', b'a=1'),
+    (b'set-cookie', b'b=2'),
+    (b'connection', b'keep-alive'),
+    (b'x-request-id', b'8d7f2c'),
+]
+
+
+def test_request_duplicates_and_order_are_preserved():
+    headers = forward_request_headers(CLIENT_HEADERS, '1.2.3.4', 'https')
+
+    assert [v for k, v in headers if k == b'cookie'] == [b'a=1', b'b=2']
+    assert [k for k, _ in headers][:4] == [b'x-forwarded-host', b'user-agent', b'accept',
+                                           b'accept-encoding']
+    assert (b'x-forwarded-proto', b'https') in headers
+    assert (b'x-real-ip', b'1.2.3.4') in headers
+
+
+def test_request_forwarded_for_is_appended():
+    headers = forward_request_headers(CLIENT_HEADERS, '1.2.3.4', 'http')
+
+    assert [v for k, v in headers if k == b'x-forwarded-for'] == [b'10.0.0.1, 1.2.3.4']
+    assert (b'host', b'api.example.com') not in headers
+
+
+def test_request_spoofed_gateway_headers_are_replaced():
+    headers = forward_request_headers([(b'x-real-ip', b'6.6.6.6'),
+                                       (b'x-forwarded-proto', b'https')], '1.2.3.4', 'http')
+
+    assert [v for k, v in headers if k == b'x-real-ip'] == [b'1.2.3.4']
+    assert [v for k, v in headers if k == b'x-forwarded-proto'] == [b'http']
+
+
+def test_request_traceparent_is_replaced_and_tracestate_kept():
+    headers = forward_request_headers([(b'traceparent', b'00-client'),
+                                       (b'tracestate', b'vendor=1')], '1.2.3.4', 'http',
+                                      traceparent=b'00-gateway')
+
+    assert [v for k, v in headers if k == b'traceparent'] == [b'00-gateway']
+    assert (b'tracestate', b'vendor=1') in headers
+
+
+def test_response_filtering_keeps_duplicates():
+    headers = response_headers(UPSTREAM_HEADERS)
+
+    assert [v for k, v in headers if k == b'set-cookie'] == [b'a=1', b'b=2']
+    assert b'connection' not in dict(headers)
+    assert dict(headers)[b'content-length'] == b'512'
+
+
+def test_response_encoding_drops_length():
+    headers = response_headers(UPSTREAM_HEADERS + [(b'content-encoding', b'gzip')])
+
+    assert b'content-encoding' not in dict(headers)
+    assert b'content-length' not in dict(headers)
+
+
+def test_response_encoding_kept_for_raw_body():
+    headers = response_headers(UPSTREAM_HEADERS + [(b'content-encoding', b'gzip')],
+                               decoded=False)
+
+    assert dict(headers)[b'content-encoding'] == b'gzip'
+    assert dict(headers)[b'content-length'] == b'512'
+
+
+def test_replace_headers_overrides_case_insensitively():
+    headers = replace_headers([(b'if-none-match', b'"old"'), (b'accept', b'*/*')],
+                              {'If-None-Match': '"new"'})
+
+    assert headers == [(b'accept', b'*/*'), (b'if-none-match', b'"new"')]
@@ -0,0 +1,70 @@
+from gateway.rate_limit import LeasedRateLimiter
+
+
+class CountingBackend:
+    """In-memory stand-in for RateLimiter.lease/refund with a fixed token pool."""
+    def __init__(self, available: int):
+        self.available = available
+        self.lease_calls = 0
+        self.refunded = 0
+
+    async def load(self):
+        pass
+
+    async def lease(self, key, capacity, rate, tokens):
+        self.lease_calls += 1
+        granted = min(tokens, self.available)
+        self.available -= granted
+        return granted, float(self.available)
+
+    async def refund(self, key, capacity, rate, tokens):
+        self.refunded += tokens
+        self.available += tokens
+        return float(self.available)
+
+
+async def test_leased_limiter_serves_batch_locally():
+    """Test: one lease covers a batch of requests without further backend calls."""
+    backend = CountingBackend(available=100)
+    limiter = LeasedRateLimiter(backend, max_drift=10, low_watermark=0.0)
+
+    for _ in range(10):
+        allowed, _ = await limiter.allow('k', capacity=100, rate=1.0)
+        assert allowed is True
+
+    assert backend.lease_calls == 1
+
+
+async def test_leased_limiter_never_exceeds_backend_tokens():
+    """Test: admissions are bounded by what the shared bucket grants."""
+    backend = CountingBackend(available=5)
+    limiter = LeasedRateLimiter(backend, max_drift=4)
+
+    results = [(await limiter.allow('k', capacity=100, rate=1.0))[0] for _ in range(8)]
+
+    assert results.count(True) == 5
+    assert results[-1] is False
+
+
+async def test_leased_limiter_caches_denial_until_refill_due():
+    """Test: denied keys don't hit the backend again until a token is due."""
+    backend = CountingBackend(available=0)
+    limiter = LeasedRateLimiter(backend, max_drift=4)
+
+    for _ in range(5):
+        allowed, _ = await limiter.allow('k', capacity=10, rate=0.001)
+        assert allowed is False
+
+    assert backend.lease_calls == 1
+
+
+async def test_leased_limiter_refunds_unspent_tokens_on_close():
+    """Test: unspent leased tokens are returned to the shared bucket."""
+    backend = CountingBackend(available=100)
+    limiter = LeasedRateLimiter(backend, max_drift=10, low_watermark=0.0)
+
+    await limiter.allow('k', capacity=100, rate=1.0, tokens=3)
+    await limiter.close()
+
+    assert backend.refunded == 7
+    assert backend.available == 97
@@ -0,0 +1,60 @@
+from httpx import AsyncClient
+
+from gateway.metrics import Histogram, Metrics, metrics
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(bounds=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+
+    lines = list(histogram.render('h', 'phase="x"'))
+
+    assert lines[:3] == ['h_bucket{phase="x",le="0.1"} 2',
+                         'h_bucket{phase="x",le="1.0"} 3',
+                         'h_bucket{phase="x",le="+Inf"} 4']
+    assert lines[-1] == 'h_count{phase="x"} 4'
+
+
+def test_status_classes_and_snapshot_collectors():
+    registry = Metrics()
+    registry.record_request('/api', 'GET', 204, 0.01)
+    registry.record_request('/api', 'GET', 503, 0.02)
+    registry.collectors['cache'] = lambda: {'hits': 3, 'ratio': 0.5}
+    registry.collectors['pool'] = lambda: {'http://a:1': {'idle': 2, 'origin': 'x'}}
+
+    text = registry.render()
+
+    assert 'gateway_requests_total{route="/api",method="GET",status="2xx"} 1' in text
+    assert 'gateway_requests_total{route="/api",method="GET",status="5xx"} 1' in text
+    assert 'gateway_cache_hits 3' in text
+    assert 'gateway_pool_idle{instance="http://a:1"} 2' in text
+    assert 'origin' not in text
+
+
+def test_unknown_methods_share_one_label():
+    registry = Metrics()
+    for method in ('FOO', 'get\n', 'X' * 100, 'PROPFIND'):
+        registry.record_request('/api', method, 200, 0.01)
+
+    assert registry.requests == {('/api', 'other', '2xx'): 4}
+
+
+async def test_metrics_endpoint_reports_proxied_routes(gateway_client: AsyncClient):
+    before = metrics.requests.get(('/hello', 'GET', '2xx'), 0)
+    await gateway_client.get('/hello')
+
+    resp = await gateway_client.get('/metrics')
+
+    assert resp.status_code == 200
+    assert resp.headers['content-type'].startswith('text/plain')
+    assert metrics.requests[('/hello', 'GET', '2xx')] == before + 1
+    assert 'gateway_phase_duration_seconds_count{phase="upstream_ttfb"}' in resp.text
+    assert 'gateway_rate_limit_decisions_total{result="allowed"}' in resp.text
+
+
+async def test_metrics_endpoint_is_not_rate_limited(gateway_client: AsyncClient):
+    gateway_client._transport.app.state.limiter.allow_next = False
+
+    assert (await gateway_client.get('/hello')).status_code == 429
+    assert (await gateway_client.get('/metrics')).status_code == 200
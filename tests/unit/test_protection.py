@@ -0,0 +1,123 @@
+import pytest
+
+from gateway.balancing import UpstreamPool
+from gateway.config import CircuitBreakerPolicy, ConcurrencyLimit, RouteRule, UpstreamTarget
+from gateway.protection import (CLOSED, HALF_OPEN, OPEN, AdaptiveConcurrency, CircuitBreaker,
+                                UpstreamRejected)
+
+
+def make_breaker(**kwargs) -> CircuitBreaker:
+    defaults = dict(window=10.0, min_requests=4, error_rate=0.5, open_seconds=5.0,
+                    half_open_requests=2)
+    return CircuitBreaker(CircuitBreakerPolicy(**{**defaults, **kwargs}))
+
+
+def test_breaker_opens_on_error_rate():
+    breaker = make_breaker()
+    for ok in (True, True, False):
+        assert breaker.record(ok, now=100.0) is False
+
+    assert breaker.record(False, now=100.5) is True
+    assert breaker.state == OPEN
+    assert breaker.allow(now=101.0) is False
+
+
+def test_breaker_ignores_failures_outside_window():
+    breaker = make_breaker()
+    breaker.record(False, now=100.0)
+    breaker.record(False, now=100.0)
+    for _ in range(2):
+        breaker.record(True, now=111.0)   # the failures rolled out of the window
+
+    assert breaker.record(False, now=111.0) is False
+    assert breaker.state == CLOSED
+
+
+def test_breaker_half_open_probes_then_closes():
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record(False, now=100.0)
+
+    assert breaker.allow(now=105.0) is True
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow(now=105.0) is True
+    assert breaker.allow(now=105.0) is False     # probe quota used up
+
+    breaker.record(True, now=105.1)
+    breaker.record(True, now=105.1)
+    assert breaker.state == CLOSED
+
+
+def test_breaker_half_open_after_idle_period_still_closes():
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record(False, now=100.0)
+
+    # First request long after the open period; its sibling probe comes a bit later
+    assert breaker.allow(now=200.0) is True
+    breaker.record(True, now=200.1)
+    assert breaker.allow(now=201.0) is True
+    breaker.record(True, now=201.1)
+    assert breaker.state == CLOSED
+
+
+def test_breaker_failed_probe_reopens():
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record(False, now=100.0)
+    breaker.allow(now=105.0)
+
+    assert breaker.record(False, now=105.1) is True
+    assert breaker.state == OPEN
+    assert breaker.open_until == pytest.approx(110.1)
+
+
+def test_aimd_grows_when_saturated_and_backs_off_when_slow():
+    limiter = AdaptiveConcurrency(ConcurrencyLimit(initial_limit=10, backoff=0.5))
+    for _ in range(10):
+        limiter.record(True, 0.010, in_flight=10)
+    assert limiter.limit == pytest.approx(11.0, abs=0.1)
+
+    limiter.record(True, 0.050, in_flight=10)    # 5x the no-load latency
+    assert limiter.limit == pytest.approx(5.5, abs=0.1)
+
+    limiter.record(False, 0.0, in_flight=1)
+    assert limiter.limit == pytest.approx(2.75, abs=0.1)
+
+
+def test_aimd_does_not_grow_while_underused():
+    limiter = AdaptiveConcurrency(ConcurrencyLimit(initial_limit=10))
+    for _ in range(50):
+        limiter.record(True, 0.010, in_flight=1)
+
+    assert limiter.limit == 10.0
+
+
+def test_pool_skips_targets_at_concurrency_limit():
+    pool = UpstreamPool(RouteRule(
+        prefix='/svc',
+        upstreams=[UpstreamTarget(url='http://a'), UpstreamTarget(url='http://b')],
+        concurrency_limit=ConcurrencyLimit(initial_limit=1),
+    ))
+    first = pool.pick()
+    pool.acquire(first)
+    second = pool.pick()
+    pool.acquire(second)
+
+    assert {first.url, second.url} == {'http://a', 'http://b'}
+    with pytest.raises(UpstreamRejected, match='concurrency'):
+        pool.pick()
+
+
+def test_open_breaker_takes_target_out_of_rotation():
+    pool = UpstreamPool(RouteRule(
+        prefix='/svc',
+        upstreams=[UpstreamTarget(url='http://a'), UpstreamTarget(url='http://b')],
+        circuit_breaker=CircuitBreakerPolicy(min_requests=2),
+    ))
+    bad = next(t for t in pool.targets if t.url == 'http://a')
+    pool.report_failure(bad)
+    pool.report_failure(bad)
+
+    assert bad.breaker.state == OPEN
+    assert {pool.pick().url for _ in range(10)} == {'http://b'}
@@ -24,3 +24,24 @@ async def test_middleware_allows_request_when_within_rate_limit(gateway_client):
     assert resp.status_code == 200
     assert data["message"] == "hello from upstream"
     assert 'x-ratelimit-remaining' in resp.headers
+
+
+async def test_middleware_keys_bucket_by_api_key(gateway_client):
+    """Test: the bucket key comes from x-api-key, falling back to the client address."""
+    limiter = gateway_client._transport.app.state.limiter
+
+    await gateway_client.get("/hello", headers={"x-api-key": "abc"})
+    await gateway_client.get("/hello")
+
+    assert limiter.calls[0][0] == "rl:{abc}:global"
+    assert limiter.calls[1][0] == "rl:{127.0.0.1}:global"
+
+
+async def test_middleware_429_reports_remaining_tokens(gateway_client):
+    """Test: blocked responses carry the rate limit header and JSON detail."""
+    gateway_client._transport.app.state.limiter.allow_next = False
+
+    resp = await gateway_client.get("/hello")
+
+    assert resp.json() == {"detail": "Rate limit exceeded"}
+    assert 'x-ratelimit-remaining' in resp.headers
@@ -0,0 +1,71 @@
+import pytest
+
+from gateway.config import settings, RateLimitPolicy, RateLimitSettings, RouteRule, Settings
+from gateway.policies import applicable_policies, consumer_tier
+
+
+@pytest.fixture(autouse=True)
+def policies(monkeypatch):
+    monkeypatch.setattr(settings, 'routes', [
+        RouteRule(prefix='/hello', upstream='http://upstream', rate_limits=[
+            RateLimitPolicy(name='hello-writes', capacity=5, rate=1.0, methods=['post']),
+        ]),
+        RouteRule(prefix='/echo', upstream='http://upstream'),
+    ])
+    monkeypatch.setattr(settings, 'rate_limit', RateLimitSettings(
+        policies=[
+            RateLimitPolicy(name='hello-all', capacity=100, rate=10.0, prefix='/hello'),
+            RateLimitPolicy(name='premium', capacity=1000, rate=100.0,
+                            algorithm='gcra', tiers=['premium']),
+        ],
+        consumers={'key-premium': 'premium'},
+    ))
+
+
+def test_consumer_tier_lookup():
+    assert consumer_tier('key-premium') == 'premium'
+    assert consumer_tier('someone-else') == 'default'
+
+
+def test_policies_filtered_by_prefix_method_and_tier():
+    names = [p.name for p in applicable_policies('/hello/x', 'GET', 'default')]
+    assert names == ['hello-all']
+
+    names = [p.name for p in applicable_policies('/hello', 'POST', 'premium')]
+    assert names == ['hello-all', 'premium', 'hello-writes']
+
+    assert applicable_policies('/helloX', 'GET', 'default') == []
+    assert applicable_policies('/echo', 'GET', 'default') == []
+
+
+async def test_middleware_checks_all_buckets_in_one_call(gateway_client):
+    """Test: applicable policies are checked together with the global bucket."""
+    limiter = gateway_client._transport.app.state.limiter
+
+    resp = await gateway_client.get('/hello', headers={'x-api-key': 'key-premium'})
+
+    assert resp.status_code == 200
+    checks, tokens = limiter.calls[-1]
+    assert checks == [
+        ('rl:{key-premium}:global', 'token_bucket', 50, 1.0),
+        ('rl:{key-premium}:hello-all', 'token_bucket', 100, 10.0),
+        ('rl:{key-premium}:premium', 'gcra', 1000, 100.0),
+    ]
+
+
+def test_policy_names_must_be_unique():
+    policy = {'name': 'p', 'capacity': 5, 'rate': 1.0}
+
+    with pytest.raises(ValueError, match="duplicate rate-limit policy name 'p'"):
+        Settings.model_validate({
+            'routes': [{'prefix': '/a', 'upstream': 'http://a', 'rate_limits': [policy]}],
+            'rate_limit': {'policies': [{**policy, 'prefix': '/a'}]},
+        })
+
+
+def test_global_bucket_name_is_reserved():
+    with pytest.raises(ValueError, match="reserved"):
+        Settings.model_validate({
+            'rate_limit': {'policies': [{'name': 'global', 'capacity': 5, 'rate': 1.0,
+                                         'algorithm': 'sliding_window'}]},
+        })
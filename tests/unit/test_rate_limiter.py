@@ -1,3 +1,4 @@
+from gateway.rate_limit import ShardedRateLimiter, bucket_key, hash_tag
 from gateway.testing.fake_limiter import FakeRateLimiter
 
 
@@ -24,3 +25,33 @@ async def test_rate_limiter_blocks_when_configured():
     )
 
     assert allowed is False
+
+
+def test_bucket_keys_of_a_consumer_share_a_hash_tag():
+    assert bucket_key('abc', 'global') == 'rl:{abc}:global'
+    assert hash_tag(bucket_key('abc', 'global')) == hash_tag(bucket_key('abc', 'writes')) == 'abc'
+    assert hash_tag('no-tag') == 'no-tag'
+    assert hash_tag('empty{}tag') == 'empty{}tag'
+
+
+async def test_sharded_limiter_routes_consumers_consistently():
+    shards = [FakeRateLimiter() for _ in range(4)]
+    limiter = ShardedRateLimiter(shards, names=['a', 'b', 'c', 'd'])
+
+    for i in range(400):
+        key = bucket_key(f'k{i}', 'global')
+        await limiter.check([(key, 'token_bucket', 5, 1.0),
+                             (bucket_key(f'k{i}', 'writes'), 'gcra', 5, 1.0)])
+        await limiter.allow(key, 5, 1.0)
+        assert limiter.shard(key) is limiter.shard(bucket_key(f'k{i}', 'writes'))
+
+    # Every consumer's calls land on one shard, and every shard gets a fair share
+    for shard in shards:
+        assert 50 <= len(shard.calls) / 2 <= 150
+
+    # Adding a shard moves only the consumers it takes over
+    grown = ShardedRateLimiter(shards + [FakeRateLimiter()], names=['a', 'b', 'c', 'd', 'e'])
+    keys = [bucket_key(f'k{i}', 'global') for i in range(400)]
+    moved = [key for key in keys if grown.shard(key) is not limiter.shard(key)]
+    assert all(grown.shard(key) is grown.shards[4] for key in moved)
+    assert len(moved) < 160
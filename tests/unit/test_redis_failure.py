@@ -0,0 +1,180 @@
+import asyncio
+import time
+
+import pytest
+
+from gateway.config import CircuitBreakerPolicy, RedisFailureSettings
+from gateway.protection import CLOSED, OPEN
+from gateway.rate_limit import INSTANCES_KEY, ResilientRateLimiter, ShardedRateLimiter
+from gateway.testing.fake_limiter import FakeRateLimiter
+
+
+class FlakyLimiter(FakeRateLimiter):
+    """FakeRateLimiter that can fail or hang like an unreachable Redis."""
+    def __init__(self):
+        super().__init__()
+        self.down = False
+        self.hang = False
+
+    async def _redis(self):
+        if self.hang:
+            await asyncio.sleep(10)
+        if self.down:
+            raise ConnectionError("redis down")
+
+    async def load(self):
+        await self._redis()
+
+    async def allow(self, key, capacity, rate, tokens=1):
+        await self._redis()
+        return await super().allow(key, capacity, rate, tokens)
+
+    async def check(self, checks, tokens=1):
+        await self._redis()
+        return await super().check(checks, tokens)
+
+
+def resilient(inner, mode='local', sharding=None, **overrides) -> ResilientRateLimiter:
+    policy = RedisFailureSettings(
+        mode=mode,
+        timeout_ms=20,
+        connect_timeout=0.05,
+        instances=overrides.pop('instances', 1),
+        breaker=CircuitBreakerPolicy(window=10, min_requests=3, open_seconds=0.01,
+                                     half_open_requests=2),
+        **overrides,
+    )
+    return ResilientRateLimiter(inner, redis_client=None, policy=policy, sharding=sharding)
+
+
+async def test_slow_redis_costs_at_most_the_timeout():
+    inner = FlakyLimiter()
+    inner.hang = True
+    limiter = resilient(inner, mode='open')
+
+    started = time.perf_counter()
+    allowed, remaining = await limiter.allow('k', capacity=5, rate=1.0)
+
+    assert time.perf_counter() - started < 0.5
+    assert allowed and remaining == 5
+    assert limiter.errors == 1
+
+
+async def test_breaker_stops_calling_redis_once_open():
+    inner = FlakyLimiter()
+    inner.down = True
+    limiter = resilient(inner, mode='closed')
+
+    for _ in range(3):
+        assert await limiter.allow('k', capacity=5, rate=1.0) == (False, 0.0)
+    assert limiter.nodes[0].breaker.state == OPEN
+    assert limiter.errors == 3
+
+    await limiter.allow('k', capacity=5, rate=1.0)
+    assert limiter.errors == 3      # answered without touching Redis
+    assert limiter.snapshot()['degraded'] == 1
+
+
+async def test_local_mode_enforces_share_of_limit():
+    inner = FlakyLimiter()
+    limiter = resilient(inner, instances=2)
+    inner.down = True
+    await limiter.load()
+    assert limiter.nodes[0].breaker.state == OPEN
+
+    results = [(await limiter.allow('k', capacity=4, rate=0.001))[0] for _ in range(3)]
+    assert results == [True, True, False]
+
+
+async def test_local_mode_checks_are_all_or_nothing():
+    inner = FlakyLimiter()
+    inner.down = True
+    limiter = resilient(inner)
+    await limiter.load()
+
+    checks = [('k:global', 'token_bucket', 5, 0.001), ('k:writes', 'gcra', 1, 0.001)]
+    assert (await limiter.check(checks))[0] is True
+    assert (await limiter.check(checks))[0] is False
+    # The denied check did not spend from the global bucket
+    allowed, remaining = await limiter.allow('k:global', capacity=5, rate=0.001)
+    assert allowed and remaining == pytest.approx(3, abs=0.01)
+
+
+async def test_recovers_after_background_reconnect():
+    inner = FlakyLimiter()
+    inner.down = True
+    limiter = resilient(inner)
+    await limiter.load()
+    await limiter.allow('k', capacity=5, rate=1.0)
+    assert limiter.snapshot()['local_buckets'] == 1
+
+    inner.down = False
+    limiter.start()
+    try:
+        for _ in range(100):
+            if limiter.nodes[0].breaker.open_until != float('inf'):
+                break
+            await asyncio.sleep(0.01)
+
+        inner.calls.clear()
+        for _ in range(2):
+            await limiter.allow('k', capacity=5, rate=1.0)
+        assert len(inner.calls) == 2
+        assert limiter.nodes[0].breaker.state == CLOSED
+        assert limiter.snapshot()['local_buckets'] == 0
+    finally:
+        await limiter.close()
+
+
+async def test_failed_probe_reopens_until_next_reconnect():
+    inner = FlakyLimiter()
+    inner.down = True
+    limiter = resilient(inner, mode='closed')
+    await limiter.load()
+
+    await limiter._reconnect(limiter.nodes[0])
+    assert limiter.nodes[0].breaker.open_until == float('inf')   # reconnect failed, stays open
+
+    inner.down = False
+    await limiter._reconnect(limiter.nodes[0])
+    inner.down = True
+    await limiter.allow('k', capacity=5, rate=1.0)       # half-open probe fails
+    assert limiter.nodes[0].breaker.state == OPEN
+    assert limiter.nodes[0].breaker.open_until == float('inf')
+
+
+async def test_each_shard_has_its_own_breaker():
+    up, down = FlakyLimiter(), FlakyLimiter()
+    sharding = ShardedRateLimiter([up, down], names=['up', 'down'])
+    limiter = resilient(sharding, mode='closed', sharding=sharding)
+    keys = {shard: next(f"rl:{{{i}}}:global" for i in range(1000)
+                        if sharding.shard(f"rl:{{{i}}}:global") is shard)
+            for shard in (up, down)}
+    down.down = True
+
+    for _ in range(3):
+        assert await limiter.allow(keys[down], capacity=5, rate=1.0) == (False, 0.0)
+    allowed, _ = await limiter.allow(keys[up], capacity=5, rate=1.0)
+
+    assert allowed and len(up.calls) == 1
+    assert [node.breaker.state for node in limiter.nodes] == [CLOSED, OPEN]
+    assert limiter.snapshot()['degraded'] == 1
+
+    down.down = False
+    await limiter._reconnect(limiter.nodes[1])
+    assert limiter.nodes[1].breaker.open_until != float('inf')
+    assert limiter.nodes[0].breaker.state == CLOSED
+
+
+async def test_heartbeat_counts_live_instances(redis_client):
+    policy = RedisFailureSettings()
+    first = ResilientRateLimiter(FlakyLimiter(), redis_client, policy, instance_id='a')
+    second = ResilientRateLimiter(FlakyLimiter(), redis_client, policy, instance_id='b')
+
+    await first._heartbeat()
+    await second._heartbeat()
+    await first._heartbeat()
+    assert (first.instances, second.instances) == (2, 2)
+
+    await second.close()
+    assert await redis_client.zrange(INSTANCES_KEY, 0, -1) == ['a']
@@ -0,0 +1,151 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from gateway.balancing import UpstreamPool
+from gateway.config import HedgePolicy, RetryPolicy, RouteRule, UpstreamTarget
+from gateway.retries import LatencyTracker, OnceBody, Retrier, RetryBudget
+
+
+def make_pool(**policy) -> UpstreamPool:
+    defaults = dict(backoff_base_ms=0, backoff_max_ms=0)
+    return UpstreamPool(RouteRule(prefix="/api",
+                                  upstreams=[UpstreamTarget(url="http://a"),
+                                             UpstreamTarget(url="http://b")],
+                                  retry=RetryPolicy(**{**defaults, **policy})))
+
+
+def failing(error: type[httpx.TransportError]) -> HTTPException:
+    exc = HTTPException(status_code=502, detail="failed")
+    exc.__cause__ = error("failed")
+    return exc
+
+
+def scripted(outcomes: dict[str, list], calls: list[str]):
+    """Attempt function answering each target from its list of responses/exceptions."""
+    async def attempt(target) -> httpx.Response:
+        calls.append(target.url)
+        outcome = outcomes[target.url].pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    return attempt
+
+
+async def test_connect_error_fails_over_to_other_target():
+    pool = make_pool()
+    calls = []
+    attempt = scripted({'http://a': [failing(httpx.ConnectError)],
+                        'http://b': [httpx.Response(200)]}, calls)
+
+    resp = await pool.retrier.send(pool, pool.targets[0], attempt, idempotent=False)
+
+    assert resp.status_code == 200
+    assert calls == ['http://a', 'http://b']
+    assert pool.retrier.stats.failovers == 1
+
+
+async def test_non_idempotent_request_not_retried_after_sending():
+    pool = make_pool()
+    calls = []
+    attempt = scripted({'http://a': [failing(httpx.ReadError)]}, calls)
+
+    with pytest.raises(HTTPException):
+        await pool.retrier.send(pool, pool.targets[0], attempt, idempotent=False)
+    assert calls == ['http://a']
+
+
+async def test_started_body_is_not_replayed():
+    async def chunks():
+        yield b'data'
+
+    pool = make_pool()
+    body = OnceBody(chunks())
+    [_ async for _ in body]
+    calls = []
+    attempt = scripted({'http://a': [failing(httpx.ReadError)]}, calls)
+
+    with pytest.raises(HTTPException):
+        await pool.retrier.send(pool, pool.targets[0], attempt, idempotent=True, body=body)
+    assert calls == ['http://a']
+
+
+async def test_retryable_status_retried_until_attempts_run_out():
+    pool = make_pool(attempts=3)
+    calls = []
+    attempt = scripted({'http://a': [httpx.Response(503), httpx.Response(503)],
+                        'http://b': [httpx.Response(503)]}, calls)
+
+    resp = await pool.retrier.send(pool, pool.targets[0], attempt, idempotent=True)
+
+    assert resp.status_code == 503
+    assert len(calls) == 3
+    assert pool.retrier.stats.retries == 2
+
+
+async def test_exhausted_budget_stops_retries():
+    pool = make_pool(budget_ratio=0, budget_min_per_second=0)
+    calls = []
+    attempt = scripted({'http://a': [failing(httpx.ConnectError)]}, calls)
+
+    with pytest.raises(HTTPException):
+        await pool.retrier.send(pool, pool.targets[0], attempt, idempotent=True)
+    assert pool.retrier.stats.budget_exhausted == 1
+
+
+async def test_hedge_wins_over_slow_attempt_and_cancels_it():
+    pool = make_pool(hedge=HedgePolicy(min_samples=1, min_delay_ms=0))
+    retrier: Retrier = pool.retrier
+    retrier.latencies.add(0.01)
+    cancelled = asyncio.Event()
+
+    async def attempt(target) -> httpx.Response:
+        if target.url == 'http://a':
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+        return httpx.Response(200, headers={'x-target': target.url})
+
+    resp = await retrier.send(pool, pool.targets[0], attempt, idempotent=True)
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+    assert resp.headers['x-target'] == 'http://b'
+    assert retrier.stats.hedges == retrier.stats.hedge_wins == 1
+
+
+def test_budget_allows_ratio_of_requests_plus_floor():
+    budget = RetryBudget(ratio=0.1, min_per_second=0)
+    for _ in range(100):
+        budget.deposit()
+
+    allowed = sum(budget.withdraw() for _ in range(20))
+
+    assert 9 <= allowed <= 10
+
+
+def test_latency_percentile_needs_min_samples():
+    tracker = LatencyTracker(0.95)
+    for ms in range(1, 101):
+        tracker.add(ms / 1000)
+
+    assert tracker.percentile(min_samples=200) is None
+    assert tracker.percentile(min_samples=100) == pytest.approx(0.096)
+
+
+def test_backoff_is_capped_full_jitter():
+    retrier = Retrier(RetryPolicy(backoff_base_ms=10, backoff_max_ms=30))
+
+    assert all(0 <= retrier.backoff(1) <= 0.01 for _ in range(50))
+    assert all(0 <= retrier.backoff(5) <= 0.03 for _ in range(50))
+
+
+def test_pick_prefers_untried_targets():
+    pool = make_pool()
+    a, b = pool.targets
+
+    assert {pool.pick(exclude=[a]).url for _ in range(10)} == {'http://b'}
+    assert pool.pick(exclude=[a, b]) in (a, b)
@@ -1,4 +1,4 @@
-from gateway.routing import find_upstream
+from gateway.routing import Router, find_upstream, get_router
 from gateway.config import RouteRule, settings
 
 
@@ -25,3 +25,55 @@ def test_find_upstream_not_found():
     upstream, suffix = find_upstream('/unknown')
     assert upstream is None
     assert suffix is None
+
+
+def test_find_upstream_respects_segment_boundaries():
+    upstream, suffix = find_upstream('/helloX')
+    assert upstream is None
+    assert suffix is None
+
+    upstream, suffix = find_upstream('/hello/world/')
+    assert upstream == 'http://a'
+    assert suffix == '/world/'
+
+
+def test_router_longest_prefix_wins():
+    router = Router([
+        RouteRule(prefix='/api', upstream='http://short'),
+        RouteRule(prefix='/api/users', upstream='http://long'),
+    ])
+
+    assert router.match('/api/users/7').rule.upstream == 'http://long'
+    assert router.match('/api/orders').rule.upstream == 'http://short'
+
+
+def test_router_path_parameters_and_wildcards():
+    router = Router([
+        RouteRule(prefix='/api/users/{user_id}/orders', upstream='http://orders'),
+        RouteRule(prefix='/api/users/me', upstream='http://me'),
+        RouteRule(prefix='/files/*/raw', upstream='http://files'),
+    ])
+
+    match = router.match('/api/users/42/orders/9')
+    assert match.rule.upstream == 'http://orders'
+    assert match.suffix == '/9'
+    assert match.params == {'user_id': '42'}
+
+    # literal segments win over parameters
+    assert router.match('/api/users/me').rule.upstream == 'http://me'
+
+    match = router.match('/files/abc/raw')
+    assert match.rule.upstream == 'http://files'
+    assert match.params == {}
+    assert router.match('/files/abc') is None
+
+
+def test_router_rebuilds_when_routes_replaced():
+    first = get_router()
+    assert get_router() is first
+
+    settings.routes = [RouteRule(prefix='/new', upstream='http://new')]
+
+    assert get_router() is not first
+    assert find_upstream('/new/x') == ('http://new', '/x')
+    assert find_upstream('/hello') == (None, None)
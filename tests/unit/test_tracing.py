@@ -0,0 +1,152 @@
+import asyncio
+import json
+import time
+
+from gateway.config import TracingSettings
+from gateway.profiling import Profiler, await_stack, collapsed
+from gateway.tracing import Trace, Tracer, current, otlp_json, parse_traceparent, record
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+
+def finished(tracer: Tracer, status: int = 200, seconds: float = 0.0) -> Trace:
+    trace = Trace()
+    trace.started -= seconds
+    tracer.finish(trace, status)
+    return trace
+
+
+def test_parse_traceparent_accepts_w3c_values():
+    assert parse_traceparent(f'00-{TRACE_ID}-{PARENT_ID}-01'.encode()) == (TRACE_ID, PARENT_ID, '01')
+    # Later versions may carry more fields
+    assert parse_traceparent(f'01-{TRACE_ID}-{PARENT_ID}-00-extra'.encode()) is not None
+
+
+def test_parse_traceparent_rejects_invalid_values():
+    for value in (f'ff-{TRACE_ID}-{PARENT_ID}-01',          # forbidden version
+                  f'00-{"0" * 32}-{PARENT_ID}-01',          # all-zero trace id
+                  f'00-{TRACE_ID}-{"0" * 16}-01',           # all-zero parent id
+                  f'00-{TRACE_ID.upper()}-{PARENT_ID}-01',  # upper-case hex
+                  f'00-{TRACE_ID}-{PARENT_ID}-01-extra',    # version 00 has four fields
+                  'garbage'):
+        assert parse_traceparent(value.encode()) is None
+
+
+def test_trace_joins_the_callers_trace():
+    trace = Trace.from_headers([(b'traceparent', f'00-{TRACE_ID}-{PARENT_ID}-01'.encode())])
+
+    assert trace.trace_id == TRACE_ID and trace.parent_id == PARENT_ID
+    assert trace.traceparent() == f'00-{TRACE_ID}-{trace.span_id}-01'.encode()
+    assert trace.span_id != PARENT_ID
+
+
+def test_trace_without_valid_traceparent_starts_a_new_one():
+    trace = Trace.from_headers([(b'traceparent', b'nonsense')])
+
+    assert len(trace.trace_id) == 32 and trace.parent_id is None
+
+
+def test_record_adds_spans_to_the_current_trace_only():
+    record('route_match', 0.0, 1.0)     # no trace: nothing to do
+    trace = Trace()
+    token = current.set(trace)
+    try:
+        record('rate_limit', 1.0, 2.0, allowed=True)
+    finally:
+        current.reset(token)
+
+    assert trace.spans == [('rate_limit', 1.0, 2.0, {'allowed': True})]
+
+
+def test_tail_sampling_keeps_slow_and_failed_requests_only():
+    tracer = Tracer(TracingSettings(slow_ms=100))
+
+    fast = finished(tracer)
+    slow = finished(tracer, seconds=0.2)
+    failed = finished(tracer, status=502)
+
+    assert list(tracer.recent) == [slow, failed]
+    assert fast not in tracer.recent
+    assert tracer.stats.kept == 2
+
+
+def test_ring_buffer_keeps_the_most_recent_traces():
+    tracer = Tracer(TracingSettings(slow_ms=0, buffer_size=2))
+
+    traces = [finished(tracer) for _ in range(3)]
+
+    assert list(tracer.recent) == traces[1:]
+
+
+def test_otlp_json_has_the_root_span_as_parent_of_stages():
+    trace = Trace(TRACE_ID, PARENT_ID)
+    trace.add('upstream', trace.started, trace.started + 0.01, {'status': 200})
+    trace.name = 'GET /hello'
+    Tracer(TracingSettings()).finish(trace, 200)
+
+    spans = otlp_json([trace], 'gw')['resourceSpans'][0]['scopeSpans'][0]['spans']
+
+    root, upstream = spans
+    assert root['parentSpanId'] == PARENT_ID and root['kind'] == 2
+    assert upstream['parentSpanId'] == root['spanId'] == trace.span_id
+    assert upstream['attributes'] == [{'key': 'status', 'value': {'intValue': '200'}}]
+    assert int(upstream['endTimeUnixNano']) - int(upstream['startTimeUnixNano']) == 10_000_000
+
+
+async def test_flush_appends_otlp_json_lines_to_the_export_file(tmp_path):
+    path = tmp_path / 'traces.jsonl'
+    tracer = Tracer(TracingSettings(slow_ms=0, export_file=str(path)))
+    finished(tracer)
+    finished(tracer)
+
+    await tracer.flush()
+    await tracer.flush()    # nothing new: nothing written
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 1
+    assert len(json.loads(lines[0])['resourceSpans'][0]['scopeSpans'][0]['spans']) == 2
+    assert tracer.stats.exported == 2
+
+
+async def test_profiler_samples_task_await_stacks_and_the_loop_thread():
+    async def parked():
+        await asyncio.sleep(10)
+
+    task = asyncio.ensure_future(parked())
+    await asyncio.sleep(0)
+
+    def busy() -> None:
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+
+    async def work():
+        await asyncio.sleep(0.01)
+        busy()
+
+    try:
+        stacks, _ = await asyncio.gather(Profiler().profile(0.1, 0.005), work())
+    finally:
+        task.cancel()
+
+    assert any(stack.startswith('test_tracing.py:parked') for stack in stacks['tasks'])
+    assert any(stack.endswith('test_tracing.py:busy') for stack in stacks['loop'])
+    assert 'tasks;test_tracing.py:parked' in collapsed(stacks)
+    assert await_stack(task).startswith('test_tracing.py:parked')
+
+
+async def test_profiler_walks_at_most_max_tasks_per_sample():
+    async def parked():
+        await asyncio.sleep(10)
+
+    tasks = [asyncio.ensure_future(parked()) for _ in range(20)]
+    await asyncio.sleep(0)
+    try:
+        stacks = await Profiler(task_interval=0.01, max_tasks=5).profile(0.05, 0.01)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    walks = 0.05 / 0.01
+    assert sum(stacks['tasks'].values()) <= 5 * (walks + 1)
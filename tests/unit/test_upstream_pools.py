@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from gateway.config import PoolSettings
+from gateway.pools import UpstreamClients, build_client, origin
+
+
+@pytest.fixture
+async def http_server():
+    """Minimal keep-alive HTTP/1.1 server on a random local port."""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while head := await reader.readuntil(b'\r\n\r\n'):
+                body = b'' if head.startswith(b'HEAD') else b'ok'
+                writer.write(b'HTTP/1.1 200 OK\r\ncontent-length: 2\r\n\r\n' + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    yield f'http://127.0.0.1:{port}'
+    server.close()
+
+
+def test_origin_normalizes_urls():
+    assert origin('http://users:8000/api/x?y=1') == 'http://users:8000'
+    assert origin('https://orders') == 'https://orders'
+
+
+async def test_build_client_applies_pool_settings():
+    client = build_client(PoolSettings(connect_timeout=1.5, read_timeout=7.0, pool_timeout=0.5))
+
+    assert client.timeout.connect == 1.5
+    assert client.timeout.read == 7.0
+    assert client.timeout.pool == 0.5
+    await client.aclose()
+
+
+async def test_unconfigured_origins_use_shared_client():
+    clients = UpstreamClients({'http://users:8000': PoolSettings()})
+
+    assert clients.get('http://users:8000') is clients.clients['http://users:8000']
+    assert clients.get('http://other:8000') is None
+    await clients.aclose()
+
+
+async def test_warm_up_opens_keepalive_connections(http_server):
+    clients = UpstreamClients({http_server: PoolSettings(warm_connections=3)})
+
+    await clients.warm_up()
+    stats = clients.snapshot()[http_server]
+
+    assert stats['connections'] == 3
+    assert stats['idle'] == 3
+    assert stats['requests'] == 3
+    assert stats['new_connections'] == 3
+
+    # A later request reuses a warm connection
+    await clients.get(http_server + '/x').get(http_server + '/x')
+    assert clients.snapshot()[http_server]['new_connections'] == 3
+    await clients.aclose()
+
+
+async def test_pool_stats_endpoint(gateway_client):
+    """Test: pool figures are served by the gateway itself, not proxied."""
+    resp = await gateway_client.get('/_gateway/pools')
+
+    assert resp.status_code == 200
+    assert resp.json() == {}